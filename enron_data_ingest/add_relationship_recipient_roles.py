@@ -0,0 +1,52 @@
+from social_signaling.db_access import DB
+
+# Adds the recipient role to the (message id, epoch secs) tuples of the directed
+# communication relationships in databases built before the roles were stored. The role is
+# the first of 'to', 'cc' and 'bcc' that lists the recipient of the relationship. With the
+# roles stored, DirectedCommRelationship counts direct and indirect messages without fetching
+# any messages. Works with both the legacy and the compact record encoding.
+
+# Number of relationships converted per round trip
+batch_size = 1000
+
+# Connect to the database
+print "Connecting to the database."
+db = DB.DB()
+db.startRedisServer()
+db.createRedisConnection()
+db.setMessageCacheSize(0)
+rdb = db.redisDB
+codec = db._codec()
+
+name = 'mids_per_directed_comm_relationship'
+keys = rdb.hkeys(name)
+rel_ids = codec.decodeRelationshipKeys(keys)
+for i in xrange(0,len(keys),batch_size):
+    batch = keys[i:i+batch_size]
+    tlists = codec.decodeRelationships(rdb.hmget(name,batch))
+
+    # Fetch the recipient lists of all of the messages in the batch at once
+    mids = list(set([tup[0] for tlist in tlists for tup in tlist]))
+    msgs = {}
+    for msg in db.getMessages(mids,['MessageID','TO','CC','BCC']):
+        msgs[msg['MessageID']] = msg
+
+    pipe = rdb.pipeline(transaction=False)
+    values = {}
+    for key, rel_id, tlist in zip(batch,rel_ids[i:i+batch_size],tlists):
+        recip = rel_id[1]
+        tlist_with_roles = []
+        for tup in tlist:
+            msg = msgs[tup[0]]
+            if recip in msg['TO']:
+                role = 'to'
+            elif recip in msg['CC']:
+                role = 'cc'
+            else:
+                role = 'bcc'
+            tlist_with_roles.append((tup[0],tup[1],role))
+        values[key] = codec.encodeRelationship(tlist_with_roles)
+    pipe.hmset(name,values)
+    pipe.execute()
+
+    print "%d of %d relationships converted." % (min(i+batch_size,len(keys)),len(keys))
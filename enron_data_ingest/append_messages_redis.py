@@ -0,0 +1,81 @@
+# import the modules
+import sys
+import time
+from itertools         import islice
+from social_signaling.db_access import DB
+from social_signaling.db_access.ingest_reader    import IngestReader, mysql_connector
+from social_signaling.db_access.redis_ingest     import CHECKPOINT_KEY, get_checkpoints, make_message, report
+from social_signaling.db_access.storage_backends import RedisBackend
+
+# Appends the messages added to the UC Berkeley MySQL database since the last ingest run to
+# the redis database, updating the relationship lists, the temporal extents and the
+# sorted_message_ids sorted set in place (see DB.addMessages). The messages whose key is
+# greater than the given message key are appended. If no key is given, the ingest
+# checkpoints of berkeley_enron_import_redis.py tell where the last run stopped, and they
+# are advanced as the messages are appended. --collapse-duplicates skips the messages whose
+# content is already held by another message, recording them in the content digest index
+# only.
+#
+# Usage: python append_messages_redis.py [<last loaded message key>] [--collapse-duplicates]
+
+# number of messages appended with each transaction
+batchSize = 500
+
+# create a connection to the redis database
+db = DB.DB()
+db.setStorageBackend(RedisBackend(host='localhost', port=6379, db=0))
+rdb = db.redisDB
+
+# find the last message key that was loaded
+args = [arg for arg in sys.argv[1:] if not arg.startswith('--')]
+collapseDuplicates = '--collapse-duplicates' in sys.argv
+checkpoints = get_checkpoints(rdb)
+partitions = []
+if checkpoints.has_key('num_partitions'):
+    partitions = ['partition:%d' % p for p in xrange(int(checkpoints['num_partitions']))]
+if len(args) > 0:
+    startAfter = int(args[0])
+elif len(partitions) > 0 and all(checkpoints.has_key(p) for p in partitions):
+
+    # messages of every partition with a key greater than the smallest checkpoint are
+    # streamed. those that were loaded already are skipped by DB.addMessages.
+    startAfter = min(int(checkpoints[p]) for p in partitions)
+else:
+    print "No ingest checkpoints found. Usage: python append_messages_redis.py [<last loaded message key>] " \
+          "[--collapse-duplicates]"
+    sys.exit(1)
+
+# create a streaming reader for the new messages in the UC Berkeley MySQL database
+UCBreader = IngestReader(mysql_connector(host='localhost',user='root',passwd='',db='berkeley_enron'),
+                         start_after=startAfter)
+
+# for each batch of new messages...
+print "Appending the messages after message key %d." % startAfter
+startTime = time.time()
+messages = UCBreader.keyed_messages()
+numMsgs = 0
+numAdded = 0
+while True:
+
+    batch = list(islice(messages,batchSize))
+    if not batch:
+        break
+
+    # normalize the messages and append them
+    numAdded += db.addMessages([make_message(msg,recips) for key, msg, recips in batch],collapse_duplicates=collapseDuplicates)
+    numMsgs += len(batch)
+
+    # advance the ingest checkpoints past the batch
+    lastKey = batch[-1][0]
+    pipe = rdb.pipeline(transaction=False)
+    for p in partitions:
+        if int(rdb.hget(CHECKPOINT_KEY,p)) < lastKey:
+            pipe.hset(CHECKPOINT_KEY,p,lastKey)
+    pipe.execute()
+
+    report(numMsgs,"messages",startTime)
+
+if numMsgs > 0:
+    print "Appended %d new messages. The last message key is %d." % (numAdded,lastKey)
+else:
+    print "There are no new messages."
@@ -0,0 +1,76 @@
+import cgi
+import random
+import time
+from calendar        import timegm
+from datetime        import datetime, timedelta
+from dateutil        import tz
+from dateutil.parser import parse
+from social_signaling.db_access.ingest_normalize import clear_caches, normalize_address, normalize_datetime
+
+# Compares the per-row cost of the original date and address normalization of the ingest
+# scripts, which reparses every date string and re-escapes every address, with the
+# memoized normalization of ingest_normalize on synthetic rows shaped like the UC Berkeley
+# database: a few hundred distinct timezone strings and a few thousand addresses recurring
+# across the rows. The tables of ingest_normalize are emptied before each pass, so the
+# times include filling them. The results of both are checked to be identical.
+
+random.seed(0)
+num_rows = 20000
+num_addresses = 5000
+num_timezones = 300
+recips_per_row = 3
+repeats = 3
+
+# Generate the synthetic rows of (date, timezone, sender, recipients)
+addresses = ['%s.%s@enron.com' % (random.choice(['john','jane','mark','kay','vince','ren\xe9e']),
+                                  ''.join(random.sample('abcdefghijklmnopqrstuvwxyz',8)))
+             for i in xrange(num_addresses)]
+timezones = ['%s%02d%02d (%s)' % (random.choice('+-'),random.randint(0,12),random.choice([0,30,45]),
+                                  ''.join(random.sample('ABCDEFGHIJKLMNOPQRSTUVWXYZ',3)))
+             for i in xrange(num_timezones)]
+start = datetime(1998,1,1)
+rows = [(start + timedelta(seconds=random.randint(0,4*365*86400)),random.choice(timezones),
+         random.choice(addresses),random.sample(addresses,recips_per_row))
+        for i in xrange(num_rows)]
+
+def original(rows):
+    """Normalizes the rows as the ingest scripts used to."""
+    result = []
+    for msg_dt, msg_tz, sender, recips in rows:
+        msg_dt = parse(msg_dt.strftime('%Y/%m/%d %H:%M:%S') + ' ' + msg_tz[:5]).astimezone(tz.tzoffset('',0))
+        msg_dt_secs = timegm(msg_dt.utctimetuple())
+        sender = cgi.escape(sender.decode('iso-8859-1')).encode('ascii','xmlcharrefreplace')
+        recips = [cgi.escape(r.decode('iso-8859-1')).encode('ascii','xmlcharrefreplace') for r in recips]
+        result.append((str(msg_dt),msg_dt_secs,sender,recips))
+    return result
+
+def memoized(rows):
+    """Normalizes the rows with ingest_normalize, starting from empty tables."""
+    clear_caches()
+    result = []
+    for msg_dt, msg_tz, sender, recips in rows:
+        msg_dt, msg_dt_secs = normalize_datetime(msg_dt,msg_tz)
+        sender = normalize_address(sender)
+        recips = [normalize_address(r) for r in recips]
+        result.append((str(msg_dt),msg_dt_secs,sender,recips))
+    return result
+
+def best_time(f):
+    """Returns the best wall clock time of repeated calls to f."""
+    times = []
+    for i in xrange(repeats):
+        start = time.time()
+        f()
+        times.append(time.time() - start)
+    return min(times)
+
+if original(rows) != memoized(rows):
+    raise Exception("The memoized normalization differs from the original one.")
+
+print "Date and address normalization (%d rows, %d addresses, %d timezones):" % \
+      (num_rows,num_addresses,num_timezones)
+original_time = best_time(lambda: original(rows))
+memoized_time = best_time(lambda: memoized(rows))
+for name, t in [('original',original_time),('memoized',memoized_time)]:
+    print "  %-9s %8.3f s   %8.2f us per row" % (name,t,t/num_rows*1e6)
+print "  speedup   %8.1fx" % (original_time/memoized_time)
@@ -0,0 +1,86 @@
+import simplejson
+import threading
+import time
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer   import ThreadingMixIn
+from social_signaling.db_access import neo4j_rest_client
+from social_signaling.db_access.neo4j_rest_client import GraphDatabase
+
+# Compares the request rate of the Neo4j REST client with one HTTP connection per request
+# (pool size 0, the behaviour before connection pooling) against the pooled keep-alive
+# connections, from one thread and from several threads. The requests go to a local
+# stand-in server that answers node GETs the way the Neo4j REST server does, so the
+# numbers reflect the client and connection overhead rather than the database.
+
+num_requests = 2000
+num_threads = 8
+pool_size = 8
+
+class StandInHandler(BaseHTTPRequestHandler):
+    """Answers the root document and node GETs with keep-alive HTTP/1.1 responses."""
+    protocol_version = 'HTTP/1.1'
+    
+    # Send each response with a single write, as a production server would
+    wbufsize = -1
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        base = 'http://%s:%d/db/data' % self.server.server_address
+        if self.path.rstrip('/') == '/db/data':
+            data = { 'node' : base + '/node', 'reference_node' : base + '/node/0',
+                     'index' : base + '/index', 'batch' : base + '/batch' }
+        else:
+            node = base + '/node/' + self.path.split('/')[-1]
+            data = { 'self' : node, 'data' : { 'address' : 'kenneth.lay@enron.com' },
+                     'property' : node + '/properties/{key}',
+                     'properties' : node + '/properties' }
+        content = simplejson.dumps(data)
+        self.send_response(200)
+        self.send_header('Content-Type','application/json')
+        self.send_header('Content-Length',str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+class StandInServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+server = StandInServer(('127.0.0.1',0),StandInHandler)
+thread = threading.Thread(target=server.serve_forever)
+thread.daemon = True
+thread.start()
+url = 'http://127.0.0.1:%d/db/data' % server.server_address[1]
+
+def fetch_nodes(graphdb,n):
+    """Fetches n nodes through the client."""
+    for i in xrange(n):
+        graphdb.node[i % 100]
+
+def run(label,size,threads):
+    """Prints the request rate for the given pool size and number of threads."""
+    neo4j_rest_client.configure_pool(size)
+    graphdb = GraphDatabase(url)
+    per_thread = num_requests / threads
+    workers = [threading.Thread(target=fetch_nodes,args=(graphdb,per_thread))
+               for i in xrange(threads)]
+    start = time.time()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.time() - start
+    print "%-40s %8.0f requests / sec" % (label,per_thread*threads/elapsed)
+
+print "%d node requests against %s" % (num_requests,url)
+run("No pooling, 1 thread:",0,1)
+run("Pool of %d, 1 thread:" % pool_size,pool_size,1)
+run("No pooling, %d threads:" % num_threads,0,num_threads)
+run("Pool of %d, %d threads:" % (pool_size,num_threads),pool_size,num_threads)
+
+# Close the pooled connections before stopping the server
+neo4j_rest_client.configure_pool()
+server.shutdown()
+server.server_close()
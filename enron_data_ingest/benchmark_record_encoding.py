@@ -0,0 +1,102 @@
+import gc
+import random
+import time
+from social_signaling.db_access.record_encoding import LegacyRecordCodec, CompactRecordCodec
+
+# Compares the legacy record encoding (marshal values and str(tuple) keys) with the compact
+# record encoding on synthetic records shaped like the Enron corpus. Reports the encoded
+# size and the encode/decode times of every record type the encodings differ on: messages,
+# message headers, directed communication relationship keys, relationship message lists
+# with and without recipient roles, temporal extents and message pair keys. Other values
+# are marshal blobs in both encodings. The compact codec uses in-memory dictionaries, so no
+# database is needed.
+
+random.seed(0)
+num_messages = 20000
+num_addresses = 5000
+num_relationships = 20000
+num_extents = 2000
+repeats = 5
+
+legacy = LegacyRecordCodec()
+compact = CompactRecordCodec()
+
+# Generate the synthetic data
+addresses = ['%s.%s@enron.com' % (random.choice(['john','jane','mark','kay','vince']),
+                                  ''.join(random.sample('abcdefghijklmnopqrstuvwxyz',8)))
+             for i in xrange(num_addresses)]
+mids = ['<%d.%d.JavaMail.evans@thyme>' % (random.randint(10**6,10**7),i) for i in xrange(num_messages)]
+words = ['gas','power','deal','meeting','contract','price','schedule','update','report','call']
+msgs = []
+for mid in mids:
+    epoch_secs = random.randint(900000000,1010000000)
+    body = ' '.join([random.choice(words) for i in xrange(random.randint(20,400))])
+    msgs.append({ 'message_id' : mid, 'datetime' : '2001-05-14 16:39:00+00:00',
+                  'epoch_secs' : epoch_secs, 'subject' : 'RE: ' + ' '.join(random.sample(words,3)),
+                  'body' : body, 'sender' : random.choice(addresses),
+                  'to' : random.sample(addresses,random.randint(1,4)),
+                  'cc' : random.sample(addresses,random.randint(0,3)), 'bcc' : [] })
+headers = []
+for msg in msgs:
+    header = msg.copy()
+    del header['body']
+    headers.append(header)
+rel_ids = [tuple(random.sample(addresses,2)) for i in xrange(num_relationships)]
+tlists = []
+for i in xrange(num_relationships):
+    tlist = [(random.choice(mids),random.randint(900000000,1010000000))
+             for j in xrange(random.randint(1,40))]
+    tlist.sort(key=lambda tup: tup[1])
+    tlists.append(tlist)
+role_tlists = [[tup + (random.choice(['to','to','cc','bcc']),) for tup in tlist] for tlist in tlists]
+extents = []
+for i in xrange(num_extents):
+    extent = set()
+    for address in random.sample(addresses,random.randint(1,60)):
+        secs = sorted([random.randint(900000000,1010000000) for j in xrange(2)])
+        extent.add((address,tuple(secs)))
+    extents.append(extent)
+mid_pairs = [random.sample(mids,2) for i in xrange(num_relationships)]
+
+def best_time(f):
+    """Returns the best wall clock time of repeated calls to f. The garbage collector stays
+    enabled, but garbage left by the previous calls is collected before each call."""
+    times = []
+    for i in xrange(repeats):
+        gc.collect()
+        start = time.time()
+        f()
+        times.append(time.time() - start)
+    return min(times)
+
+def report(label,encode,decode):
+    """Prints the encoded size and the encode/decode times for both codecs."""
+    print label
+    for name, codec in [('legacy',legacy),('compact',compact)]:
+        encoded = encode(codec)
+        size = sum([len(s) for s in encoded])
+        encode_time = best_time(lambda: encode(codec))
+        decode_time = best_time(lambda: decode(codec,encoded))
+        print "  %-8s %12d bytes   encode %8.3f s   decode %8.3f s" % (name,size,encode_time,decode_time)
+
+report("Messages (%d):" % num_messages,
+       lambda codec: codec.encodeMessages(msgs),
+       lambda codec, encoded: codec.decodeMessages(encoded,mids))
+report("Message headers (%d):" % num_messages,
+       lambda codec: codec.encodeMessages(headers),
+       lambda codec, encoded: codec.decodeMessages(encoded,mids))
+report("Relationship keys (%d):" % num_relationships,
+       lambda codec: codec.encodeRelationshipKeys(rel_ids,True),
+       lambda codec, encoded: codec.decodeRelationshipKeys(encoded))
+report("Relationship message lists (%d):" % num_relationships,
+       lambda codec: [codec.encodeRelationship(tlist) for tlist in tlists],
+       lambda codec, encoded: codec.decodeRelationships(encoded))
+report("Relationship message lists with roles (%d):" % num_relationships,
+       lambda codec: [codec.encodeRelationship(tlist) for tlist in role_tlists],
+       lambda codec, encoded: codec.decodeRelationships(encoded))
+report("Temporal extents (%d):" % num_extents,
+       lambda codec: [codec.encodeExtents(extent) for extent in extents],
+       lambda codec, encoded: [codec.decodeExtents(s) for s in encoded])
+report("Message pair keys (%d):" % num_relationships,
+       lambda codec: codec.encodeMessagePairKeys(mid_pairs,True),
+       lambda codec, encoded: codec.decodeMessagePairKeys(encoded))
@@ -1,197 +1,209 @@
 # import the modules
-import cgi
 import marshal
-import MySQLdb
 import pymongo
-from calendar          import timegm
-from dateutil          import tz
+import sys
 from dateutil.parser   import parse
-
-# create a connection to the MySQL databases
-ucb_db = MySQLdb.connect(host='localhost',user='root',passwd='root',db='berkeley_enron')
-isi_db = MySQLdb.connect(host='localhost',user='root',passwd='root',db='isi_enron')
+from social_signaling.db_access.ingest_normalize import normalize_address, normalize_datetime
+from social_signaling.db_access.ingest_reader    import IngestReader, mysql_connector
+from social_signaling.db_access.mail_reader      import MailReader
+
+# Usage: python berkeley_enron_import_mongo.py [--mail <path>] [--restart]
+#
+# --mail reads the messages from the mbox or maildir files under path instead of the UC
+# Berkeley MySQL database (see mail_reader.py).
+#
+# An interrupted run is resumed from its checkpoints in the ingest_checkpoints collection:
+# the completed stages are skipped and the messages are streamed from the one after the
+# last message key of the last inserted batch. --restart drops the database and starts
+# over instead.
+
+# helper function returning the checkpoint dictionary of the current ingest run, which is
+# empty if no run has started
+def get_checkpoints(mdb):
+    return dict([(doc['_id'],doc['value']) for doc in mdb.ingest_checkpoints.find()])
+
+# helper function setting a checkpoint of the current ingest run
+def set_checkpoint(mdb,name,value):
+    mdb.ingest_checkpoints.update({'_id' : name},{'_id' : name, 'value' : value},upsert=True)
+
+# helper function returning True if the stage is marked as completed
+def is_stage_done(checkpoints,stage):
+    return checkpoints.get('stage:' + stage) == 'done'
 
 # create a connection to the mongo database
 mongo_connection = pymongo.Connection()
-
-# drop the previous enron db
-mongo_connection.drop_database('enron_db')
-
-# create a new database
 mdb = mongo_connection.enron_db
 
-# fetch message information from the UC Berkeley MySQL database
-print "Pulling message data from the UC Berkeley MySQL database."
-cursor = ucb_db.cursor()
-cursor.execute("select t2.email, t1.date, t1.timezone, t1.smtpid, t1.subject, t1.body from msgs as t1, addresses as t2 where t1.eid = t2.eid;")
-results = cursor.fetchall()
-
-# fetch email addresses corresponding to the 151 email inboxes that make up the dataset
-print "Pulling email address data from the USC/ISI MySQL database."
-cursor = isi_db.cursor()
-cursor.execute("select Email_id as email from employeelist;")
-address_tuples = cursor.fetchall()
-fully_observed_addresses = [e[0] for e in address_tuples]
-
-# find and modify the specific address that appears to be incorrectly represented in the ISI database
-for i in range(len(fully_observed_addresses)):
-    if fully_observed_addresses[i] == 'paul.y barbo@enron.com':
-        break
-fully_observed_addresses[i] = "paul.y'barbo@enron.com"
-
-# add the set of fully observed addresses to the mongo database
-foa = mdb.fully_observed_addresses
-for address in fully_observed_addresses:
-    foa.insert({'address' : address})
-    
-# for each message...
-print "Constructing the corpus dictionary."
-corpus_dict = {}
-num_msgs = len(results)
-for i in xrange(num_msgs):
-
-    # get the message
-    msg = results[i]
-
-    # get the message datetime
-    msg_dt = msg[1]
-
-    # get the message timezone
-    msg_tz = msg[2]
-
-    if msg_dt != None:
-
-        # create new datetime object with time normalized to UTC
-        msg_dt = parse(msg_dt.strftime('%Y/%m/%d %H:%M:%S') + ' ' + msg_tz[:5]).astimezone(tz.tzoffset('',0))
-        
-        # convert the datetime into seconds since the epoch
-        msg_dt_secs = timegm(msg_dt.utctimetuple())
-
-    else:
-
-        # seconds since the epoch
-        msg_dt_secs = 0
-
-    # get the message ID
-    msg_id = msg[3]
-
-    # get the message subject
-    msg_subj = msg[4]
-
-    # get the message body
-    msg_body = msg[5]
-
-    # get the message sender's email address
-    sender = msg[0]
-
-    # decode the address from ISO-8859-1 and encode in ASCII preserving extended characters
-    sender = cgi.escape(sender.decode('iso-8859-1')).encode('ascii','xmlcharrefreplace')
-
-    # create a message dictionary
-    m_dict = { 'message_id' : msg_id, 'datetime' : msg_dt, 'epoch_secs' : msg_dt_secs, 
-               'subject' : msg_subj, 'body' : msg_body, 'sender' : sender, 'to' : [],
-               'cc' : [], 'bcc' : [] }
-
-    # add to the corpus dictionary
-    corpus_dict[msg_id] = m_dict
-
-    if (i+1) % 500 == 0:
-        print "%d messages processed." % (i+1)
-
-# fetch recipient information from the MySQL database
-print "Pulling recipient data from the MySQL database."
-cursor = ucb_db.cursor()
-cursor.execute("select t1.smtpid, t2.reciptype, t2.reciporder, t3.email from msgs as t1, recip_info as t2, addresses as t3 where t1.mid = t2.mid and t2.eid = t3.eid;")
-results = cursor.fetchall()
-
-# for each recipient...
-print "Inserting the recipient data into the corpus dictionary."
-num_recips = len(results)
-for i in xrange(num_recips):
-
-    # get the recipient information
-    recip = results[i]
-
-    # get the message ID
-    msg_id = recip[0]
-
-    # get the recipient type
-    recip_type = recip[1]
-
-    # get the recipient order
-    recip_order = int(recip[2])
-
-    # get the recipient email address
-    recip_email = recip[3]
-    
-    # decode the address from ISO-8859-1 and encode in ASCII preserving extended characters
-    recip_email = cgi.escape(recip_email.decode('iso-8859-1')).encode('ascii','xmlcharrefreplace')
-
-    # fetch message dictionary 
-    m_dict = corpus_dict[msg_id]
-
-    # add recipient information to the message
-    r_tup = (recip_email,recip_order)
-    if m_dict.has_key(recip_type):
-        m_dict[recip_type].append(r_tup)
-    else:
-        m_dict[recip_type] = [r_tup]
-
-    # save message dictionary
-    corpus_dict[msg_id] = m_dict
-
-    if (i+1) % 5000 == 0:
-        print "%d recipients processed." % (i+1)
-
-# generate ordered lists for the message recipients
-print "Ordering the message recipients in the corpus dictionary."
-i = 0
-for msg_id in corpus_dict.keys():
-
-    m_dict = corpus_dict[msg_id]
-
-    # sort the recipients by their position info and reduce the lists down to the addresses
-    # only, now in the proper order
-    fields = ['to','cc','bcc']
-    for field in fields:
-        m_dict[field].sort(key=lambda tup: tup[1])
-        m_dict[field] = [tup[0] for tup in m_dict[field]]
-
-    # save message dictionary
-    corpus_dict[msg_id] = m_dict
+# resume the previous run if it was interrupted. otherwise drop the previous enron db.
+checkpoints = get_checkpoints(mdb)
+if checkpoints and not is_stage_done(checkpoints,'complete') and '--restart' not in sys.argv:
+    print "Resuming the interrupted ingest run from its checkpoints."
+else:
+    mongo_connection.drop_database('enron_db')
+    mdb = mongo_connection.enron_db
+    checkpoints = {}
+
+# the key of the last message inserted before the interruption, or None
+start_after = checkpoints.get('last_message_key')
+
+# create a streaming reader for the mail files or for the UC Berkeley MySQL database
+mail_path = None
+if '--mail' in sys.argv:
+    mail_path = sys.argv[sys.argv.index('--mail')+1]
+    ucb_reader = MailReader(mail_path,start_after=start_after)
+else:
+    ucb_reader = IngestReader(mysql_connector(host='localhost',user='root',passwd='root',db='berkeley_enron'),
+                              start_after=start_after)
+
+# when reading mail files, there are no fully observed addresses or manager-subordinate
+# relationships to load
+if mail_path == None and not is_stage_done(checkpoints,'fully_observed_addresses'):
+
+    # fetch email addresses corresponding to the 151 email inboxes that make up the dataset
+    print "Pulling email address data from the USC/ISI MySQL database."
+    import MySQLdb
+    isi_db = MySQLdb.connect(host='localhost',user='root',passwd='root',db='isi_enron')
+    cursor = isi_db.cursor()
+    cursor.execute("select Email_id as email from employeelist;")
+    address_tuples = cursor.fetchall()
+    fully_observed_addresses = [e[0] for e in address_tuples]
+
+    # find and modify the specific address that appears to be incorrectly represented in the ISI database
+    for i in range(len(fully_observed_addresses)):
+        if fully_observed_addresses[i] == 'paul.y barbo@enron.com':
+            break
+    fully_observed_addresses[i] = "paul.y'barbo@enron.com"
+
+    # add the set of fully observed addresses to the mongo database, replacing a partial
+    # set from the interrupted run
+    foa = mdb.fully_observed_addresses
+    foa.remove()
+    for address in fully_observed_addresses:
+        foa.insert({'address' : address})
+    set_checkpoint(mdb,'stage:fully_observed_addresses','done')
+
+# message batch size - number of messages to insert into mongo with each request
+msg_batch_size = 500
+
+# for each message along with its recipients, streamed from the mail files or the UC
+# Berkeley MySQL database...
+if not is_stage_done(checkpoints,'messages'):
+    print "Streaming the message and recipient data into MongoDB."
+    messages = mdb.messages
+
+    # a batch inserted after the last checkpoint is inserted again, so remove it first
+    if start_after != None:
+        messages.remove({'message_key' : {'$gt' : start_after}})
+    m_dicts = []
+    i = 0
+    for key, msg, recips in ucb_reader.keyed_messages():
+
+        # get the message datetime
+        msg_dt = msg[1]
+
+        # get the message timezone
+        msg_tz = msg[2]
+
+        if msg_dt != None:
+
+            # normalize the datetime to UTC and convert it into seconds since the epoch
+            msg_dt, msg_dt_secs = normalize_datetime(msg_dt,msg_tz)
+
+        else:
+
+            # seconds since the epoch
+            msg_dt_secs = 0
+
+        # get the message ID
+        msg_id = msg[3]
+
+        # get the message subject
+        msg_subj = msg[4]
+
+        # get the message body
+        msg_body = msg[5]
+
+        # get the message sender's email address
+        sender = msg[0]
+
+        # decode the address from ISO-8859-1 and encode in ASCII preserving extended characters
+        sender = normalize_address(sender)
+
+        # create a message dictionary. the message key locates the message in the stream for
+        # the checkpoints.
+        m_dict = { 'message_id' : msg_id, 'datetime' : msg_dt, 'epoch_secs' : msg_dt_secs, 
+                   'subject' : msg_subj, 'body' : msg_body, 'sender' : sender, 'to' : [],
+                   'cc' : [], 'bcc' : [], 'message_key' : key }
+
+        # for each recipient...
+        for recip in recips:
+
+            # get the recipient type
+            recip_type = recip[1]
+
+            # get the recipient order
+            recip_order = int(recip[2])
+
+            # get the recipient email address
+            recip_email = recip[3]
     
-    i += 1
-    if i % 500 == 0:
-        print "%d messages processed." % i
-
-# push the message data to mongo
-print "Pushing the message data into MongoDB."
-i = 0
-messages = mdb.messages
-for m_dict in corpus_dict.values():
-    messages.insert(m_dict)
-    i += 1
-    if i % 500 == 0:
-        print "%d messages processed." % i
-
-# fetch manager-subordinate relationship information from the MySQL database
-print "Pulling manager-subordinate relationship information from the MySQL database."
-cursor = ucb_db.cursor()
-cursor.execute("select * from sub_mgr_pairs_in_collection;")
-results = cursor.fetchall()
-
-# for each relationship pair
-print "Adding manager-subordinate relationships to MongoDB."
-social_relationships = mdb.social_relationships
-rel_dicts = []
-for rpair in results:
-
-   # create the relationship in mongo
-   rel_dict = { 'source' : rpair[0], 'type' : 'directly reported to', 'target' : rpair[1], 'evidence_type' : 'interval',
-                'start_time' : parse('2000-01-01 00:00:00 +00:00'), 'end_time' : parse('2001-11-30 23:59:59 +00:00'),
-                'provenance' : 'http://tinyurl.com/cfsooc' }
-   rel_dicts.append(rel_dict)
+            # decode the address from ISO-8859-1 and encode in ASCII preserving extended characters
+            recip_email = normalize_address(recip_email)
+
+            # add recipient information to the message
+            r_tup = (recip_email,recip_order)
+            if m_dict.has_key(recip_type):
+                m_dict[recip_type].append(r_tup)
+            else:
+                m_dict[recip_type] = [r_tup]
+
+        # sort the recipients by their position info and reduce the lists down to the addresses
+        # only, now in the proper order
+        fields = ['to','cc','bcc']
+        for field in fields:
+            m_dict[field].sort(key=lambda tup: tup[1])
+            m_dict[field] = [tup[0] for tup in m_dict[field]]
+
+        # push the batch of message dictionaries to mongo when it is full, followed by the
+        # checkpoint of its last message key
+        m_dicts.append(m_dict)
+        if len(m_dicts) == msg_batch_size:
+            messages.insert(m_dicts)
+            set_checkpoint(mdb,'last_message_key',key)
+            m_dicts = []
+
+        i += 1
+        if i % 500 == 0:
+            print "%d messages processed." % i
+
+    # push the last batch of message dictionaries to mongo
+    if m_dicts:
+        messages.insert(m_dicts)
+        set_checkpoint(mdb,'last_message_key',key)
+    print "%d messages processed." % i
+    set_checkpoint(mdb,'stage:messages','done')
+
+if mail_path == None and not is_stage_done(checkpoints,'social_relationships'):
+
+    # fetch manager-subordinate relationship information from the MySQL database
+    print "Pulling manager-subordinate relationship information from the MySQL database."
+    results = list(ucb_reader.rows("select * from sub_mgr_pairs_in_collection;"))
+
+    # for each relationship pair
+    print "Adding manager-subordinate relationships to MongoDB."
+    social_relationships = mdb.social_relationships
+    rel_dicts = []
+    for rpair in results:
+
+       # create the relationship in mongo
+       rel_dict = { 'source' : rpair[0], 'type' : 'directly reported to', 'target' : rpair[1], 'evidence_type' : 'interval',
+                    'start_time' : parse('2000-01-01 00:00:00 +00:00'), 'end_time' : parse('2001-11-30 23:59:59 +00:00'),
+                    'provenance' : 'http://tinyurl.com/cfsooc' }
+       rel_dicts.append(rel_dict)
    
-# push the relationship data into mongo   
-social_relationships.insert(rel_dicts)
+    # push the relationship data into mongo, replacing a partial set from the interrupted run
+    social_relationships.remove()
+    social_relationships.insert(rel_dicts)
+    set_checkpoint(mdb,'stage:social_relationships','done')
 
+set_checkpoint(mdb,'stage:complete','done')
@@ -1,15 +1,22 @@
 # import the modules
-import cgi
 import neo4j
-import MySQLdb
+import sys
 from neo4j.util      import Subreference
-from calendar        import timegm
-from dateutil        import tz
-from dateutil.parser import parse
-
-# create a connection to the MySQL databases
-UCBdb = MySQLdb.connect(host='localhost',user='root',passwd='',db='berkeley_enron')
-ISIdb = MySQLdb.connect(host='localhost',user='root',passwd='',db='isi_enron')
+from itertools       import islice
+from social_signaling.db_access.ingest_normalize import normalize_address, normalize_datetime
+from social_signaling.db_access.ingest_reader    import IngestReader, mysql_connector
+from social_signaling.db_access.mail_reader      import MailReader
+
+# Usage: python berkeley_enron_import_neo4j_py.py [--mail <path>] [--restart]
+#
+# --mail reads the messages from the mbox or maildir files under path instead of the UC
+# Berkeley MySQL database (see mail_reader.py). None of the addresses are fully observed
+# then.
+#
+# An interrupted run is resumed from its checkpoint on the reference node, which is
+# updated in the transaction of each message batch: the messages are streamed from the
+# one after the last message key of the last committed batch. --restart ignores the
+# checkpoint and starts over instead, so it should be given an empty database.
 
 # create a connection to the neo4j database
 graphdb = neo4j.GraphDatabase("/Users/diehl4/neodb/UCB_Enron_v2")
@@ -18,45 +25,91 @@ with graphdb.transaction:
     # create index for email address nodes
     addIdx = graphdb.index("address", create=True)
 
-# fetch message information from the UC Berkeley MySQL database
-print "Pulling message data from the UC Berkeley MySQL database."
-cursor = UCBdb.cursor()
-cursor.execute("select t2.email, t1.date, t1.timezone, t1.smtpid, t1.subject, t1.body from msgs as t1, addresses as t2 where t1.eid = t2.eid;")
-results = cursor.fetchall()
-
-# fetch email addresses corresponding to the 151 email inboxes that make up the dataset
-print "Pulling email address data from the USC/ISI MySQL database."
-cursor = ISIdb.cursor()
-cursor.execute("select Email_id as email from employeelist;")
-addressTuples = cursor.fetchall()
-fullyObservedAddresses = [e[0] for e in addressTuples]
-
-# find and modify the specific address that appears to be incorrectly represented in the ISI database
-for i in range(len(fullyObservedAddresses)):
-    if fullyObservedAddresses[i] == 'paul.y barbo@enron.com':
-        break
-fullyObservedAddresses[i] = "paul.y'barbo@enron.com"
-
-# create dictionary to map email IDs to message nodes
-msgNodeDict = {}
-
-# message batch size - number of messages to process for each graph database transaction
+    # resume the previous run if it was interrupted
+    checkpointNode = graphdb.reference_node
+    startAfter = None
+    try:
+        if not checkpointNode['ingestComplete'] and '--restart' not in sys.argv:
+            startAfter = checkpointNode['ingestLastMessageKey']
+            print "Resuming the interrupted ingest run from its checkpoint."
+    except KeyError:
+        pass
+    checkpointNode['ingestComplete'] = False
+    if startAfter == None:
+        checkpointNode['ingestLastMessageKey'] = 0
+
+# create a streaming reader for the mail files or for the UC Berkeley MySQL database
+mailPath = None
+if '--mail' in sys.argv:
+    mailPath = sys.argv[sys.argv.index('--mail')+1]
+    UCBreader = MailReader(mailPath,start_after=startAfter)
+else:
+    UCBreader = IngestReader(mysql_connector(host='localhost',user='root',passwd='',db='berkeley_enron'),
+                             start_after=startAfter)
+
+if mailPath == None:
+
+    # fetch email addresses corresponding to the 151 email inboxes that make up the dataset
+    print "Pulling email address data from the USC/ISI MySQL database."
+    import MySQLdb
+    ISIdb = MySQLdb.connect(host='localhost',user='root',passwd='',db='isi_enron')
+    cursor = ISIdb.cursor()
+    cursor.execute("select Email_id as email from employeelist;")
+    addressTuples = cursor.fetchall()
+    fullyObservedAddresses = [e[0] for e in addressTuples]
+
+    # find and modify the specific address that appears to be incorrectly represented in the ISI database
+    for i in range(len(fullyObservedAddresses)):
+        if fullyObservedAddresses[i] == 'paul.y barbo@enron.com':
+            break
+    fullyObservedAddresses[i] = "paul.y'barbo@enron.com"
+else:
+    fullyObservedAddresses = []
+
+# helper function returning the email address node for the given address, creating it
+# if it does not exist yet
+def get_address_node(address):
+
+    # check to see if an email address node exists for this address
+    e = addIdx[address]
+    if e is None:
+
+        # check to see if this address is fully observed
+        fO = (address in fullyObservedAddresses)
+
+        # if not, create a new email address node
+        e = graphdb.node(address=address, fullyObserved=fO, type="Email Address")
+
+        # add the node to the index
+        addIdx[address] = e
+
+    return e
+
+# message batch size - number of messages, along with their recipients, to process for
+# each graph database transaction
 msgBatchSize = 500
 
-# number of batches
-numBatches = len(results) / msgBatchSize + 1
+# the messages along with their recipients, streamed from the mail files or the UC
+# Berkeley MySQL database
+if mailPath != None:
+    print "Streaming message and recipient data from %s." % mailPath
+else:
+    print "Streaming message and recipient data from the UC Berkeley MySQL database."
+messages = UCBreader.keyed_messages()
+numMsgs = 0
+numRecips = 0
 
 # for each batch...
-i = 0
-for b in range(numBatches):
+while True:
+
+    msgBatch = list(islice(messages,msgBatchSize))
+    if not msgBatch:
+        break
 
     with graphdb.transaction:
 
         # for each message in the batch...
-        for m in range(msgBatchSize):
-
-            # get the message
-            msg = results[i]
+        for key, msg, recips in msgBatch:
 
             # get the message datetime
             msgDT = msg[1]
@@ -75,11 +128,8 @@ for b in range(numBatches):
             
             if msgDT != None:
 
-                # create new datetime object with time normalized to UTC
-                msgDT = parse(msgDT.strftime('%Y/%m/%d %H:%M:%S') + ' ' + msgTZ[:5]).astimezone(tz.tzoffset('',0))
-
-                # convert the datetime into seconds since the epoch
-                msgDTsecs = timegm(msgDT.utctimetuple())
+                # normalize the datetime to UTC and convert it into seconds since the epoch
+                msgDT, msgDTsecs = normalize_datetime(msgDT,msgTZ)
 
                 # create new message node - assume there are no duplicate messages in the collection
                 # so no need to check for matching nodes that already exist.
@@ -96,104 +146,44 @@ for b in range(numBatches):
                                  minute=0, second=0, epochSecs=0, subject=msgSubj, 
                                  body=msgBody, emailID = msgID, type="Message")
 
-            # add message node to the dictionary
-            msgNodeDict[msgID] = m
-
             # get the message sender's email address
             sender = msg[0]
 
             # decode the address from ISO-8859-1 and encode in ASCII preserving extended characters
-            sender = cgi.escape(sender.decode('iso-8859-1')).encode('ascii','xmlcharrefreplace')
-
-            # check to see if an email address node exists for this address
-            e = addIdx[sender]
-            if e is None:
-
-                # check to see if this address is fully observed
-                fO = (sender in fullyObservedAddresses)
-
-                # if not, create a new email address node
-                e = graphdb.node(address=sender, fullyObserved=fO, type="Email Address")
-
-                # add the node to the index
-                addIdx[sender] = e
-
-            # create a link from the new email address node to the new message node
-            e.SENT(m)
-
-            i += 1
-
-            # check to see if we are at the end of the results list and need to stop iterating
-            if i == len(results):
-                break
+            sender = normalize_address(sender)
 
-    print "%d messages processed." % i
+            # create a link from the email address node to the new message node
+            get_address_node(sender).SENT(m)
 
-# fetch recipient information from the MySQL database
-print "Pulling recipient data from the MySQL database."
-cursor = UCBdb.cursor()
-cursor.execute("select t1.smtpid, t2.reciptype, t2.reciporder, t3.email from msgs as t1, recip_info as t2, addresses as t3 where t1.mid = t2.mid and t2.eid = t3.eid;")
-results = cursor.fetchall()
+            # for each recipient of the message...
+            for recip in recips:
 
-# recipient batch size - number of recipients to process for each graph database transaction
-recipBatchSize = 10000
+                # get the recipient type
+                recipType = recip[1]
 
-# number of batches
-numBatches = len(results) / recipBatchSize + 1
+                # get the recipient order
+                recipOrder = int(recip[2])
 
-# for each batch...
-i = 0
-for b in range(numBatches):
-
-    with graphdb.transaction:
-
-        # for each recipient in the batch...
-        for r in range(recipBatchSize):
-
-            # get the recipient information
-            recip = results[i]
-
-            # get the message ID
-            msgID = recip[0]
-
-            # get the recipient type
-            recipType = recip[1]
-
-            # get the recipient order
-            recipOrder = int(recip[2])
-
-            # get the recipient email address
-            recipEmail = recip[3]
+                # get the recipient email address
+                recipEmail = recip[3]
     
-            # decode the address from ISO-8859-1 and encode in ASCII preserving extended characters
-            recipEmail = cgi.escape(recipEmail.decode('iso-8859-1')).encode('ascii','xmlcharrefreplace')
-
-            # check to see if an email address node exists for this address
-            e = addIdx[recipEmail]
-            if e is None:
+                # decode the address from ISO-8859-1 and encode in ASCII preserving extended characters
+                recipEmail = normalize_address(recipEmail)
 
-                # check to see if this address is fully observed
-                fO = (recipEmail in fullyObservedAddresses)
+                # create a link from the message node to the email address node
+                m.RECEIVED_BY(get_address_node(recipEmail),type=recipType,order=recipOrder)
 
-                # if not, create a new email address node
-                e = graphdb.node(address=recipEmail, fullyObserved=fO, type="Email Address")
+            numRecips += len(recips)
 
-                # add the node to the index
-                addIdx[recipEmail] = e
+        # commit the checkpoint of the last message key along with the batch
+        checkpointNode['ingestLastMessageKey'] = key
 
-            # retrieve the message node
-            m = msgNodeDict[msgID]
+    numMsgs += len(msgBatch)
+    print "%d messages and %d recipients processed." % (numMsgs,numRecips)
 
-            # create a link from the message node to the email address node
-            m.RECEIVED_BY(e,type=recipType,order=recipOrder)
-
-            i += 1
-
-            # check to see if we are at the end of the results list and need to stop iterating
-            if i == len(results):
-                break
-
-    print "%d recipients processed." % i
+# mark the ingest run as completed
+with graphdb.transaction:
+    checkpointNode['ingestComplete'] = True
 
 # close connection to the graph database
 graphdb.shutdown()
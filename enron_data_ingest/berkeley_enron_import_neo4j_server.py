@@ -1,15 +1,22 @@
 # import the modules
-import cgi
-import MySQLdb
 import redis
-from calendar          import timegm
-from dateutil          import tz
-from dateutil.parser   import parse
+import sys
+from itertools         import islice
+from social_signaling.db_access.ingest_normalize import normalize_address, normalize_datetime
+from social_signaling.db_access.ingest_reader    import IngestReader, mysql_connector
+from social_signaling.db_access.mail_reader      import MailReader
 from social_signaling.db_access.neo4j_rest_client import GraphDatabase
 
-# create a connection to the MySQL databases
-UCBdb = MySQLdb.connect(host='localhost',user='root',passwd='',db='berkeley_enron')
-ISIdb = MySQLdb.connect(host='localhost',user='root',passwd='',db='isi_enron')
+# Usage: python berkeley_enron_import_neo4j_server.py [--mail <path>] [--restart]
+#
+# --mail reads the messages from the mbox or maildir files under path instead of the UC
+# Berkeley MySQL database (see mail_reader.py). None of the addresses are fully observed
+# then and no manager-subordinate relationships are added.
+#
+# An interrupted run is resumed from its checkpoints in the neo4j_ingest_checkpoints redis
+# hash: the messages are streamed from the one after the last message key of the last
+# submitted batch. --restart deletes the redis indexes and starts over instead, so the
+# neo4j database should be emptied first.
 
 # create a connection to the neo4j database
 graphdb = GraphDatabase("http://localhost:7474/db/data")
@@ -17,44 +24,111 @@ graphdb = GraphDatabase("http://localhost:7474/db/data")
 # create a connection to the redis database
 rdb = redis.Redis(host='localhost', port=6379, db=0)
 
-# delete previous keys if they exist
-rdb.delete('neo4j_message_node_index','neo4j_address_node_index',
-           'neo4j_fully_observed_address_nodes','neo4j_people_node_index')
-
-# fetch message information from the UC Berkeley MySQL database
-print "Pulling message data from the UC Berkeley MySQL database."
-cursor = UCBdb.cursor()
-cursor.execute("select t2.email, t1.date, t1.timezone, t1.smtpid, t1.subject, t1.body from msgs as t1, addresses as t2 where t1.eid = t2.eid;")
-results = cursor.fetchall()
-
-# fetch email addresses corresponding to the 151 email inboxes that make up the dataset
-print "Pulling email address data from the USC/ISI MySQL database."
-cursor = ISIdb.cursor()
-cursor.execute("select Email_id as email from employeelist;")
-addressTuples = cursor.fetchall()
-fullyObservedAddresses = [e[0] for e in addressTuples]
-
-# find and modify the specific address that appears to be incorrectly represented in the ISI database
-for i in range(len(fullyObservedAddresses)):
-    if fullyObservedAddresses[i] == 'paul.y barbo@enron.com':
-        break
-fullyObservedAddresses[i] = "paul.y'barbo@enron.com"
-
-# message batch size - number of messages to process for each graph database transaction
+# resume the previous run if it was interrupted. otherwise delete previous keys if they exist.
+checkpoints = rdb.hgetall('neo4j_ingest_checkpoints')
+if checkpoints and checkpoints.get('stage:complete') != 'done' and '--restart' not in sys.argv:
+    print "Resuming the interrupted ingest run from its checkpoints."
+else:
+    rdb.delete('neo4j_message_node_index','neo4j_address_node_index',
+               'neo4j_fully_observed_address_nodes','neo4j_people_node_index',
+               'neo4j_ingest_checkpoints')
+    checkpoints = {}
+
+# the key of the last message submitted before the interruption, or None
+startAfter = checkpoints.get('last_message_key')
+if startAfter != None:
+    startAfter = int(startAfter)
+
+# create a streaming reader for the mail files or for the UC Berkeley MySQL database
+mailPath = None
+if '--mail' in sys.argv:
+    mailPath = sys.argv[sys.argv.index('--mail')+1]
+    UCBreader = MailReader(mailPath,start_after=startAfter)
+else:
+    UCBreader = IngestReader(mysql_connector(host='localhost',user='root',passwd='',db='berkeley_enron'),
+                             start_after=startAfter)
+
+if mailPath == None:
+
+    # fetch email addresses corresponding to the 151 email inboxes that make up the dataset
+    print "Pulling email address data from the USC/ISI MySQL database."
+    import MySQLdb
+    ISIdb = MySQLdb.connect(host='localhost',user='root',passwd='',db='isi_enron')
+    cursor = ISIdb.cursor()
+    cursor.execute("select Email_id as email from employeelist;")
+    addressTuples = cursor.fetchall()
+    fullyObservedAddresses = [e[0] for e in addressTuples]
+
+    # find and modify the specific address that appears to be incorrectly represented in the ISI database
+    for i in range(len(fullyObservedAddresses)):
+        if fullyObservedAddresses[i] == 'paul.y barbo@enron.com':
+            break
+    fullyObservedAddresses[i] = "paul.y'barbo@enron.com"
+else:
+    fullyObservedAddresses = []
+
+# address node ids or, for nodes created in the current batch, batch references. the
+# address nodes of the interrupted run are reused.
+addressNodes = dict([(address, int(nodeID)) for address, nodeID
+                     in rdb.hgetall('neo4j_address_node_index').iteritems()])
+newAddresses = []
+
+# helper function returning the address node for the given address, queueing its
+# creation in the write batch if it does not exist yet
+def get_address_node(batch,address):
+    if not addressNodes.has_key(address):
+
+        # check to see if this address is fully observed
+        fO = (address in fullyObservedAddresses)
+
+        # create a new email address node
+        addressNodes[address] = batch.create_node(address=address, fullyObserved=fO, type="Email Address")
+        newAddresses.append(address)
+    return addressNodes[address]
+
+# helper function submitting the write batch and recording the new address nodes
+# in the redis indexes
+def submit_batch(batch):
+    batch.submit()
+    pipe = rdb.pipeline(transaction=True)
+    for address in newAddresses:
+        nodeID = addressNodes[address].id
+        addressNodes[address] = nodeID
+        pipe.hset('neo4j_address_node_index',address,str(nodeID))
+
+        # if this node is fully observed, add the index to the list of fully observed nodes
+        if address in fullyObservedAddresses:
+            pipe.sadd('neo4j_fully_observed_address_nodes',str(nodeID))
+    del newAddresses[:]
+    return pipe
+
+# message batch size - number of messages, along with their recipients, to send to the
+# graph database with each request
 msgBatchSize = 500
 
-# number of batches
-numBatches = len(results) / msgBatchSize + 1
+# the messages along with their recipients, streamed from the mail files or the UC
+# Berkeley MySQL database
+if mailPath != None:
+    print "Streaming message and recipient data from %s." % mailPath
+else:
+    print "Streaming message and recipient data from the UC Berkeley MySQL database."
+messages = UCBreader.keyed_messages()
+numMsgs = 0
+numRecips = 0
 
 # for each batch...
-i = 0
-for b in range(numBatches):
+while True:
 
-    # for each message in the batch...
-    for m in range(msgBatchSize):
+    msgBatch = list(islice(messages,msgBatchSize))
+    if not msgBatch:
+        break
 
-        # get the message
-        msg = results[i]
+    # the batch queues the node and relationship creations of the messages and recipients
+    batch = graphdb.write_batch()
+    msgRefs = []
+
+    # for each message in the batch...
+    for key, msg, recips in msgBatch:
 
         # get the message datetime
         msgDT = msg[1]
@@ -73,11 +147,8 @@ for b in range(numBatches):
 
         if msgDT != None:
 
-            # create new datetime object with time normalized to UTC
-            msgDT = parse(msgDT.strftime('%Y/%m/%d %H:%M:%S') + ' ' + msgTZ[:5]).astimezone(tz.tzoffset('',0))
-
-            # convert the datetime into seconds since the epoch
-            msgDTsecs = timegm(msgDT.utctimetuple())
+            # normalize the datetime to UTC and convert it into seconds since the epoch
+            msgDT, msgDTsecs = normalize_datetime(msgDT,msgTZ)
 
             # message datetime string
             msgDTstring = str(msgDT)
@@ -92,123 +163,63 @@ for b in range(numBatches):
 
         # create new message node - assume there are no duplicate messages in the collection
         # so no need to check for matching nodes that already exist.
-        m = graphdb.node(datetime=msgDTstring, epochSecs=msgDTsecs, subject=msgSubj, 
-                         body=msgBody, emailID=msgID, type="Message")
-
-        # add message node to the index
-        rdb.hset('neo4j_message_node_index',msgID,str(m.id))
+        m = batch.create_node(datetime=msgDTstring, epochSecs=msgDTsecs, subject=msgSubj, 
+                              body=msgBody, emailID=msgID, type="Message")
+        msgRefs.append((msgID,m))
 
         # get the message sender's email address
         sender = msg[0]
 
         # decode the address from ISO-8859-1 and encode in ASCII preserving extended characters
-        sender = cgi.escape(sender.decode('iso-8859-1')).encode('ascii','xmlcharrefreplace')
-
-        # check to see if an email address node exists for this address
-        addNodeID = rdb.hget('neo4j_address_node_index',sender)
-        if addNodeID != None:
-            e = graphdb.node[int(addNodeID)]
-        else:
-
-            # check to see if this address is fully observed
-            fO = (sender in fullyObservedAddresses)
-
-            # create a new email address node
-            e = graphdb.node(address=sender, fullyObserved=fO, type="Email Address")
-
-            # add the node to the address index
-            rdb.hset('neo4j_address_node_index',sender,str(e.id))
-
-            # if this node is fully observed, add the index to the list of fully observed nodes
-            if fO:
-                rdb.sadd('neo4j_fully_observed_address_nodes',str(e.id))                            
-
-        # create a link from the new email address node to the new message node
-        e.SENT(m, datetime=msgDTstring, epochSecs=msgDTsecs)
-
-        i += 1
-
-        # check to see if we are at the end of the results list and need to stop iterating
-        if i == len(results):
-            break
-
-    print "%d messages processed." % i
-
-# fetch recipient information from the MySQL database
-print "Pulling recipient data from the MySQL database."
-cursor = UCBdb.cursor()
-cursor.execute("select t1.smtpid, t2.reciptype, t2.reciporder, t3.email from msgs as t1, recip_info as t2, addresses as t3 where t1.mid = t2.mid and t2.eid = t3.eid;")
-results = cursor.fetchall()
+        sender = normalize_address(sender)
 
-# recipient batch size - number of recipients to process for each graph database transaction
-recipBatchSize = 10000
+        # create a link from the email address node to the new message node
+        e = get_address_node(batch,sender)
+        batch.create_relationship(e, m, "SENT", datetime=msgDTstring, epochSecs=msgDTsecs)
 
-# number of batches
-numBatches = len(results) / recipBatchSize + 1
+        # for each recipient of the message...
+        for recip in recips:
 
-# for each batch...
-i = 0
-for b in range(numBatches):
-
-    # for each recipient in the batch...
-    for r in range(recipBatchSize):
-
-        # get the recipient information
-        recip = results[i]
-
-        # get the message ID
-        msgID = recip[0]
-
-        # get the recipient type
-        recipType = recip[1]
+            # get the recipient type
+            recipType = recip[1]
 
-        # get the recipient order
-        recipOrder = int(recip[2])
+            # get the recipient order
+            recipOrder = int(recip[2])
 
-        # get the recipient email address
-        recipEmail = recip[3]
+            # get the recipient email address
+            recipEmail = recip[3]
     
-        # decode the address from ISO-8859-1 and encode in ASCII preserving extended characters
-        recipEmail = cgi.escape(recipEmail.decode('iso-8859-1')).encode('ascii','xmlcharrefreplace')
-
-        # check to see if an email address node exists for this address
-        addNodeID = rdb.hget('neo4j_address_node_index',recipEmail)
-        if addNodeID != None:
-            e = graphdb.node[int(addNodeID)]
-        else:
-
-            # check to see if this address is fully observed
-            fO = (recipEmail in fullyObservedAddresses)
-
-            # create a new email address node
-            e = graphdb.node(address=recipEmail, fullyObserved=fO, type="Email Address")
-
-            # add the node to the address index
-            rdb.hset('neo4j_address_node_index',recipEmail,str(e.id))
-
-            # if this node is fully observed, add the index to the list of fully observed nodes
-            if fO:
-                rdb.sadd('neo4j_fully_observed_address_nodes',str(e.id))                            
-
-        # retrieve the message node
-        msgNodeID = rdb.hget('neo4j_message_node_index',msgID)
-        m = graphdb.node[int(msgNodeID)]
-
-        # create a link from the message node to the email address node
-        m.RECEIVED_BY(e, datetime=m['datetime'], epochSecs=m['epochSecs'], type=recipType, order=recipOrder)
-
-        i += 1
-
-        # check to see if we are at the end of the results list and need to stop iterating
-        if i == len(results):
-            break
-
-    print "%d recipients processed." % i
-
-# fetch manager-subordinate relationship information from the text file
-print "Pulling manager-subordinate relationship information from the text file."
-f = open('enron_manager_subordinate_relationships.txt','r')
-relationships = f.readline().split('\r')
+            # decode the address from ISO-8859-1 and encode in ASCII preserving extended characters
+            recipEmail = normalize_address(recipEmail)
+
+            # get the email address node
+            e = get_address_node(batch,recipEmail)
+
+            # create a link from the message node to the email address node
+            batch.create_relationship(m, e, "RECEIVED_BY", datetime=msgDTstring, epochSecs=msgDTsecs, 
+                                      type=recipType, order=recipOrder)
+
+        numRecips += len(recips)
+
+    # send the batch and add the message nodes to the index along with the checkpoint of
+    # the last message key of the batch
+    pipe = submit_batch(batch)
+    for msgID, m in msgRefs:
+        pipe.hset('neo4j_message_node_index',msgID,str(m.id))
+    pipe.hset('neo4j_ingest_checkpoints','last_message_key',key)
+    pipe.execute()
+
+    numMsgs += len(msgBatch)
+    print "%d messages and %d recipients processed." % (numMsgs,numRecips)
+
+# fetch manager-subordinate relationship information from the text file. its addresses
+# are those of the UC Berkeley database, so it is skipped when reading mail files.
+if mailPath == None:
+    print "Pulling manager-subordinate relationship information from the text file."
+    f = open('enron_manager_subordinate_relationships.txt','r')
+    relationships = f.readline().split('\r')
+else:
+    relationships = []
 
 # helper function to check for the existence of an edge of the specified type 
 # going from node na to node nb
@@ -282,3 +293,6 @@ for rel in relationships:
                                            startDatetime='2000-01-01 00:00:00 +00:00',
                                            endDatetime='2001-11-30 23:59:59 +00:00',
                                            provenance='http://tinyurl.com/4faotq4')
+
+# mark the ingest run as completed
+rdb.hset('neo4j_ingest_checkpoints','stage:complete','done')
@@ -0,0 +1,26 @@
+import sys
+from social_signaling.db_access import DB
+
+# Exports the messages and directed communication relationships from the Redis database to
+# a memory-mapped columnar snapshot, see columnar_snapshot.py. Analysis code reads the
+# snapshot after calling DB.openColumnarSnapshot(path).
+#
+# Usage: python build_columnar_snapshot.py <snapshot path>
+
+if len(sys.argv) != 2:
+    print "Usage: python build_columnar_snapshot.py <snapshot path>"
+    sys.exit(1)
+path = sys.argv[1]
+
+# Connect to the database
+print "Connecting to the database."
+db = DB.DB()
+db.startRedisServer()
+db.createRedisConnection()
+
+# Fetched messages do not need to be cached
+db.setMessageCacheSize(0)
+
+print "Writing the columnar snapshot to %s." % path
+db.exportColumnarSnapshot(path)
+print "Done."
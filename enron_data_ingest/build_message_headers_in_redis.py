@@ -0,0 +1,37 @@
+import marshal
+import redis
+import sys
+
+# create a connection to the redis database
+rdb = redis.Redis(host='localhost', port=6379, db=0)
+
+# databases converted to the compact record encoding already have the header-only message
+# hash since the migration builds it
+if rdb.get('record_encoding_version') != None:
+    print "The database uses the compact record encoding. message_headers is already built."
+    sys.exit(0)
+
+# delete the previous header-only message hash if it exists
+rdb.delete('message_headers')
+
+# build the header-only message hash from the messages hash in batches of message ids.
+# the header dictionaries are the message dictionaries without the message body.
+batchSize = 500
+msgIDs = rdb.hkeys('messages')
+for i in xrange(0,len(msgIDs),batchSize):
+
+    # fetch the message dictionaries for the batch
+    batch = msgIDs[i:i+batchSize]
+    mDictStrs = rdb.hmget('messages',batch)
+
+    # remove the message bodies
+    hDicts = {}
+    for msgID, mDictStr in zip(batch,mDictStrs):
+        hDict = marshal.loads(mDictStr)
+        del hDict['body']
+        hDicts[msgID] = marshal.dumps(hDict)
+
+    # push the header dictionaries to redis
+    rdb.hmset('message_headers',hDicts)
+
+    print "%d messages processed." % min(i+batchSize,len(msgIDs))
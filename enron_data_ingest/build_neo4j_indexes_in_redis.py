@@ -1,5 +1,10 @@
 import redis
-from social_signaling.db.neo4j_rest_client import GraphDatabase
+from social_signaling.db_access.neo4j_rest_client import GraphDatabase, configure_pool
+
+# number of node requests issued concurrently. the connection pool holds a connection
+# per worker, as the workers would otherwise block on the pool without a timeout.
+numWorkers = 16
+configure_pool(size=numWorkers)
 
 # create a connection to the neo4j database
 graphdb = GraphDatabase('http://localhost:7474/db/data')
@@ -9,29 +14,34 @@ rdb = redis.Redis(host='localhost', port=6379, db=0)
 
 # iterate over the vertices
 # there is no mechanism in the Python REST client to discover the total number
-# of vertices available. so we must know the total number beforehand. 
-for i in xrange(343112):
+# of vertices available. so we must know the total number beforehand. the vertices
+# are fetched concurrently and the index entries are written through a pipeline.
+numVertices = 343112
+numMissing = 0
+pipe = rdb.pipeline(transaction=False)
+for i, v, error in graphdb.get_nodes(xrange(numVertices), max_workers=numWorkers):
 
-    # get the vertex from neo4j
-    v = graphdb.node[i]
+    # skip vertex ids that could not be fetched, e.g. deleted vertices
+    if error != None:
+        numMissing += 1
 
     # if it's an email address vertex
-    if v.properties.has_key('type') and v['type'] == "Email Address":
+    elif v.properties.has_key('type') and v['type'] == "Email Address":
 
-        # add a key-value pair to the redis index mapping from the address 
+        # add a key-value pair to the redis index mapping from the address
         # to the vertex id
-        rdb.hset('addresses',v['address'],i)
+        pipe.hset('addresses',v['address'],i)
 
         # if the email address is fully observed
         if v['fullyObserved'] == True:
 
             # add the vertex id to the set of ids corresponding to fully observed
             # email addresses
-            rdb.sadd('fullyObserved',i)
+            pipe.sadd('fullyObserved',i)
 
     if (i+1) % 500 == 0:
+        pipe.execute()
         print "%d vertices processed." % (i+1)
 
-print "%d vertices processed." % (i+1)
-
-
+pipe.execute()
+print "%d vertices processed. %d could not be fetched." % (numVertices,numMissing)
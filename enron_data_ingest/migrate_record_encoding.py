@@ -0,0 +1,118 @@
+import sys
+from social_signaling.db_access                 import DB
+from social_signaling.db_access.record_encoding import LegacyRecordCodec, CompactRecordCodec
+from social_signaling.db_access.redis_ingest    import CHECKPOINT_KEY, get_checkpoints, is_stage_done
+
+# Converts the Redis database from the legacy record encoding (marshal values and str(tuple)
+# keys) to the compact record encoding described in record_encoding.py. Each hash is
+# converted into a temporary hash. The temporary hashes replace the legacy hashes in a
+# single transaction at the end, so an interrupted migration leaves the legacy data intact
+# and can simply be restarted.
+
+# Number of hash entries converted per round trip
+batch_size = 1000
+
+# Connect to the database
+print "Connecting to the database."
+db = DB.DB()
+db.startRedisServer()
+db.createRedisConnection()
+rdb = db.redisDB
+
+if rdb.get('record_encoding_version') != None:
+    print "The database already uses record encoding version %s." % rdb.get('record_encoding_version')
+    sys.exit(0)
+
+# An interrupted ingest run resumes by writing records in the legacy encoding, so it has to
+# be completed first. The checkpoints of a completed run only hold message keys and stage
+# markers and are kept as they are for append_messages_redis.py.
+checkpoints = get_checkpoints(rdb)
+if checkpoints and not is_stage_done(checkpoints,'complete'):
+    print "The ingest run recorded in %s is incomplete. Complete it with berkeley_enron_import_redis.py first." % CHECKPOINT_KEY
+    sys.exit(1)
+
+legacy = LegacyRecordCodec()
+compact = CompactRecordCodec(rdb)
+
+def temp_name(name):
+    """Returns the name of the temporary hash for the converted version of hash name."""
+    return '%s:v%d' % (name,compact.version)
+
+# The longest common substrings of each message field are held in their own hash
+lcs_hash_names = ['lcsubstrings'] + ['lcsubstrings:%s' % field for field in rdb.smembers('lcsubstring_fields')]
+
+# The other hashes hold plain marshal values in both encodings and are left as they are
+hash_names = ['messages','message_headers','mids_per_directed_comm_relationship',
+              'recipients_per_sender_address','senders_per_recipient_address'] + lcs_hash_names
+
+# Remove the dictionaries and temporary hashes left by an interrupted migration
+rdb.delete('address_to_id','id_to_address','message_id_to_id','id_to_message_id',
+           'record_dictionary_counters',*[temp_name(name) for name in hash_names])
+
+def convert_hash(name,convert):
+    """Converts the legacy hash name in batches. convert takes the lists of legacy keys and
+    values and a pipeline and returns a dictionary of the converted entries for temp_name(name).
+    New dictionary entries are written by the codec before the pipeline is executed."""
+    keys = rdb.hkeys(name)
+    for i in xrange(0,len(keys),batch_size):
+        batch = keys[i:i+batch_size]
+        values = rdb.hmget(name,batch)
+        pipe = rdb.pipeline(transaction=False)
+        pipe.hmset(temp_name(name),convert(batch,values,pipe))
+        pipe.execute()
+    print "%s: %d entries converted." % (name,len(keys))
+
+def convert_messages(keys,values,pipe):
+    msgs = legacy.decodeMessages(values,keys)
+
+    # The header-only message hash is rebuilt from the complete messages
+    headers = []
+    for msg in msgs:
+        header = msg.copy()
+        del header['body']
+        headers.append(header)
+    pipe.hmset(temp_name('message_headers'),dict(zip(keys,compact.encodeMessages(headers))))
+    return dict(zip(keys,compact.encodeMessages(msgs)))
+
+def convert_relationships(keys,values,pipe):
+    keys = compact.encodeRelationshipKeys(legacy.decodeRelationshipKeys(keys),True)
+    values = [compact.encodeRelationship(tlist) for tlist in legacy.decodeRelationships(values)]
+    return dict(zip(keys,values))
+
+def convert_extents(keys,values,pipe):
+    return dict(zip(keys,[compact.encodeExtents(legacy.decodeExtents(s)) for s in values]))
+
+def convert_lcsubstrings(keys,values,pipe):
+    keys = compact.encodeMessagePairKeys(legacy.decodeMessagePairKeys(keys),True)
+    return dict(zip(keys,values))
+
+# Assign the message ids in time order so that relationship lists refer to nearby ids
+print "Assigning message ids."
+if rdb.exists('sorted_message_ids'):
+    mids = rdb.zrange('sorted_message_ids',0,-1)
+else:
+    mids = rdb.hkeys('messages')
+for i in xrange(0,len(mids),batch_size):
+    compact.message_ids.assignIDs(mids[i:i+batch_size])
+print "%d message ids assigned." % len(mids)
+
+# Convert the hashes
+convert_hash('messages',convert_messages)
+convert_hash('mids_per_directed_comm_relationship',convert_relationships)
+convert_hash('recipients_per_sender_address',convert_extents)
+convert_hash('senders_per_recipient_address',convert_extents)
+for name in lcs_hash_names:
+    convert_hash(name,convert_lcsubstrings)
+
+# Replace the legacy hashes with the converted hashes and record the encoding version
+print "Replacing the legacy hashes."
+pipe = rdb.pipeline(transaction=True)
+for name in hash_names:
+    if rdb.exists(temp_name(name)):
+        pipe.rename(temp_name(name),name)
+    else:
+        pipe.delete(name)
+pipe.set('record_encoding_version',compact.version)
+pipe.execute()
+
+print "The database now uses record encoding version %d." % compact.version
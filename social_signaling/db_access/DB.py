@@ -1,16 +1,25 @@
 import os
-import redis
-import marshal
 import subprocess
+from collections     import deque
 from time            import sleep
 from datetime        import datetime
 from dateutil.parser import parse
+from social_signaling.db_access.MessageRecord     import MessageRecord
+from social_signaling.db_access.columnar_snapshot import ColumnarSnapshot, export_columnar_snapshot
 from social_signaling.db_access.neo4j_rest_client import GraphDatabase
+from social_signaling.db_access.record_encoding   import LegacyRecordCodec, CompactRecordCodec
+from social_signaling.db_access.redis_ingest      import CommAggregates, merge_relationship_lists, message_digest
+from social_signaling.db_access.storage_backends  import RedisBackend, DictBackend, SnapshotBackend, save_snapshot
+from social_signaling.util.lru_cache              import LRUCache
+from social_signaling.util.time_interval          import datetime_to_epoch_secs
 
 # Redis databases used for various datasets
 ENRON = 0
 SWITCHBOARD = 1
 
+# Message properties available from the header-only message store
+HEADER_FIELDS = ['MessageID','Datetime','EpochSecs','Sender','TO','CC','BCC','Subject']
+
 class Borg(object):
     _shared_state = {}
     def __new__(cls, *a, **k):
@@ -21,16 +30,52 @@ class Borg(object):
 class DB(Borg):
     """Class encapsulating connections to both the Neo4j and Redis databases.
     Global state ensures that each instance of DB will share the same
-    connections.
+    connections. The Redis data may also be served by one of the in-process
+    storage backends in storage_backends.py.
     """
     
     # In the near-term, we'll leave these as public variables for debugging purposes
     neo4j_path = None
     redis_path = None
+    snapshot_path = None
     neo4j_running = False
     redis_running = False
     neo4jDB = None
     redisDB = None    
+    
+    # Number of message ids fetched with each HMGET
+    message_fetch_chunk_size = 500
+    
+    # Number of hash entries requested with each HSCAN by the iter* methods
+    scan_batch_size = 1000
+    
+    # Number of sorted_message_ids entries fetched with each ZRANGEBYSCORE
+    time_range_page_size = 10000
+    
+    # Maximum number of decoded messages held in the message cache
+    message_cache_size = 10000
+    _message_cache = None
+    
+    # Codec for the record encoding used by the Redis database
+    _record_codec = None
+
+    # Names of the hashes that messages and header-only messages are read from, resolved
+    # once per storage backend until the message_headers hash is found
+    _message_hash_names = None
+    
+    # Read-only columnar snapshot serving messages and relationships, if one is open
+    _columnar_snapshot = None
+    
+    # Messages are read from Neo4j instead of Redis if True and no columnar snapshot is open
+    read_messages_from_neo4j = False
+    
+    # Number of messages assembled with each Neo4j batch request
+    neo4j_batch_size = 100
+    _neo4j_addresses = None
+    
+    # Number of buffered longest common substring results written with each flush
+    lcs_write_batch_size = 1000
+    _lcs_buffer = None
 
     #========== Methods for interacting with the database servers ==========#
 
@@ -59,6 +104,7 @@ class DB(Borg):
         if self.neo4j_running:
             try:
                 self.neo4jDB = GraphDatabase("http://localhost:7474/db/data")
+                self._neo4j_addresses = None
             except Exception:
                 raise Exception("Unable to establish connection to the Neo4j server.")
         else: 
@@ -71,9 +117,18 @@ class DB(Borg):
 
     def startRedisServer(self):
         """Checks to see that the environment variable REDIS_HOME is defined. If it is 
-        specified, the Redis server is started.
+        specified, the Redis server is started. If the environment variable REDIS_SNAPSHOT
+        names a snapshot file instead, no server is started and createRedisConnection
+        serves the data from the snapshot.
         """
         if self.redis_running == False:
+            if self.snapshot_path == None:
+                self.snapshot_path = os.getenv('REDIS_SNAPSHOT')
+            if self.snapshot_path != None:
+                print "Using Redis snapshot %s..." % self.snapshot_path
+                self.redis_running = True
+                return
+
             if self.redis_path == None:
     
                 # Get the path to the Redis database
@@ -92,22 +147,59 @@ class DB(Borg):
             print "Redis Server is already running."
 
     def createRedisConnection(self,rdb=0):
-        """Instantiates a Redis database object."""
+        """Instantiates a Redis database object. When a snapshot is in use, the snapshot
+        is loaded into an in-process backend instead."""
         if self.redis_running:
+            if self.snapshot_path != None:
+                self.setStorageBackend(SnapshotBackend(self.snapshot_path))
+                return
+            
             try:
                 # Note: the database defaults to zero for now
-                self.redisDB = redis.Redis(host='localhost', port=6379, db=rdb)
+                self.setStorageBackend(RedisBackend(host='localhost', port=6379, db=rdb))
             except Exception:
             
                 # if it failed, wait five seconds and try again
                 sleep(5)
                 try:
-                    self.redisDB = redis.Redis(host='localhost', port=6379, db=rdb)
+                    self.setStorageBackend(RedisBackend(host='localhost', port=6379, db=rdb))
                 except Exception:
                     raise Exception("Unable to establish connection to the Redis server.")
         else:
             raise Exception("Redis server is not running.")
 
+    def setStorageBackend(self,backend):
+        """Uses the given storage backend for all Redis data access. Any backend from
+        storage_backends.py, or another object providing the same subset of the redis-py
+        API, may be used.
+        """
+        
+        # Cached messages, the record codec and the message hash names may belong to a
+        # different database
+        self.invalidateMessageCache()
+        self._record_codec = None
+        self._message_hash_names = None
+        
+        self.redisDB = backend
+        self.redis_running = True
+
+    def createInProcessConnection(self,snapshot_path=None):
+        """Serves the Redis data from an in-process backend without starting a server. 
+        If snapshot_path is specified, the whole snapshot at that path is loaded into
+        memory. Otherwise the backend starts out empty.
+        """
+        self.snapshot_path = snapshot_path
+        if snapshot_path != None:
+            self.setStorageBackend(SnapshotBackend(snapshot_path))
+        else:
+            self.setStorageBackend(DictBackend())
+
+    def saveSnapshot(self,path):
+        """Writes the contents of the current Redis database, from any backend, to a 
+        snapshot file that createInProcessConnection or REDIS_SNAPSHOT can load."""
+        self.checkRedisConnection()
+        save_snapshot(self.redisDB,path)
+
     def checkRedisConnection(self):
         """Raises an exception if there is no Redis database connection."""
         if self.redisDB == None:
@@ -143,7 +235,12 @@ class DB(Borg):
         """Stops the Redis server if it is running. Sets the database object reference
         to None.
         """
-        if self.redis_running == True:
+        if self.redis_running == True and (self.snapshot_path != None or isinstance(self.redisDB,DictBackend)):
+            
+            # No server was started for the in-process backends
+            self.redis_running = False
+            self.redisDB = None
+        elif self.redis_running == True:
     
             # Shutdown the Redis server
             print "Stopping Redis Server..."
@@ -160,6 +257,28 @@ class DB(Borg):
         self.stopNeo4jServer()
         self.stopRedisServer()
     
+    def openColumnarSnapshot(self,path):
+        """Serves messages, message ids and directed communication relationships from the
+        memory-mapped columnar snapshot at path instead of Redis (see 
+        enron_data_ingest/build_columnar_snapshot.py). All other data is still read from 
+        Redis. Processes that open the same snapshot share its pages in memory.
+        """
+        self.closeColumnarSnapshot()
+        self.invalidateMessageCache()
+        self._columnar_snapshot = ColumnarSnapshot(path)
+        
+    def closeColumnarSnapshot(self):
+        """Closes the columnar snapshot, if one is open, and resumes reading from Redis."""
+        if self._columnar_snapshot != None:
+            self.invalidateMessageCache()
+            self._columnar_snapshot.close()
+            self._columnar_snapshot = None
+            
+    def exportColumnarSnapshot(self,path):
+        """Writes the messages and directed communication relationships to a columnar 
+        snapshot at path. They are read from Redis even when a columnar snapshot is open."""
+        export_columnar_snapshot(self,path)
+    
     #========== Methods for accessing message data ==========#
     
     def checkRedisKey(self,key):
@@ -167,11 +286,63 @@ class DB(Borg):
         if self.redisDB.exists(key) == False:
             err = "%s hash does not exist." % key
             raise Exception(err)
+            
+    def _codec(self):
+        """Returns the codec for the record encoding of the Redis database. Databases
+        converted by enron_data_ingest/migrate_record_encoding.py store their encoding 
+        version under the record_encoding_version key. Other databases use the legacy 
+        encoding.
+        """
+        if self._record_codec == None:
+            self.checkRedisConnection()
+            version = self.redisDB.get('record_encoding_version')
+            if version == None:
+                self._record_codec = LegacyRecordCodec()
+            elif int(version) == CompactRecordCodec.version:
+                self._record_codec = CompactRecordCodec(self.redisDB)
+            else:
+                err = "Unsupported record encoding version %s." % version
+                raise Exception(err)
+        return self._record_codec
     
+    def _scan_hash(self,name,batch_size=None):
+        """Yields dictionaries holding the entries of the hash name, read with HSCAN about 
+        batch_size entries at a time. batch_size defaults to scan_batch_size. Unlike HKEYS,
+        HSCAN never reads the whole hash with a single command. Entries added or removed 
+        during the scan may be missed or returned twice.
+        """
+        self.checkRedisConnection()
+        if batch_size == None:
+            batch_size = self.scan_batch_size
+        cursor = None
+        while cursor != 0:
+            cursor, data = self.redisDB.hscan(name,cursor or 0,count=batch_size)
+            if len(data) > 0:
+                yield data
+                
+    def iterAllMessageIDs(self,batch_size=None):
+        """Iterates over all message ids, reading the message id index with HSCAN in batches
+        of about batch_size entries instead of all at once."""
+        if self._columnar_snapshot != None:
+            batch_size = batch_size or self.scan_batch_size
+            num_msgs = self._columnar_snapshot.getNumberOfMessages()
+            for i in xrange(0,num_msgs,batch_size):
+                mids, secs = self._columnar_snapshot.getMessageIDsAndEpochSecs(i,min(i+batch_size,num_msgs))
+                for mid in mids:
+                    yield mid
+            return
+        self.checkRedisConnection()
+        self.checkRedisKey('neo4j_message_node_index')
+        for data in self._scan_hash('neo4j_message_node_index',batch_size):
+            for mid in data:
+                yield mid
+            
     def getAllMessageIDs(self):
         """Returns a list of all message ids if it exists or None otherwise. Throws 
         an exception if no database connection exists.
         """
+        if self._columnar_snapshot != None:
+            return self._columnar_snapshot.getAllMessageIDs() or None
         self.checkRedisConnection()
         self.checkRedisKey('neo4j_message_node_index')
         msg_ids = self.redisDB.hkeys('neo4j_message_node_index')
@@ -205,88 +376,411 @@ class DB(Borg):
         
         return msg
 
-    def _get_message_from_neo4j(self,message_id):
-        """Returns a dictionary of message properties from Neo4j for the referenced message."""
+    def _lookup_neo4j_addresses(self,node_urls):
+        """Returns a dictionary mapping the given address node URLs to their email 
+        addresses. Addresses never change once their nodes are created, so they are
+        remembered, and the addresses of the nodes not seen before are fetched with a 
+        single batch request.
+        """
+        if self._neo4j_addresses == None:
+            self._neo4j_addresses = {}
+        new_urls = list(set(node_urls).difference(self._neo4j_addresses))
+        if len(new_urls) > 0:
+            jobs = [{ 'method' : 'GET', 
+                      'to' : '/node/%s/properties/address' % url.split('/')[-1] } 
+                    for url in new_urls]
+            for url, address in zip(new_urls,self.neo4jDB.batch(jobs)):
+                if isinstance(address,unicode):
+                    address = address.encode('utf-8')
+                self._neo4j_addresses[url] = address
+        return dict([(url,self._neo4j_addresses[url]) for url in node_urls])
+        
+    def _get_messages_from_neo4j(self,message_ids,headers_only=False):
+        """Returns a list of message property dictionaries from Neo4j for the referenced 
+        messages in the same order as message_ids. For every neo4j_batch_size messages, the
+        message nodes and their SENT and RECEIVED_BY relationships are fetched with a single
+        request to the REST batch endpoint, followed by at most one request for the 
+        addresses of sender and recipient nodes not seen before. The dictionaries match 
+        those read from Redis. If headers_only = True, the message bodies are dropped.
+        """
         self.checkNeo4jConnection()
-                
-        # Fetch the property information from the message node
-        idx = self._lookup_neo4j_message_node_index(message_id)
-        msg_node = self._lookup_neo4j_node(idx)
-        msg = msg_node.properties
+        self.checkRedisConnection()
+        self.checkRedisKey('neo4j_message_node_index')
         
-        # Convert the datetime from a string to a datetime object
-        if msg['datetime'] == 'None':
-            msg['datetime'] = None
-        else:
-            msg['datetime'] = parse(msg['datetime'])
-        
-        # Fetch the sender information from the address node
-        sender_node = msg_node.relationships.incoming(types=["SENT"])[0].start
-        msg['sender'] = sender_node['address']       
-        
-        # Fetch the recipient information from the RECEIVED_BY edges and address nodes
-        recipient_rels = msg_node.relationships.outgoing(types=["RECEIVED_BY"])
-        msg['to'] = []
-        msg['cc'] = []
-        msg['bcc'] = []
-        for rel in recipient_rels:
-            rel_type  = rel.properties['type']
-            rel_order = rel.properties['order']
-            recip_node = rel.end
-            msg[rel_type].append((recip_node['address'],rel_order))
-            
-        # Sort the recipients by their position info and reduce the lists down to the addresses
-        # only, now in the proper order
-        fields = ['to','cc','bcc']
-        for field in fields:
-            msg[field].sort(key=lambda tup: tup[1])
-            msg[field] = [tup[0] for tup in msg[field]]     
-
-        # Define properties to rename and delete
-        prop_map = { 'emailID' : 'MessageID', 'datetime' : 'Datetime', 'epochSecs' : 'EpochSecs',
+        # Look up the message node indexes
+        pipe = self.redisDB.pipeline(transaction=False)
+        chunk_size = self.message_fetch_chunk_size
+        for i in xrange(0,len(message_ids),chunk_size):
+            pipe.hmget('neo4j_message_node_index',message_ids[i:i+chunk_size])
+        idxs = [idx for chunk in pipe.execute() for idx in chunk]
+        for mid, idx in zip(message_ids,idxs):
+            if idx == None:
+                err = "Message %s does not exist." % mid
+                raise Exception(err)
+                
+        # Define properties to rename
+        prop_map = { 'emailID' : 'MessageID', 'epochSecs' : 'EpochSecs',
                      'sender' : 'Sender', 'to' : 'TO', 'cc' : 'CC', 'bcc' : 'BCC', 
                      'subject' : 'Subject', 'body' : 'Body'}
-        prop_del = ['type']
         
-        # Rename and delete properties
+        records = []
+        batch_size = self.neo4j_batch_size
+        for i in xrange(0,len(idxs),batch_size):
+            
+            # Fetch the message nodes along with their sender and recipient relationships
+            jobs = []
+            for idx in idxs[i:i+batch_size]:
+                jobs.append({ 'method' : 'GET', 'to' : '/node/%s' % idx })
+                jobs.append({ 'method' : 'GET', 'to' : '/node/%s/relationships/in/SENT' % idx })
+                jobs.append({ 'method' : 'GET', 'to' : '/node/%s/relationships/out/RECEIVED_BY' % idx })
+            results = self.neo4jDB.batch(jobs)
+            
+            # Fetch the addresses of the sender and recipient nodes
+            node_urls = []
+            for k in xrange(0,len(results),3):
+                node_urls.extend([rel['start'] for rel in results[k+1]])
+                node_urls.extend([rel['end'] for rel in results[k+2]])
+            addresses = self._lookup_neo4j_addresses(node_urls)
+            
+            for k in xrange(0,len(results),3):
+                node, sent_rels, recipient_rels = results[k:k+3]
+                
+                # Message strings are read from Redis as byte strings
+                msg = {}
+                for key, value in node['data'].items():
+                    if isinstance(value,unicode):
+                        value = value.encode('utf-8')
+                    msg[key] = value
+                del msg['type']
+                if headers_only and msg.has_key('body'):
+                    del msg['body']
+                msg['sender'] = addresses[sent_rels[0]['start']]
+                
+                # Sort the recipients by their position info
+                msg['to'] = []
+                msg['cc'] = []
+                msg['bcc'] = []
+                for rel in recipient_rels:
+                    msg[rel['data']['type']].append((rel['data']['order'],addresses[rel['end']]))
+                for field in ['to','cc','bcc']:
+                    msg[field].sort(key=lambda tup: tup[0])
+                    msg[field] = [tup[1] for tup in msg[field]]
+                    
+                records.append(self._make_message_record(msg,prop_map))
+                
+        return records
+
+    def _get_message_from_neo4j(self,message_id,headers_only=False):
+        """Returns a dictionary of message properties from Neo4j for the referenced message."""
+        return self._get_messages_from_neo4j([message_id],headers_only)[0]
+        
+    def _make_message_record(self,msg,prop_map):
+        """Returns a MessageRecord holding the properties in msg renamed according to 
+        prop_map. The Datetime property is derived from EpochSecs on first access. The stored
+        datetime string is only parsed for legacy messages without epoch secs.
+        """
+        record = MessageRecord()
         for key1, key2 in prop_map.items():
-            msg[key2] = msg[key1]
-            del msg[key1]
-        for key in prop_del:
-            del msg[key]
+            if msg.has_key(key1):
+                record[key2] = msg[key1]
+                
+        # Messages without a datetime are stored with the string 'None'
+        if msg.get('datetime') == 'None':
+            record['Datetime'] = None
+        elif not record.has_key('EpochSecs'):
+            record['Datetime'] = parse(msg['datetime'])
+            record['EpochSecs'] = datetime_to_epoch_secs(record['Datetime'])
+            
+        return record
+        
+    def _decode_redis_messages(self,sdicts,message_ids):
+        """Returns a list of MessageRecords of message properties decoded from the encoded
+        message dictionaries sdicts stored in the Redis message hashes.
+        """
+            
+        # Define properties to rename
+        prop_map = { 'message_id' : 'MessageID', 'epoch_secs' : 'EpochSecs',
+                     'sender' : 'Sender', 'to' : 'TO', 'cc' : 'CC', 'bcc' : 'BCC', 
+                     'subject' : 'Subject', 'body' : 'Body'}
         
-        return msg  
+        msgs = self._codec().decodeMessages(sdicts,message_ids)
+        return [self._make_message_record(msg,prop_map) for msg in msgs]
         
-    def _get_message_from_redis(self,message_id):
+    def _get_message_from_redis(self,message_id,headers_only=False):
         """Returns a dictionary of message properties from Redis for the referenced message."""
+        return self._get_messages_from_redis([message_id],headers_only)[0]
+        
+    def _message_hash_name(self,headers_only=False):
+        """Returns the name of the hash that messages are read from. If headers_only = True,
+        this is the message_headers hash, which omits the message bodies, when it exists.
+        The names are cached for the storage backend once the message_headers hash is found.
+        Until then, header reads check for it again, as it may be built after the first
+        read."""
         self.checkRedisConnection()
-        self.checkRedisKey('messages')
+        if self._message_hash_names == None:
+            self.checkRedisKey('messages')
+            self._message_hash_names = { False : 'messages', True : 'messages' }
+        if headers_only and self._message_hash_names[True] == 'messages':
+            if self.redisDB.exists('message_headers'):
+                self._message_hash_names[True] = 'message_headers'
+        return self._message_hash_names[headers_only]
         
-        # Get the message property data
-        sdict = self.redisDB.hget('messages',message_id)
-        msg = marshal.loads(sdict)
+    def _get_messages_from_redis(self,message_ids,headers_only=False):
+        """Returns a list of message property dictionaries from Redis for the referenced 
+        messages in the same order as message_ids. The message ids are split into chunks of
+        message_fetch_chunk_size ids and each chunk is fetched with a single HMGET. All of 
+        the HMGETs are sent through one pipeline. If headers_only = True, the messages are
+        fetched from the message_headers hash, which omits the message bodies, when it exists.
+        """
+        hash_name = self._message_hash_name(headers_only)
         
-        # Convert the datetime from a string to a datetime object
-        if msg['datetime'] == 'None':
-            msg['datetime'] = None
-        else:
-            msg['datetime'] = parse(msg['datetime'])
+        # Queue an HMGET for each chunk of message ids
+        pipe = self.redisDB.pipeline(transaction=False)
+        chunk_size = self.message_fetch_chunk_size
+        for i in xrange(0,len(message_ids),chunk_size):
+            pipe.hmget(hash_name,message_ids[i:i+chunk_size])
             
+        # Decode the message property data
+        sdicts = [sdict for chunk in pipe.execute() for sdict in chunk]
+        for mid, sdict in zip(message_ids,sdicts):
+            if sdict == None:
+                err = "Message %s does not exist." % mid
+                raise Exception(err)
+                
+        return self._decode_redis_messages(sdicts,message_ids)
+        
+    def _get_messages_from_columnar_snapshot(self,message_ids,headers_only=False):
+        """Returns a list of message property dictionaries from the columnar snapshot for
+        the referenced messages in the same order as message_ids."""
+        
         # Define properties to rename
-        prop_map = { 'message_id' : 'MessageID', 'datetime' : 'Datetime', 'epoch_secs' : 'EpochSecs',
+        prop_map = { 'message_id' : 'MessageID', 'epoch_secs' : 'EpochSecs',
                      'sender' : 'Sender', 'to' : 'TO', 'cc' : 'CC', 'bcc' : 'BCC', 
                      'subject' : 'Subject', 'body' : 'Body'}
+                     
+        msgs = self._columnar_snapshot.getMessages(message_ids,headers_only)
+        return [self._make_message_record(msg,prop_map) for msg in msgs]
         
-        # Rename properties
-        for key1, key2 in prop_map.items():
-            msg[key2] = msg[key1]
-            del msg[key1]            
-
+    def _get_message_cache(self):
+        """Returns the message cache shared by all instances of DB, creating it if needed."""
+        if self._message_cache == None:
+            self._message_cache = LRUCache(self.message_cache_size)
+        return self._message_cache
+        
+    def _copy_message(self,msg):
+        """Returns a copy of the message property dictionary msg so that callers cannot
+        modify the cached message.
+        """
+        msg = msg.copy()
+        for field in ['TO','CC','BCC']:
+            msg[field] = list(msg[field])
         return msg
         
-    def getMessage(self,message_id):
-        """Returns a dictionary of message properties for the referenced message."""
-        return self._get_message_from_redis(message_id)
+    def _headers_only(self,fields):
+        """Returns True if the message properties listed in fields are all available from
+        the header-only message store.
+        """
+        return fields != None and set(fields).issubset(HEADER_FIELDS)
+        
+    def getMessage(self,message_id,fields=None):
+        """Returns a dictionary of message properties for the referenced message. If a list
+        of property names is given through fields, the dictionary is only guaranteed to
+        contain those properties. Requesting header properties only (see HEADER_FIELDS)
+        avoids fetching the message body.
+        """
+        return self.getMessages([message_id],fields)[0]
+        
+    def getMessages(self,message_ids,fields=None):
+        """Returns a list of message property dictionaries for the referenced messages in
+        the same order as message_ids. Messages are served from the message cache when
+        possible and the remaining messages are fetched in a single batch. If a list of 
+        property names is given through fields, the dictionaries are only guaranteed to
+        contain those properties. Requesting header properties only (see HEADER_FIELDS)
+        avoids fetching the message bodies.
+        """
+        cache = self._get_message_cache()
+        headers_only = self._headers_only(fields)
+        
+        # Look up the messages in the cache. Header-only messages are cached separately
+        # from complete messages.
+        msgs = {}
+        mids_to_fetch = []
+        for mid in message_ids:
+            if not msgs.has_key(mid):
+                msgs[mid] = cache.get((mid,headers_only))
+                if msgs[mid] == None:
+                    mids_to_fetch.append(mid)
+                    
+        # Fetch the remaining messages and add them to the cache
+        if len(mids_to_fetch) > 0:
+            if self._columnar_snapshot != None:
+                fetched = self._get_messages_from_columnar_snapshot(mids_to_fetch,headers_only)
+            elif self.read_messages_from_neo4j:
+                fetched = self._get_messages_from_neo4j(mids_to_fetch,headers_only)
+            else:
+                fetched = self._get_messages_from_redis(mids_to_fetch,headers_only)
+            for mid, msg in zip(mids_to_fetch,fetched):
+                msgs[mid] = msg
+                cache.put((mid,headers_only),msg)
+                
+        return [self._copy_message(msgs[mid]) for mid in message_ids]
+        
+    def iterAllMessages(self,fields=None,batch_size=None):
+        """Iterates over the property dictionaries of all messages. The message hash is read
+        with HSCAN and decoded in batches of about batch_size messages, so the messages 
+        arrive with their ids and bypass the message cache. If a list of property names is 
+        given through fields, the dictionaries are only guaranteed to contain those 
+        properties. Requesting header properties only (see HEADER_FIELDS) avoids reading 
+        the message bodies.
+        """
+        headers_only = self._headers_only(fields)
+        if self._columnar_snapshot != None:
+            batch_size = batch_size or self.scan_batch_size
+            num_msgs = self._columnar_snapshot.getNumberOfMessages()
+            for i in xrange(0,num_msgs,batch_size):
+                mids, secs = self._columnar_snapshot.getMessageIDsAndEpochSecs(i,min(i+batch_size,num_msgs))
+                for msg in self._get_messages_from_columnar_snapshot(mids,headers_only):
+                    yield msg
+            return
+        if self.read_messages_from_neo4j:
+            for data in self._scan_hash('neo4j_message_node_index',batch_size):
+                for msg in self._get_messages_from_neo4j(data.keys(),headers_only):
+                    yield msg
+            return
+        for data in self._scan_hash(self._message_hash_name(headers_only),batch_size):
+            mids = data.keys()
+            for msg in self._decode_redis_messages([data[mid] for mid in mids],mids):
+                yield msg
+        
+    def setNeo4jMessageReads(self,enabled=True):
+        """Selects whether messages are read from Neo4j (enabled = True) or from Redis. Both
+        return the same message property dictionaries. The message cache is cleared.
+        """
+        self.read_messages_from_neo4j = enabled
+        self.invalidateMessageCache()
+        
+    def setMessageCacheSize(self,size):
+        """Sets the maximum number of decoded messages held in the message cache. A size
+        of zero disables the cache.
+        """
+        self.message_cache_size = size
+        self._get_message_cache().setMaxSize(size)
+        
+    def invalidateMessageCache(self,message_ids=None):
+        """Removes the referenced messages from the message cache. If message_ids is None,
+        the cache is cleared.
+        """
+        if message_ids != None:
+            message_ids = [(mid,headers_only) for mid in message_ids 
+                                              for headers_only in [False,True]]
+        self._get_message_cache().invalidate(message_ids)
+        
+    def getMessageCacheStats(self):
+        """Returns a dictionary with the hit, miss and eviction counts, the hit rate and the
+        current and maximum sizes of the message cache.
+        """
+        return self._get_message_cache().getStats()
+                
+    #========== Methods for time range queries ==========#
+    
+    def _epoch_secs_bound(self,t,default):
+        """Returns the time bound t, given as a datetime or as epoch secs, in epoch secs. 
+        If t is None, default is returned."""
+        if t == None:
+            return default
+        if isinstance(t,datetime):
+            return datetime_to_epoch_secs(t)
+        return t
+        
+    def iterMessageIDsInTimeRange(self,begin=None,end=None):
+        """Yields (message id, epoch secs) tuples in ascending epoch secs order for the 
+        messages with begin <= epoch secs <= end. begin and end are datetimes or epoch secs
+        and default to an unbounded range. The sorted_message_ids sorted set is read with 
+        ZRANGEBYSCORE in pages of time_range_page_size entries. Messages without a datetime
+        are stored with epoch secs zero.
+        """
+        begin_secs = self._epoch_secs_bound(begin,float('-inf'))
+        end_secs = self._epoch_secs_bound(end,float('inf'))
+        page_size = self.time_range_page_size
+        
+        # The rows of a columnar snapshot are already in epoch secs order
+        if self._columnar_snapshot != None:
+            start, stop = self._columnar_snapshot.getMessageRowsInTimeRange(begin_secs,end_secs)
+            for i in xrange(start,stop,page_size):
+                mids, secs = self._columnar_snapshot.getMessageIDsAndEpochSecs(i,min(i+page_size,stop))
+                for tup in zip(mids,secs):
+                    yield tup
+            return
+            
+        self.checkRedisConnection()
+        self.checkRedisKey('sorted_message_ids')
+        min_secs = begin_secs
+        skip = 0
+        while True:
+            page = self.redisDB.zrangebyscore('sorted_message_ids',min_secs,end_secs,start=skip,
+                                              num=page_size,withscores=True,
+                                              score_cast_func=lambda score: int(float(score)))
+            for tup in page:
+                yield tup
+            if len(page) < page_size:
+                return
+                
+            # Continue from the score of the last entry, skipping the entries with that 
+            # score that have been read already
+            last_secs = page[-1][1]
+            ties = 0
+            while ties < len(page) and page[-1-ties][1] == last_secs:
+                ties += 1
+            if last_secs == min_secs:
+                skip += ties
+            else:
+                skip = ties
+            min_secs = last_secs
+            
+    def getMessageIDsInTimeRange(self,begin=None,end=None):
+        """Returns the list of message ids in ascending epoch secs order for the messages
+        with begin <= epoch secs <= end. begin and end are datetimes or epoch secs and 
+        default to an unbounded range.
+        """
+        return [mid for mid, secs in self.iterMessageIDsInTimeRange(begin,end)]
+        
+    def iterTimeWindows(self,begin,end,window_size,step=None):
+        """Yields ((window begin, window end), message ids) tuples for the time windows 
+        window begin <= epoch secs < window end that start every step from begin up to end.
+        begin and end are datetimes or epoch secs. window_size and step are timedeltas or 
+        seconds and step defaults to window_size. The message ids of each window are in 
+        ascending epoch secs order and the sorted_message_ids sorted set is read once.
+        """
+        begin_secs = self._epoch_secs_bound(begin,None)
+        end_secs = self._epoch_secs_bound(end,None)
+        if begin_secs == None or end_secs == None:
+            raise Exception("Time windows need both a begin and an end.")
+        if step == None:
+            step = window_size
+        if not isinstance(window_size,(int,long,float)):
+            window_size = window_size.total_seconds()
+        if not isinstance(step,(int,long,float)):
+            step = step.total_seconds()
+        if window_size <= 0 or step <= 0:
+            raise Exception("Time windows need a positive size and step.")
+            
+        tups = self.iterMessageIDsInTimeRange(begin_secs,end_secs)
+        pending = next(tups,None)
+        window = deque()
+        window_begin = begin_secs
+        while window_begin <= end_secs:
+            window_end = window_begin + window_size
+            
+            # Drop the messages before the window and add the messages in the window
+            while len(window) > 0 and window[0][1] < window_begin:
+                window.popleft()
+            while pending != None and pending[1] < window_end:
+                if pending[1] >= window_begin:
+                    window.append(pending)
+                pending = next(tups,None)
+                
+            yield (window_begin,window_end), [mid for mid, secs in window]
+            window_begin += step
                 
     #========== Methods for accessing communication relationship data ==========#                
                 
@@ -302,116 +796,416 @@ class DB(Borg):
         """Returns a list of all directed communication relationship ids if it exists or 
         None otherwise.
         """
+        if self._columnar_snapshot != None:
+            return self._columnar_snapshot.getAllDirectedCommRelationshipIDs() or None
         self.checkRedisConnection()        
         self.checkRedisKey('mids_per_directed_comm_relationship')
         rel_ids = self.redisDB.hkeys('mids_per_directed_comm_relationship')
         if len(rel_ids) == 0:
             return None
         else:
-            # Convert strings back to tuples before returning
-            return [eval(rel_id) for rel_id in rel_ids]
+            # Convert the keys back to tuples before returning
+            return self._codec().decodeRelationshipKeys(rel_ids)
+            
+    def iterAllDirectedCommRelationshipIDs(self,batch_size=None):
+        """Iterates over all directed communication relationship ids, reading the relationship
+        hash with HSCAN in batches of about batch_size entries instead of all at once."""
+        for rel_id, tlist in self._iter_directed_comm_relationships(batch_size,False):
+            yield rel_id
+            
+    def iterAllDirectedCommRelationships(self,batch_size=None):
+        """Iterates over (relationship id, list of (message id, epoch secs) tuples) pairs for
+        all directed communication relationships, reading the relationship hash with HSCAN
+        in batches of about batch_size entries. See getDirectedCommRelationship for the
+        tuples."""
+        return self._iter_directed_comm_relationships(batch_size,True)
+        
+    def _iter_directed_comm_relationships(self,batch_size,with_messages):
+        """Iterates over (relationship id, message tuples) pairs. The message tuples are None
+        unless with_messages = True."""
+        if self._columnar_snapshot != None:
+            for rel_id in self._columnar_snapshot.getAllDirectedCommRelationshipIDs():
+                if with_messages:
+                    yield rel_id, self._columnar_snapshot.getDirectedCommRelationship(rel_id)
+                else:
+                    yield rel_id, None
+            return
+        for rel_id, tlist in self._iter_redis_directed_comm_relationships(batch_size,with_messages):
+            yield rel_id, tlist
+            
+    def _iter_redis_directed_comm_relationships(self,batch_size,with_messages):
+        """Iterates over (relationship id, message tuples) pairs read from Redis with HSCAN,
+        even when a columnar snapshot is open. The message tuples are None unless 
+        with_messages = True."""
+        self.checkRedisConnection()
+        self.checkRedisKey('mids_per_directed_comm_relationship')
+        codec = self._codec()
+        for data in self._scan_hash('mids_per_directed_comm_relationship',batch_size):
+            keys = data.keys()
+            rel_ids = codec.decodeRelationshipKeys(keys)
+            if with_messages:
+                tlists = codec.decodeRelationships([data[key] for key in keys])
+            else:
+                tlists = [None] * len(keys)
+            for rel_id, tlist in zip(rel_ids,tlists):
+                yield rel_id, tlist
             
     def getDirectedCommRelationship(self,rel_id):
         """Returns a list of (message id, epoch secs) tuples for the directed communication
         relationship rel_id = (sender address,recipient address) if it exists or None otherwise.
+        The tuples are in ascending epoch secs order. If the relationship lists were built with
+        recipient roles, the tuples are (message id, epoch secs, role) where role is 'to', 
+        'cc' or 'bcc', the first recipient field of the message listing the recipient.
         """
+        if self._columnar_snapshot != None:
+            return self._columnar_snapshot.getDirectedCommRelationship(rel_id)
         self.checkRedisConnection()                   
         self.checkRedisKey('mids_per_directed_comm_relationship')
-        if self.redisDB.hexists('mids_per_directed_comm_relationship',str(rel_id)):
-            return marshal.loads(self.redisDB.hget('mids_per_directed_comm_relationship',str(rel_id)))
-        else:
+        codec = self._codec()
+        key = codec.encodeRelationshipKeys([rel_id])[0]
+        if key == None:
+            return None
+        tlist = self.redisDB.hget('mids_per_directed_comm_relationship',key)
+        if tlist == None:
             return None
+        return codec.decodeRelationships([tlist])[0]
             
     def getSendersForRecipient(self,recip_address):
         """Returns a set of (sender address, (beginning epoch secs, end epoch secs)) tuples
         specifying the directed communication relationships and their temporal extent.
         """
-        return marshal.loads(self.redisDB.hget('senders_per_recipient_address',recip_address))
+        if self._columnar_snapshot != None:
+            return self._columnar_snapshot.getSendersForRecipient(recip_address)
+        return self._codec().decodeExtents(self.redisDB.hget('senders_per_recipient_address',recip_address))
         
     def getRecipientsForSender(self,sender_address):
         """Returns a set of (recipient address, (beginning epoch secs, end epoch secs)) tuples
         specifying the directed communication relationships and their temporal extent.
         """
-        return marshal.loads(self.redisDB.hget('recipients_per_sender_address',sender_address))
+        if self._columnar_snapshot != None:
+            return self._columnar_snapshot.getRecipientsForSender(sender_address)
+        return self._codec().decodeExtents(self.redisDB.hget('recipients_per_sender_address',sender_address))
 
-    #========== Methods for storing and accessing longest common substring data ==========#
-    
-    def _get_lcsubstring_dict_from_redis(self,mids):
-        """Returns the longest common substring dictionary from Redis for the message id
-        pair list, if it exists. Otherwise an empty dictionary is returned.
+    #========== Methods for appending messages ==========#
+
+    def _hmget(self,name,keys):
+        """Returns the values of the keys of the hash name, or an empty list if there are
+        no keys, for which HMGET is an error."""
+        if len(keys) == 0:
+            return []
+        return self.redisDB.hmget(name,keys)
+
+    def addMessages(self,msgs,collapse_duplicates=False):
+        """Appends the message dictionaries msgs to the database and updates the derived
+        structures in place: the messages and message_headers hashes, the sorted_message_ids
+        sorted set, the directed communication relationship lists and the temporal extents
+        of the relationships. The dictionaries use the property names written by the ingest
+        scripts ('message_id', 'datetime', 'epoch_secs', 'subject', 'body', 'sender', 'to',
+        'cc' and 'bcc', see redis_ingest.make_message). Messages that already exist are
+        skipped. Returns the number of messages added.
+
+        The new messages are indexed by content digest in the message_digests and
+        message_ids_per_digest hashes. If collapse_duplicates is True, a message whose
+        content is already held by another message is only added to the index.
+
+        Only the relationships and extents involving the senders and recipients of the new
+        messages are read and rewritten, so the cost is proportional to the batch rather
+        than to the corpus. All of the writes are sent in one MULTI/EXEC transaction, after
+        any new address and message id dictionary entries. A columnar snapshot does not
+        include the new messages until it is rebuilt.
         """
+        self.checkRedisConnection()
+        self.checkRedisKey('messages')
+        codec = self._codec()
 
-        # Ensure that mids is a list
-        if type(mids) != list:
-            raise Exception("mids is not of type list.")
-            
-        # Sort mids to avoid ordering issue
-        mids.sort()
-        
-        # Check to see if a dictionary exists currently for the message id pair
-        if self.redisDB.hexists('lcsubstrings',str(mids)):
-        
-            # get the dictionary
-            d = marshal.loads(self.redisDB.hget('lcsubstrings',str(mids)))
-            
-        else:
-            d = {}
-            
-        return d
-    
-    def _set_lcsubstring_dict_in_redis(self,mids,d):
-        """Inserts the given longest common substring dictionary d for the message id pair mids 
-        into Redis. mids should be of type list. Otherwise an exception will be thrown.
+        # Skip the messages that already exist or were collapsed, along with repeats within
+        # the batch
+        new_msgs = []
+        new_ids = set()
+        msg_ids = [msg['message_id'] for msg in msgs]
+        existing = self._hmget('messages',msg_ids)
+        indexed = self._hmget('message_digests',msg_ids)
+        for msg, value, digest in zip(msgs,existing,indexed):
+            if value == None and digest == None and not msg['message_id'] in new_ids:
+                new_msgs.append(msg)
+                new_ids.add(msg['message_id'])
+        if len(new_msgs) == 0:
+            return 0
+
+        pipe = self.redisDB.pipeline(transaction=True)
+
+        # Index the new messages by content digest. The copies of messages whose content is
+        # in the database or earlier in the batch are dropped if duplicates are collapsed.
+        digests = [message_digest(msg) for msg in new_msgs]
+        digest_keys = list(set(digests))
+        digest_ids = {}
+        for digest, value in zip(digest_keys,self._hmget('message_ids_per_digest',digest_keys)):
+            digest_ids[digest] = []
+            if value != None:
+                digest_ids[digest] = codec.decodeValue(value)
+        unique_msgs = []
+        for msg, digest in zip(new_msgs,digests):
+            if not collapse_duplicates or len(digest_ids[digest]) == 0:
+                unique_msgs.append(msg)
+            digest_ids[digest].append(msg['message_id'])
+            pipe.hset('message_digests',msg['message_id'],codec.encodeValue(digest))
+        for digest in digest_keys:
+            pipe.hset('message_ids_per_digest',digest,codec.encodeValue(sorted(digest_ids[digest])))
+        new_msgs = unique_msgs
+        if len(new_msgs) == 0:
+            pipe.execute()
+            return 0
+
+        # Aggregate the relationships of the new messages
+        aggregates = CommAggregates()
+        for msg in new_msgs:
+            aggregates.add_message(msg)
+        aggregates.sort()
+
+        # Write the messages, the header-only messages and the sorted set entries
+        message_ids = [msg['message_id'] for msg in new_msgs]
+        pipe.hmset('messages',dict(zip(message_ids,codec.encodeMessages(new_msgs))))
+        if self.redisDB.exists('message_headers'):
+            headers = []
+            for msg in new_msgs:
+                header = msg.copy()
+                del header['body']
+                headers.append(header)
+            pipe.hmset('message_headers',dict(zip(message_ids,codec.encodeMessages(headers))))
+        for msg in new_msgs:
+            pipe.zadd('sorted_message_ids',msg['message_id'],msg['epoch_secs'])
+
+        # Merge the new (message id, epoch secs, role) tuples into the relationship lists.
+        # Lists built without recipient roles stay without them.
+        rel_ids = aggregates.rel_lists.keys()
+        keys = codec.encodeRelationshipKeys(rel_ids,True)
+        tlists = self._hmget('mids_per_directed_comm_relationship',keys)
+        for rel_id, key, tlist in zip(rel_ids,keys,tlists):
+            new_tuples = aggregates.rel_lists[rel_id]
+            if tlist == None:
+                tlist = new_tuples
+            else:
+                tlist = codec.decodeRelationships([tlist])[0]
+                if len(tlist) > 0 and len(tlist[0]) == 2:
+                    new_tuples = [tup[:2] for tup in new_tuples]
+                tlist = merge_relationship_lists(tlist,new_tuples)
+            pipe.hset('mids_per_directed_comm_relationship',key,codec.encodeRelationship(tlist))
+
+        # Widen the temporal extents of the relationships by sender and by recipient
+        for name, new_extents in [('recipients_per_sender_address',aggregates.recip_extents),
+                                  ('senders_per_recipient_address',aggregates.sender_extents)]:
+            addresses = new_extents.keys()
+            values = self._hmget(name,addresses)
+            for address, value in zip(addresses,values):
+                extents = {}
+                if value != None:
+                    extents = dict(codec.decodeExtents(value))
+                for other, (min_secs,max_secs) in new_extents[address].iteritems():
+                    if extents.has_key(other):
+                        extent = extents[other]
+                        extents[other] = (min(extent[0],min_secs),max(extent[1],max_secs))
+                    else:
+                        extents[other] = (min_secs,max_secs)
+                pipe.hset(name,address,codec.encodeExtents(set(extents.iteritems())))
+
+        pipe.execute()
+        self.invalidateMessageCache(message_ids)
+        return len(new_msgs)
+
+    #========== Methods for accessing message content digests ==========#
+
+    def getMessageDigest(self,message_id):
+        """Returns the content digest of the message if it was indexed and None otherwise.
+        Messages holding the same content under different message ids have the same digest
+        (see redis_ingest.message_digest)."""
+        self.checkRedisConnection()
+        digest = self.redisDB.hget('message_digests',message_id)
+        if digest == None:
+            return None
+        return self._codec().decodeValue(digest)
+
+    def getDuplicateMessageIDs(self,message_id):
+        """Returns the sorted list of the ids of the messages with the same content as the
+        message, including its own id, or None if the message was not indexed. Copies that
+        were collapsed at load time are included, although they are not stored as messages.
         """
-        if type(mids) == list:
-            
-            # Sort mids to avoid ordering issue
-            mids.sort()
-            
-            # Get the dictionary
-            self.redisDB.hset('lcsubstrings',str(mids),marshal.dumps(d))
-        else:
-            raise Exception("mids is not of type list.")
+        digest = self.getMessageDigest(message_id)
+        if digest == None:
+            return None
+        msg_ids = self.redisDB.hget('message_ids_per_digest',digest)
+        if msg_ids == None:
+            return [message_id]
+        return self._codec().decodeValue(msg_ids)
+
+    def iterDuplicateMessageIDs(self,batch_size=None):
+        """Iterates over the sorted lists of ids of the messages that share their content
+        with other messages, reading the content digest index with HSCAN in batches of about
+        batch_size entries instead of all at once. As with _scan_hash, a list may be returned
+        twice if the index changes during the scan."""
+        self.checkRedisConnection()
+        self.checkRedisKey('message_ids_per_digest')
+        codec = self._codec()
+        for data in self._scan_hash('message_ids_per_digest',batch_size):
+            for value in data.itervalues():
+                msg_ids = codec.decodeValue(value)
+                if len(msg_ids) > 1:
+                    yield msg_ids
+
+    #========== Methods for storing and accessing longest common substring data ==========#
+    
+    def _lcs_hash_name(self,field):
+        """Returns the name of the hash holding the longest common substrings of the given
+        message field. Each field has its own hash mapping message id pairs to substrings,
+        so results for 'Subject' and 'Body' never rewrite each other."""
+        return 'lcsubstrings:%s' % field
+        
+    def _lcs_hash_names(self):
+        """Returns the names of the longest common substring hashes: the legacy hash, which
+        maps message id pairs to dictionaries of substrings keyed by field, followed by the
+        per-field hashes."""
+        self.checkRedisConnection()
+        fields = sorted(self.redisDB.smembers('lcsubstring_fields'))
+        return ['lcsubstrings'] + [self._lcs_hash_name(field) for field in fields]
     
     def setMessagePairLCSubstring(self,mids,field,lcs):
-        """The longest common substring hash maps from message id pairs to a dictionary of 
-        computed longest common substrings for various message fields (such as 'Subject' and
-        'Body'). mids is a list capturing the pair of message IDs. field is the string label
+        """The longest common substring hashes map from message id pairs to the computed 
+        longest common substrings for various message fields (such as 'Subject' and 'Body').
+        mids is a list capturing the pair of message IDs. field is the string label
         corresponding to the message field of interest. lcs is the longest common substring
         between the message fields. The given information is inserted into the hash.
         """
+        if type(mids) != list:
+            raise Exception("mids is not of type list.")
+        self.setMessagePairLCSubstrings([mids],field,[lcs])
         
-        # Get the dictionary for mids
-        d = self._get_lcsubstring_dict_from_redis(mids)
-            
-        # Add the data to the dictionary
-        d[field] = lcs
+    def setMessagePairLCSubstrings(self,pairs,field,lcss):
+        """Inserts the longest common substrings lcss for the message field into the hash for
+        the corresponding message id pairs. All of the entries are written in a single
+        transaction, after any new message id dictionary entries.
+        """
+        if len(pairs) != len(lcss):
+            raise Exception("The number of message pairs and substrings differ.")
+        self.checkRedisConnection()
+        codec = self._codec()
+        pipe = self.redisDB.pipeline(transaction=True)
+        keys = codec.encodeMessagePairKeys(pairs,True)
+        values = [codec.encodeValue(lcs) for lcs in lcss]
+        chunk_size = self.lcs_write_batch_size
+        for i in xrange(0,len(keys),chunk_size):
+            pipe.hmset(self._lcs_hash_name(field),dict(zip(keys[i:i+chunk_size],values[i:i+chunk_size])))
+        pipe.sadd('lcsubstring_fields',field)
+        pipe.execute()
         
-        # Insert the updated dictionary into Redis
-        self._set_lcsubstring_dict_in_redis(mids,d)
+    def bufferMessagePairLCSubstring(self,mids,field,lcs):
+        """Buffers the longest common substring for the message field associated with the
+        pair of message ids. The buffered results are written with setMessagePairLCSubstrings
+        once lcs_write_batch_size of them have accumulated, and when 
+        flushMessagePairLCSubstrings is called. Buffered results are not visible to the 
+        get* methods until they are written.
+        """
+        if self._lcs_buffer == None:
+            self._lcs_buffer = {}
+        pairs, lcss = self._lcs_buffer.setdefault(field,([],[]))
+        pairs.append(mids)
+        lcss.append(lcs)
+        if sum([len(p) for p, l in self._lcs_buffer.itervalues()]) >= self.lcs_write_batch_size:
+            self.flushMessagePairLCSubstrings()
+            
+    def flushMessagePairLCSubstrings(self):
+        """Writes the buffered longest common substrings to the database and returns the 
+        number of results written."""
+        count = 0
+        if self._lcs_buffer != None:
+            buffered = self._lcs_buffer
+            self._lcs_buffer = None
+            for field, (pairs, lcss) in buffered.iteritems():
+                self.setMessagePairLCSubstrings(pairs,field,lcss)
+                count += len(pairs)
+        return count
         
     def getMessagePairLCSubstring(self,mids,field):
         """Returns the longest common substring for the message field associated with the 
         pair of message ids if it exists in the hash. Otherwise None is returned. mids should
         be of type list.
         """
+        if type(mids) != list:
+            raise Exception("mids is not of type list.")
+        return self.getMessagePairLCSubstrings([mids],field)[0]
         
-        # Get the dictionary for mids
-        d = self._get_lcsubstring_dict_from_redis(mids)
+    def getMessagePairLCSubstrings(self,pairs,field):
+        """Returns a list of the longest common substrings for the message field associated 
+        with each of the message id pairs, in the same order as pairs. The substring of a 
+        pair is None if it is not available. The pairs are fetched in chunks of 
+        message_fetch_chunk_size with HMGETs sent through one pipeline. Pairs missing from 
+        the per-field hash are looked up in the legacy hash.
+        """
+        self.checkRedisConnection()
+        codec = self._codec()
+        keys = codec.encodeMessagePairKeys(pairs)
+        lcss = [None] * len(pairs)
         
-        # If the longest common substring for the field is available, return it
-        if d.has_key(field):
-            return d[field]
-        else:
-            return None
+        # Pairs involving unknown message ids have no substrings
+        known = [i for i in xrange(len(keys)) if keys[i] != None]
+        
+        for hash_name in [self._lcs_hash_name(field),'lcsubstrings']:
+            if len(known) == 0 or not self.redisDB.exists(hash_name):
+                continue
+                
+            # Queue an HMGET for each chunk of pairs
+            pipe = self.redisDB.pipeline(transaction=False)
+            chunk_size = self.message_fetch_chunk_size
+            for i in xrange(0,len(known),chunk_size):
+                pipe.hmget(hash_name,[keys[k] for k in known[i:i+chunk_size]])
+            values = [value for chunk in pipe.execute() for value in chunk]
+            
+            # Decode the substrings that were found
+            missing = []
+            for k, value in zip(known,values):
+                if value == None:
+                    missing.append(k)
+                elif hash_name == 'lcsubstrings':
+                    lcss[k] = codec.decodeValue(value).get(field)
+                else:
+                    lcss[k] = codec.decodeValue(value)
+            known = missing
+            
+        return lcss
             
     def clearMessagePairLCSubstrings(self):
-        """Deletes the hash containing longest common substring data."""
-        self.redisDB.delete('lcsubstrings')
+        """Deletes the hashes containing longest common substring data along with any 
+        buffered results."""
+        self._lcs_buffer = None
+        self.redisDB.delete('lcsubstring_fields',*self._lcs_hash_names())
         
-    def getAllLCSMessagePairs(self):
-        """Returns a list of the message id pairs in the longest common substring hash."""
-        return map(eval,self.redisDB.hkeys('lcsubstrings'))
+    def getAllLCSMessagePairs(self,field=None):
+        """Returns a list of the message id pairs in the longest common substring hashes, or
+        only of those with a substring for the given message field."""
+        return list(self.iterAllLCSMessagePairs(field))
+        
+    def iterAllLCSMessagePairs(self,field=None,batch_size=None):
+        """Iterates over the message id pairs in the longest common substring hashes, reading
+        the hashes with HSCAN in batches of about batch_size entries instead of all at once.
+        If field is given, only the pairs with a substring for that field are returned, read
+        from its hash and the legacy hash. A pair found in several hashes is returned once:
+        the keys of each batch are looked up with HMGET in the hashes read before. HSCAN may
+        return an entry twice, so a pair may still be repeated, as with _scan_hash."""
+        codec = self._codec()
+        if field == None:
+            hash_names = self._lcs_hash_names()
+        else:
+            hash_names = [self._lcs_hash_name(field),'lcsubstrings']
+        hash_names = [name for name in hash_names if self.redisDB.exists(name)]
+        for i in xrange(len(hash_names)):
+            for data in self._scan_hash(hash_names[i],batch_size):
+                keys = data.keys()
+                
+                # The legacy hash maps pairs to dictionaries of substrings keyed by field
+                if field != None and hash_names[i] == 'lcsubstrings':
+                    keys = [key for key in keys if codec.decodeValue(data[key]).get(field) != None]
+                for name in hash_names[:i]:
+                    keys = [key for key, value in zip(keys,self._hmget(name,keys)) if value == None]
+                for pair in codec.decodeMessagePairKeys(keys):
+                    yield pair
         
     #========== Methods for storing and accessing Mechanical Turk annotations ==========#
     
@@ -424,7 +1218,7 @@ class DB(Borg):
         if self.redisDB.hexists('mturk_msg_annotations',mid):
         
             # Get the list of annotations for mid
-            annotations = marshal.loads(self.redisDB.hget('mturk_msg_annotations',mid))
+            annotations = self._codec().decodeValue(self.redisDB.hget('mturk_msg_annotations',mid))
             
         else:
             annotations = []
@@ -434,7 +1228,7 @@ class DB(Borg):
             annotations.append((results,description))
         
             # Push the list back to the database
-            self.redisDB.hset('mturk_msg_annotations',mid,marshal.dumps(annotations))
+            self.redisDB.hset('mturk_msg_annotations',mid,self._codec().encodeValue(annotations))
 
     def getMTurkMessageAnnotations(self,mid):
         """Returns a list of (results,description) tuples for the given message id if 
@@ -445,7 +1239,7 @@ class DB(Borg):
         if self.redisDB.hexists('mturk_msg_annotations',mid):
         
             # Return the list of annotations for mid
-            return marshal.loads(self.redisDB.hget('mturk_msg_annotations',mid))
+            return self._codec().decodeValue(self.redisDB.hget('mturk_msg_annotations',mid))
             
         else:
             return None
@@ -455,19 +1249,24 @@ class DB(Borg):
         tuples if annotation data is available. Otherwise None is returned.
         """
         
-        # Get the message ids for which annotation data is available
-        mids = self.redisDB.hkeys('mturk_msg_annotations')
         
         # Build the dictionary if annotation data is available
-        if len(mids) > 0:
-            data = {}
-            for mid in mids:
-                data[mid] = self.getMTurkMessageAnnotations(mid)
-        else:
+        data = dict(self.iterAllMTurkMessageAnnotations())
+        if len(data) == 0:
             data = None
             
         return data
         
+    def iterAllMTurkMessageAnnotations(self,batch_size=None):
+        """Iterates over (message id, list of (results,description) tuples) pairs for all 
+        annotated messages. The annotation hash is read with HSCAN in batches of about 
+        batch_size entries, which return the annotations along with the message ids.
+        """
+        codec = self._codec()
+        for data in self._scan_hash('mturk_msg_annotations',batch_size):
+            for mid, value in data.iteritems():
+                yield mid, codec.decodeValue(value)
+        
     #========== Methods for storing and accessing social relationship metadata ==========#        
     
     def getSocialRelationshipMetadata(self,address):
@@ -475,7 +1274,7 @@ class DB(Borg):
         relationships associated with the given email address. Otherwise None is returned.
         """
         if self.redisDB.hexists('social_relationships',address):
-            rels = marshal.loads(self.redisDB.hget('social_relationships',address))
+            rels = self._codec().decodeValue(self.redisDB.hget('social_relationships',address))
         else:
             rels = None
         return rels
@@ -0,0 +1,33 @@
+from social_signaling.util.time_interval import epoch_secs_to_datetime
+
+class MessageRecord(dict):
+    """Dictionary of message properties. The Datetime property is derived from EpochSecs
+    as a UTC datetime the first time it is accessed, so that records can be decoded without
+    parsing the stored datetime string. Records for messages without a datetime hold
+    Datetime = None explicitly.
+    """
+    
+    def __missing__(self,key):
+        """Derives the Datetime property from EpochSecs when it is first requested."""
+        if key == 'Datetime' and self.has_key('EpochSecs'):
+            dt = epoch_secs_to_datetime(self['EpochSecs'])
+            self['Datetime'] = dt
+            return dt
+        raise KeyError(key)
+        
+    def get(self,key,default=None):
+        """Returns the property for key if it exists and default otherwise."""
+        try:
+            return self[key]
+        except KeyError:
+            return default
+            
+    def copy(self):
+        """Returns a shallow copy of the record."""
+        return MessageRecord(self)
+        
+    def hasDatetime(self):
+        """Returns True if the message has a datetime. The datetime is not constructed."""
+        if self.has_key('Datetime'):
+            return dict.__getitem__(self,'Datetime') != None
+        return self.has_key('EpochSecs')
@@ -0,0 +1,479 @@
+"""Memory-mapped columnar snapshot of the message corpus.
+
+A snapshot is a single read-only file holding the messages and the directed communication
+relationships as fixed-width columns. ColumnarSnapshot maps the file into memory and reads
+values straight out of the mapping, so opening a snapshot is instantaneous and worker
+processes reading the same snapshot share the operating system page cache instead of each
+holding a copy of the corpus or querying Redis. Snapshots are written by
+export_columnar_snapshot, see enron_data_ingest/build_columnar_snapshot.py.
+
+File layout
+    MAGIC, '<I' version, the columns (each aligned to 8 bytes), the marshaled table of
+    contents {column name : (byte offset, struct type code, count)} and a footer of the
+    '<Q' table of contents offset followed by MAGIC. All integers are little-endian.
+
+Messages are stored as rows in ascending epoch secs order:
+    message_ids         string table of the message ids
+    message_index       'I' open addressing hash table of rows for message id lookups,
+                        indexed by the CRC-32 of the message id with linear probing, a
+                        power of two in size and EMPTY_SLOT in unused slots
+    epoch_secs          'q' epoch secs
+    flags               'B' HAS_DATETIME, HAS_BODY, SUBJECT_UNICODE, BODY_UNICODE
+    sender              'I' sender address id
+    to, cc, bcc         CSR recipient lists: '<role>_offsets' 'Q' (rows + 1) into the 'I'
+                        address ids of '<role>_ids'
+    subject, body       string tables, unicode values are stored UTF-8 encoded
+
+Addresses are stored as the string table 'addresses' in sorted order, so an address id is
+the position of the address in the sorted list. The address list is small and is read into
+memory on first use.
+
+Directed communication relationships are stored in (sender id, recipient id) order:
+    rel_keys            'Q' sender id << 32 | recipient id
+    rel_offsets         'Q' (relationships + 1) into the 'I' message rows of 'rel_rows',
+                        in the order of the stored relationship lists, and the 'B'
+                        ROLE_CODES of the recipient in each message of 'rel_roles' (0 if
+                        the relationship lists store no roles)
+    rel_min_secs,       'q' temporal extent of the relationship
+    rel_max_secs
+    rel_recipient_keys  'Q' recipient id << 32 | sender id in ascending order and
+    rel_recipient_order 'I' the corresponding relationships
+
+A string table <name> consists of the 'Q' byte offsets '<name>_offsets' (count + 1) into the
+bytes of '<name>_blob'.
+"""
+
+import os
+import mmap
+import marshal
+import struct
+from bisect import bisect_left, bisect_right
+from zlib   import crc32
+from social_signaling.db_access.record_encoding import HAS_DATETIME, HAS_BODY, ROLE_CODES, ROLES
+
+MAGIC = 'SSCOLSNP'
+VERSION = 1
+
+# Flags marking UTF-8 encoded unicode subjects and bodies
+SUBJECT_UNICODE = 0x04
+BODY_UNICODE = 0x08
+
+# Unused slot of the message id hash table
+EMPTY_SLOT = 0xffffffff
+
+_version_struct = struct.Struct('<I')
+_footer_struct = struct.Struct('<Q')
+
+# Number of values packed per write
+_write_chunk_size = 65536
+
+#========== Reading snapshots ==========#
+
+class _Column(object):
+    """Read-only sequence view of a fixed-width column in a memory-mapped snapshot."""
+
+    def __init__(self,buf,offset,code,count):
+        self._buf = buf
+        self._offset = offset
+        self._code = code
+        self._struct = struct.Struct('<' + code)
+        self._size = self._struct.size
+        self._count = count
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self,i):
+        if i < 0:
+            i += self._count
+        if i < 0 or i >= self._count:
+            raise IndexError("column index out of range")
+        return self._struct.unpack_from(self._buf,self._offset + i*self._size)[0]
+
+    def slice(self,start,stop):
+        """Returns a tuple of the values in rows start up to stop."""
+        return struct.unpack_from('<%d%s' % (stop-start,self._code),self._buf,self._offset + start*self._size)
+
+class _Strings(object):
+    """Read-only sequence view of a string table in a memory-mapped snapshot."""
+
+    def __init__(self,offsets,blob_offset,buf):
+        self._offsets = offsets
+        self._blob_offset = blob_offset
+        self._buf = buf
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def __getitem__(self,i):
+        start, stop = self._offsets.slice(i,i+2)
+        return self._buf[self._blob_offset+start:self._blob_offset+stop]
+
+    def slice(self,start,stop):
+        """Returns a list of the strings start up to stop."""
+        offsets = self._offsets.slice(start,stop+1)
+        base = offsets[0]
+        blob = self._buf[self._blob_offset+base:self._blob_offset+offsets[-1]]
+        return [blob[offsets[i]-base:offsets[i+1]-base] for i in xrange(len(offsets)-1)]
+
+    def all(self):
+        """Returns a list of all of the strings."""
+        return self.slice(0,len(self))
+
+class ColumnarSnapshot(object):
+    """Read-only access to a columnar snapshot file through a shared memory mapping."""
+
+    def __init__(self,path):
+        self.path = path
+        f = open(path,'rb')
+        try:
+            self._buf = mmap.mmap(f.fileno(),0,access=mmap.ACCESS_READ)
+        finally:
+            f.close()
+
+        # Check the header and footer and read the table of contents
+        n = len(self._buf)
+        if self._buf[:len(MAGIC)] != MAGIC or self._buf[n-len(MAGIC):] != MAGIC:
+            err = "%s is not a columnar snapshot." % path
+            raise Exception(err)
+        version = _version_struct.unpack_from(self._buf,len(MAGIC))[0]
+        if version != VERSION:
+            err = "Unsupported columnar snapshot version %d." % version
+            raise Exception(err)
+        toc_offset = _footer_struct.unpack_from(self._buf,n-len(MAGIC)-_footer_struct.size)[0]
+        self._toc = marshal.loads(self._buf[toc_offset:n-len(MAGIC)-_footer_struct.size])
+
+        self._message_ids = self._strings('message_ids')
+        self._message_index = self._column('message_index')
+        self._epoch_secs = self._column('epoch_secs')
+        self._flags = self._column('flags')
+        self._sender = self._column('sender')
+        self._recipients = [(self._column(role+'_offsets'),self._column(role+'_ids'))
+                            for role in ['to','cc','bcc']]
+        self._subject = self._strings('subject')
+        self._body = self._strings('body')
+        self._address_table = self._strings('addresses')
+        self._addresses = None
+        self._rel_keys = self._column('rel_keys')
+        self._rel_offsets = self._column('rel_offsets')
+        self._rel_rows = self._column('rel_rows')
+        self._rel_roles = self._column('rel_roles')
+        self._rel_min_secs = self._column('rel_min_secs')
+        self._rel_max_secs = self._column('rel_max_secs')
+        self._rel_recipient_keys = self._column('rel_recipient_keys')
+        self._rel_recipient_order = self._column('rel_recipient_order')
+
+    def _column(self,name):
+        offset, code, count = self._toc[name]
+        return _Column(self._buf,offset,code,count)
+
+    def _strings(self,name):
+        return _Strings(self._column(name+'_offsets'),self._toc[name+'_blob'][0],self._buf)
+
+    def close(self):
+        """Unmaps the snapshot file."""
+        self._buf.close()
+
+    def getNumberOfMessages(self):
+        """Returns the number of messages in the snapshot."""
+        return len(self._message_ids)
+
+    def getAllMessageIDs(self):
+        """Returns a list of all message ids in ascending epoch secs order."""
+        return self._message_ids.all()
+
+    def _get_addresses(self):
+        """Returns the sorted list of addresses, reading it on first use."""
+        if self._addresses == None:
+            self._addresses = self._address_table.all()
+        return self._addresses
+
+    def getMessageRowsInTimeRange(self,begin_secs,end_secs):
+        """Returns the range of rows (start, stop) of the messages with begin_secs <= epoch
+        secs <= end_secs. The rows are in ascending epoch secs order, so the range is found
+        by bisection."""
+        start = bisect_left(self._epoch_secs,begin_secs)
+        return start, bisect_right(self._epoch_secs,end_secs,start)
+
+    def getMessageIDsAndEpochSecs(self,start,stop):
+        """Returns the lists of message ids and epoch secs of the rows start up to stop."""
+        return self._message_ids.slice(start,stop), list(self._epoch_secs.slice(start,stop))
+
+    def _find_message_row(self,message_id):
+        """Returns the row of the message or None if the message does not exist."""
+        index = self._message_index
+        mask = len(index) - 1
+        i = crc32(message_id) & mask
+        while True:
+            row = index[i]
+            if row == EMPTY_SLOT:
+                return None
+            if self._message_ids[row] == message_id:
+                return row
+            i = (i + 1) & mask
+
+    def _find_address_id(self,address):
+        """Returns the address id of the address or None if the address is unknown."""
+        addresses = self._get_addresses()
+        i = bisect_left(addresses,address)
+        if i < len(addresses) and addresses[i] == address:
+            return i
+        return None
+
+    def getMessages(self,message_ids,headers_only=False):
+        """Returns a list of message dictionaries with the legacy property names for the
+        referenced messages in the same order as message_ids. The bodies are omitted if
+        headers_only = True. Messages stored without a body have 'body' = None. Raises an
+        exception if a message does not exist.
+        """
+        addresses = self._get_addresses()
+        epoch_secs, flags, sender = self._epoch_secs, self._flags, self._sender
+        subjects, bodies = self._subject, self._body
+        roles = zip(['to','cc','bcc'],self._recipients)
+        msgs = []
+        for mid in message_ids:
+            row = self._find_message_row(mid)
+            if row == None:
+                err = "Message %s does not exist." % mid
+                raise Exception(err)
+            msg_flags = flags[row]
+            msg = { 'message_id' : mid, 'epoch_secs' : epoch_secs[row],
+                    'sender' : addresses[sender[row]] }
+            if not msg_flags & HAS_DATETIME:
+                msg['datetime'] = 'None'
+            for role, (offsets, ids) in roles:
+                start, stop = offsets.slice(row,row+2)
+                msg[role] = [addresses[id] for id in ids.slice(start,stop)]
+            msg['subject'] = subjects[row]
+            if msg_flags & SUBJECT_UNICODE:
+                msg['subject'] = msg['subject'].decode('utf-8')
+            if msg_flags & HAS_BODY and not headers_only:
+                msg['body'] = bodies[row]
+                if msg_flags & BODY_UNICODE:
+                    msg['body'] = msg['body'].decode('utf-8')
+            elif not headers_only:
+                msg['body'] = None
+            msgs.append(msg)
+        return msgs
+
+    def getAllDirectedCommRelationshipIDs(self):
+        """Returns a list of all (sender address, recipient address) relationship ids."""
+        addresses = self._get_addresses()
+        return [(addresses[key >> 32],addresses[key & 0xffffffff])
+                for key in self._rel_keys.slice(0,len(self._rel_keys))]
+
+    def _find_relationship(self,sender_id,recipient_id):
+        key = sender_id << 32 | recipient_id
+        i = bisect_left(self._rel_keys,key)
+        if i < len(self._rel_keys) and self._rel_keys[i] == key:
+            return i
+        return None
+
+    def getDirectedCommRelationship(self,rel_id):
+        """Returns the list of (message id, epoch secs) tuples of the relationship rel_id =
+        (sender address, recipient address) or None if it does not exist."""
+        sender_id = self._find_address_id(rel_id[0])
+        recipient_id = self._find_address_id(rel_id[1])
+        if sender_id == None or recipient_id == None:
+            return None
+        i = self._find_relationship(sender_id,recipient_id)
+        if i == None:
+            return None
+        start, stop = self._rel_offsets.slice(i,i+2)
+        tlist = [(self._message_ids[row],self._epoch_secs[row]) for row in self._rel_rows.slice(start,stop)]
+        roles = self._rel_roles.slice(start,stop)
+        if len(roles) > 0 and roles[0] != 0:
+            tlist = [tup + (ROLES[code],) for tup, code in zip(tlist,roles)]
+        return tlist
+
+    def _extents(self,keys,order,address):
+        """Returns the set of (address, (min epoch secs, max epoch secs)) tuples of the
+        relationships whose keys in the sorted column keys start with the address id."""
+        id = self._find_address_id(address)
+        if id == None:
+            return set()
+        start = bisect_left(keys,id << 32)
+        stop = bisect_left(keys,(id+1) << 32,start)
+        addresses = self._get_addresses()
+        extents = set()
+        for i in xrange(start,stop):
+            rel = i if order == None else order[i]
+            extents.add((addresses[keys[i] & 0xffffffff],
+                         (self._rel_min_secs[rel],self._rel_max_secs[rel])))
+        return extents
+
+    def getRecipientsForSender(self,sender_address):
+        """Returns a set of (recipient address, (beginning epoch secs, end epoch secs)) tuples."""
+        return self._extents(self._rel_keys,None,sender_address)
+
+    def getSendersForRecipient(self,recip_address):
+        """Returns a set of (sender address, (beginning epoch secs, end epoch secs)) tuples."""
+        return self._extents(self._rel_recipient_keys,self._rel_recipient_order,recip_address)
+
+#========== Writing snapshots ==========#
+
+class _SnapshotWriter(object):
+    """Writes columns to a snapshot file and records them in the table of contents."""
+
+    def __init__(self,f):
+        self._f = f
+        self._toc = {}
+        f.write(MAGIC + _version_struct.pack(VERSION))
+
+    def _align(self):
+        pad = -self._f.tell() % 8
+        self._f.write('\0' * pad)
+        return self._f.tell()
+
+    def writeColumn(self,name,code,values):
+        offset = self._align()
+        for i in xrange(0,len(values),_write_chunk_size):
+            chunk = values[i:i+_write_chunk_size]
+            self._f.write(struct.pack('<%d%s' % (len(chunk),code),*chunk))
+        self._toc[name] = (offset,code,len(values))
+
+    def writeStrings(self,name,strings):
+        """Writes the string table name from the iterable of byte strings."""
+        offset = self._align()
+        offsets = [0]
+        for s in strings:
+            self._f.write(s)
+            offsets.append(offsets[-1] + len(s))
+        self._toc[name+'_blob'] = (offset,'B',offsets[-1])
+        self.writeColumn(name+'_offsets','Q',offsets)
+
+    def close(self):
+        toc_offset = self._align()
+        self._f.write(marshal.dumps(self._toc))
+        self._f.write(_footer_struct.pack(toc_offset) + MAGIC)
+
+def _utf8(s):
+    """Returns s as a byte string and whether it was unicode."""
+    if isinstance(s,unicode):
+        return s.encode('utf-8'), True
+    return s, False
+
+def _message_index(mids):
+    """Returns the slots of the message id hash table for the list of message ids."""
+    size = 1
+    while size < 2*len(mids):
+        size *= 2
+    mask = size - 1
+    index = [EMPTY_SLOT] * size
+    for row, mid in enumerate(mids):
+        i = crc32(mid) & mask
+        while index[i] != EMPTY_SLOT:
+            i = (i + 1) & mask
+        index[i] = row
+    return index
+
+def export_columnar_snapshot(db,path,batch_size=1000):
+    """Writes the messages and directed communication relationships of the database behind
+    the DB instance db to a columnar snapshot at path. They are read from the Redis backend
+    of db, bypassing the message cache and any columnar snapshot db has open. The file is
+    replaced atomically."""
+    db.checkRedisConnection()
+    rdb = db.redisDB
+
+    # Rows are in ascending epoch secs order
+    if rdb.exists('sorted_message_ids'):
+        mids = rdb.zrange('sorted_message_ids',0,-1)
+    else:
+        mids = rdb.hkeys(db._message_hash_name(True))
+        secs = []
+        for i in xrange(0,len(mids),batch_size):
+            secs.extend([msg['EpochSecs'] for msg in db._get_messages_from_redis(mids[i:i+batch_size],True)])
+        mids = [mid for s, mid in sorted(zip(secs,mids))]
+    row_of = dict(zip(mids,xrange(len(mids))))
+
+    # Read the message headers. Addresses are collected first and the ids assigned once
+    # the sorted list of addresses is known.
+    epoch_secs, flags, senders, subjects = [], [], [], []
+    recipients = dict([(role,([0],[])) for role in ['TO','CC','BCC']])
+    for i in xrange(0,len(mids),batch_size):
+        for msg in db._get_messages_from_redis(mids[i:i+batch_size],True):
+            subject, is_unicode = _utf8(msg['Subject'])
+            epoch_secs.append(msg['EpochSecs'])
+            flags.append((msg.hasDatetime() and HAS_DATETIME) | (is_unicode and SUBJECT_UNICODE))
+            senders.append(msg['Sender'])
+            subjects.append(subject)
+            for role, (offsets, addresses) in recipients.iteritems():
+                addresses.extend(msg[role])
+                offsets.append(len(addresses))
+        print "%d of %d message headers read." % (min(i+batch_size,len(mids)),len(mids))
+
+    # Read the relationships with HSCAN. Empty relationship lists have no messages or
+    # temporal extent and are left out.
+    rels = []
+    for rel_id, tlist in db._iter_redis_directed_comm_relationships(batch_size,True):
+        if len(tlist) == 0:
+            continue
+        roles = [len(tup) > 2 and ROLE_CODES[tup[2]] or 0 for tup in tlist]
+        rels.append((rel_id,[row_of[tup[0]] for tup in tlist],roles,tlist[0][1],tlist[-1][1]))
+    print "%d relationships read." % len(rels)
+
+    # Assign the address ids
+    addresses = set(senders)
+    for offsets, role_addresses in recipients.values():
+        addresses.update(role_addresses)
+    for rel in rels:
+        addresses.update(rel[0])
+    addresses = sorted(addresses)
+    address_id = dict(zip(addresses,xrange(len(addresses))))
+
+    tmp_path = path + '.tmp'
+    f = open(tmp_path,'wb')
+    try:
+        writer = _SnapshotWriter(f)
+        writer.writeStrings('message_ids',mids)
+        writer.writeColumn('message_index','I',_message_index(mids))
+        writer.writeColumn('epoch_secs','q',epoch_secs)
+        writer.writeColumn('sender','I',[address_id[a] for a in senders])
+        for role, (offsets, role_addresses) in recipients.iteritems():
+            writer.writeColumn(role.lower()+'_offsets','Q',offsets)
+            writer.writeColumn(role.lower()+'_ids','I',[address_id[a] for a in role_addresses])
+        writer.writeStrings('subject',subjects)
+        writer.writeStrings('addresses',addresses)
+        del senders, subjects, recipients
+
+        # Relationships, by sender and by recipient
+        keys = [address_id[rel_id[0]] << 32 | address_id[rel_id[1]] for rel_id, rows, roles, mn, mx in rels]
+        order = sorted(xrange(len(rels)),key=keys.__getitem__)
+        rels = [rels[i] for i in order]
+        writer.writeColumn('rel_keys','Q',[keys[i] for i in order])
+        rel_offsets = [0]
+        rel_rows = []
+        rel_roles = []
+        for rel_id, rows, roles, min_secs, max_secs in rels:
+            rel_rows.extend(rows)
+            rel_roles.extend(roles)
+            rel_offsets.append(len(rel_rows))
+        writer.writeColumn('rel_offsets','Q',rel_offsets)
+        writer.writeColumn('rel_rows','I',rel_rows)
+        writer.writeColumn('rel_roles','B',rel_roles)
+        writer.writeColumn('rel_min_secs','q',[rel[3] for rel in rels])
+        writer.writeColumn('rel_max_secs','q',[rel[4] for rel in rels])
+        keys = [address_id[rel_id[1]] << 32 | address_id[rel_id[0]] for rel_id, rows, roles, mn, mx in rels]
+        order = sorted(xrange(len(rels)),key=keys.__getitem__)
+        writer.writeColumn('rel_recipient_keys','Q',[keys[i] for i in order])
+        writer.writeColumn('rel_recipient_order','I',order)
+        del rels, rel_rows, rel_roles, keys, order
+
+        # Stream the bodies, which are only fetched now to bound the memory use
+        def bodies():
+            for i in xrange(0,len(mids),batch_size):
+                for msg in db._get_messages_from_redis(mids[i:i+batch_size]):
+                    row = row_of[msg['MessageID']]
+                    if msg.has_key('Body') and msg['Body'] != None:
+                        body, is_unicode = _utf8(msg['Body'])
+                        flags[row] |= HAS_BODY | (is_unicode and BODY_UNICODE)
+                        yield body
+                    else:
+                        yield ''
+                print "%d of %d message bodies written." % (min(i+batch_size,len(mids)),len(mids))
+        writer.writeStrings('body',bodies())
+        writer.writeColumn('flags','B',flags)
+        writer.close()
+    finally:
+        f.close()
+    os.rename(tmp_path,path)
@@ -0,0 +1,84 @@
+"""Memoized normalization of the message dates and addresses read by the ingest scripts.
+
+The loaders used to normalize each message date by formatting it, appending the timezone
+and reparsing the string with dateutil, and each address by decoding and escaping it, even
+though a few hundred timezone strings and some tens of thousands of addresses recur across
+millions of rows. Here the UTC offset of each distinct timezone is computed once and the
+epoch seconds and UTC datetime are derived from it arithmetically, and each distinct
+address is normalized once and kept in an intern table, so that every message shares the
+same string object for an address.
+
+The results are identical to those of the original expressions:
+
+    utc_dt = parse(msg_dt.strftime('%Y/%m/%d %H:%M:%S') + ' ' + msg_tz[:5]).astimezone(tz.tzoffset('',0))
+    epoch_secs = timegm(utc_dt.utctimetuple())
+    address = cgi.escape(address.decode('iso-8859-1')).encode('ascii','xmlcharrefreplace')
+
+Timezones that do not start with a numeric '+HHMM' offset still go through dateutil. The
+tables only grow, so a long-running process reading unrelated corpora can empty them with
+clear_caches().
+"""
+
+import cgi
+import re
+from calendar        import timegm
+from datetime        import datetime, timedelta
+from dateutil        import tz
+from dateutil.parser import parse
+
+# The timezone of the normalized datetimes
+UTC = tz.tzoffset('',0)
+
+# A numeric UTC offset, as in the UC Berkeley timezone strings ('-0700 (PDT)')
+OFFSET_PATTERN = re.compile(r'[+-]\d{4}$')
+
+EPOCH = datetime(1970,1,1)
+
+# UTC offset in secs of each timezone prefix, or None if the prefix is not numeric
+_offsets = {}
+
+# Normalized address of each raw address
+_addresses = {}
+
+def clear_caches():
+    """Empties the timezone and address tables."""
+    _offsets.clear()
+    _addresses.clear()
+
+def utc_offset(msg_tz):
+    """Returns the UTC offset in secs of the '+HHMM' prefix of the timezone string, or None
+    if it does not start with a numeric offset."""
+    prefix = msg_tz[:5]
+    try:
+        return _offsets[prefix]
+    except KeyError:
+        offset = None
+        if OFFSET_PATTERN.match(prefix):
+            offset = int(prefix[1:3])*3600 + int(prefix[3:5])*60
+            if prefix[0] == '-':
+                offset = -offset
+        _offsets[prefix] = offset
+        return offset
+
+def normalize_datetime(msg_dt,msg_tz):
+    """Returns the (UTC datetime, epoch secs) tuple of the naive local datetime of a message
+    and its timezone string."""
+    offset = utc_offset(msg_tz)
+    if offset == None:
+        utc_dt = parse(msg_dt.strftime('%Y/%m/%d %H:%M:%S') + ' ' + msg_tz[:5]).astimezone(UTC)
+        return utc_dt, timegm(utc_dt.utctimetuple())
+
+    # the fractional seconds are dropped, as they were by strftime()
+    utc_dt = msg_dt.replace(microsecond=0,tzinfo=None) - timedelta(seconds=offset)
+    delta = utc_dt - EPOCH
+    return utc_dt.replace(tzinfo=UTC), delta.days*86400 + delta.seconds
+
+def normalize_address(address):
+    """Decodes the address from ISO-8859-1 and encodes it in ASCII preserving extended
+    characters. Returns the interned normalized string."""
+    try:
+        return _addresses[address]
+    except KeyError:
+        normalized = intern(cgi.escape(address.decode('iso-8859-1')).encode('ascii','xmlcharrefreplace'))
+        _addresses[address] = normalized
+        return normalized
@@ -0,0 +1,126 @@
+"""Streaming reader for the UC Berkeley Enron MySQL database used by the ingest scripts.
+
+The ingest scripts used to fetchall() the message and recipient joins, which holds every
+message body in client memory at once. IngestReader instead reads each query through its
+own connection in chunks of chunk_size rows and merges the message and recipient streams
+on the message key, so that the loaders receive one message at a time along with its
+recipients:
+
+    reader = IngestReader(mysql_connector(host='localhost',user='root',passwd='',db='berkeley_enron'))
+    for msg, recips in reader.messages():
+        ...
+
+The message rows have the layout (sender email, date, timezone, smtpid, subject, body) and
+the recipient rows (smtpid, reciptype, reciporder, email), as in the original queries.
+
+With MySQL the connections use server-side cursors (MySQLdb.cursors.SSCursor), so rows
+are streamed from the server instead of being buffered by the client library, and peak
+memory does not grow with the size of the corpus. Any DB-API connection works, so a
+SQLite database with the msgs, recip_info and addresses tables can stand in for MySQL:
+
+    reader = IngestReader(lambda: sqlite3.connect(path,detect_types=sqlite3.PARSE_DECLTYPES))
+"""
+
+from functools import partial
+
+# Number of rows fetched from the server at a time
+CHUNK_SIZE = 1000
+
+# The message and recipient joins, both ordered by the message key so that they can be
+# merged in a single pass. The key is the first column of each row. The joins can be
+# restricted to a partition of the message keys.
+MESSAGE_QUERY = ("select t1.mid, t2.email, t1.date, t1.timezone, t1.smtpid, t1.subject, t1.body "
+                 "from msgs as t1, addresses as t2 where t1.eid = t2.eid%s order by t1.mid;")
+RECIPIENT_QUERY = ("select t1.mid, t1.smtpid, t2.reciptype, t2.reciporder, t3.email "
+                   "from msgs as t1, recip_info as t2, addresses as t3 "
+                   "where t1.mid = t2.mid and t2.eid = t3.eid%s order by t1.mid;")
+PARTITION_CLAUSE = " and t1.mid %% %d = %d"
+RESUME_CLAUSE = " and t1.mid > %d"
+COUNT_QUERY = "select count(*) from msgs as t1, addresses as t2 where t1.eid = t2.eid;"
+
+def _mysql_connect(**kwargs):
+    import MySQLdb
+    import MySQLdb.cursors
+    return MySQLdb.connect(cursorclass=MySQLdb.cursors.SSCursor,**kwargs)
+
+def mysql_connector(**kwargs):
+    """Returns a function opening MySQL connections with the given MySQLdb.connect
+    arguments whose cursors are server-side cursors. The function can be pickled, so it
+    can be handed to worker processes."""
+    return partial(_mysql_connect,**kwargs)
+
+class IngestReader(object):
+    """Streams the rows of the UC Berkeley Enron database. connect is a function returning
+    a new DB-API connection. Each query is read through a connection of its own, since a
+    server-side cursor must be exhausted before its connection can run another query.
+
+    If num_partitions is greater than one, messages() only yields the messages whose key
+    is congruent to partition modulo num_partitions, so that the partitions can be read by
+    separate processes. If start_after is given, only the messages whose key is greater
+    are yielded, so that an interrupted ingest can resume after the last message key it
+    loaded."""
+
+    def __init__(self,connect,chunk_size=CHUNK_SIZE,partition=0,num_partitions=1,start_after=None):
+        self.connect = connect
+        self.chunk_size = chunk_size
+        self.partition = partition
+        self.num_partitions = num_partitions
+        self.start_after = start_after
+
+    def partition_reader(self,partition,num_partitions,start_after=None):
+        """Returns a reader for the given partition of the message keys."""
+        return IngestReader(self.connect,self.chunk_size,partition,num_partitions,start_after)
+
+    def rows(self,query):
+        """Generator yielding the rows of the query, fetched chunk_size rows at a time."""
+        conn = self.connect()
+        try:
+            cursor = conn.cursor()
+            cursor.execute(query)
+            while True:
+                rows = cursor.fetchmany(self.chunk_size)
+                if not rows:
+                    break
+                for row in rows:
+                    yield row
+            cursor.close()
+        finally:
+            conn.close()
+
+    def count_messages(self):
+        """Returns the number of messages with a sender address."""
+        return int(list(self.rows(COUNT_QUERY))[0][0])
+
+    def messages(self):
+        """Generator yielding a (message row, list of recipient rows) tuple for each message
+        with a sender address. Recipients of messages without one are skipped."""
+        for key, msg, recips in self.keyed_messages():
+            yield msg, recips
+
+    def keyed_messages(self):
+        """Generator yielding a (message key, message row, list of recipient rows) tuple for
+        each message with a sender address, in ascending order of the keys."""
+        clause = ''
+        if self.num_partitions > 1:
+            clause += PARTITION_CLAUSE % (self.num_partitions,self.partition)
+        if self.start_after != None:
+            clause += RESUME_CLAUSE % self.start_after
+        recips = self.rows(RECIPIENT_QUERY % clause)
+        recip = next(recips,None)
+        for msg in self.rows(MESSAGE_QUERY % clause):
+            key = msg[0]
+
+            # skip the recipients of messages that precede this one
+            while recip != None and recip[0] < key:
+                recip = next(recips,None)
+
+            # gather the recipients of this message
+            msg_recips = []
+            while recip != None and recip[0] == key:
+                msg_recips.append(recip[1:])
+                recip = next(recips,None)
+
+            yield key, msg[1:], msg_recips
+
+        # release the recipient connection
+        recips.close()
@@ -0,0 +1,154 @@
+"""Streaming reader for local mail files, a stand-in for IngestReader that needs no MySQL.
+
+MailReader parses the files under a path with the stdlib email and mailbox packages and
+yields the messages with the same row layouts as IngestReader.messages(), so the ingest
+scripts load a new mailbox dump without staging it in MySQL first:
+
+    message row    (sender email, date, timezone, smtpid, subject, body)
+    recipient row  (smtpid, reciptype, reciporder, email)
+
+The date is the naive datetime of the Date header in the sender's local time and the
+timezone starts with the '+HHMM' offset of the header, as in the UC Berkeley database, so
+the loaders normalize both exactly as they do the MySQL rows. The addresses are lowercased
+like those of the UC Berkeley database. Messages without a Message-ID or a sender address
+are skipped.
+
+The path may be an mbox file, a maildir or any directory tree of mbox files and files
+holding a single message, such as the Enron maildir distribution. Files starting with a
+'From ' line are read as mbox files. The files are visited in sorted order and only one
+message is held in memory at a time. The files are split into partitions by their position
+in that order, so that the partitions can be read by separate processes.
+"""
+
+import email
+import mailbox
+import os
+from datetime    import datetime
+from email.utils import getaddresses, parseaddr, parsedate_tz
+
+# The recipient headers and the corresponding recipient types
+RECIPIENT_HEADERS = [('to','To'),('cc','Cc'),('bcc','Bcc')]
+
+def _is_mbox(path):
+    f = open(path,'rb')
+    try:
+        return f.read(5) == 'From '
+    finally:
+        f.close()
+
+def _body(msg):
+    """Returns the text of the message, joining the text/plain parts of multipart messages."""
+    if not msg.is_multipart():
+        return msg.get_payload(decode=True) or ''
+    parts = [part.get_payload(decode=True) for part in msg.walk()
+             if part.get_content_type() == 'text/plain' and not part.is_multipart()]
+    return '\n'.join([part for part in parts if part])
+
+def message_rows(msg):
+    """Returns the (message row, list of recipient rows) tuple for the email.message.Message
+    msg, or None if it has no Message-ID or sender address."""
+    smtpid = (msg.get('Message-ID') or '').strip()
+    sender = parseaddr(msg.get('From') or '')[1].lower()
+    if not smtpid or not sender:
+        return None
+
+    # the local datetime and the UTC offset of the Date header
+    msg_dt = None
+    msg_tz = None
+    date = parsedate_tz(msg.get('Date') or '')
+    if date != None:
+        try:
+            msg_dt = datetime(*date[:6])
+        except ValueError:
+            pass
+        else:
+            offset = date[9] or 0
+            sign = '+'
+            if offset < 0:
+                sign = '-'
+            msg_tz = '%s%02d%02d' % (sign,abs(offset) / 3600,abs(offset) % 3600 / 60)
+
+    recips = []
+    for recip_type, header in RECIPIENT_HEADERS:
+        addresses = [address for name, address in getaddresses(msg.get_all(header,[])) if address]
+        for order, address in enumerate(addresses):
+            recips.append((smtpid,recip_type,order,address.lower()))
+
+    return (sender,msg_dt,msg_tz,smtpid,msg.get('Subject') or '',_body(msg)), recips
+
+class MailReader(object):
+    """Streams the messages of the mail files under path. The methods mirror those of
+    IngestReader: the messages are keyed by their position in the partition, so an
+    interrupted ingest can resume after the last position it loaded with start_after."""
+
+    def __init__(self,path,partition=0,num_partitions=1,start_after=None):
+        self.path = path
+        self.partition = partition
+        self.num_partitions = num_partitions
+        self.start_after = start_after
+
+    def partition_reader(self,partition,num_partitions,start_after=None):
+        """Returns a reader for the given partition of the files."""
+        return MailReader(self.path,partition,num_partitions,start_after)
+
+    def files(self):
+        """Returns the sorted list of the files of this partition."""
+        if os.path.isfile(self.path):
+            paths = [self.path]
+        else:
+            paths = []
+            for dirpath, dirnames, filenames in os.walk(self.path):
+                dirnames.sort()
+                paths.extend([os.path.join(dirpath,name) for name in sorted(filenames)])
+        return paths[self.partition::self.num_partitions]
+
+    def _file_messages(self,path):
+        if _is_mbox(path):
+            box = mailbox.mbox(path,create=False)
+            try:
+                for msg in box:
+                    yield msg
+            finally:
+                box.close()
+        else:
+            f = open(path,'rb')
+            try:
+                msg = email.message_from_file(f)
+            finally:
+                f.close()
+            yield msg
+
+    def count_messages(self):
+        """Returns the number of messages in the files of this partition, including those
+        that are skipped."""
+        count = 0
+        for path in self.files():
+            if _is_mbox(path):
+                box = mailbox.mbox(path,create=False)
+                try:
+                    count += len(box)
+                finally:
+                    box.close()
+            else:
+                count += 1
+        return count
+
+    def messages(self):
+        """Generator yielding a (message row, list of recipient rows) tuple for each
+        message."""
+        for key, msg, recips in self.keyed_messages():
+            yield msg, recips
+
+    def keyed_messages(self):
+        """Generator yielding a (message key, message row, list of recipient rows) tuple for
+        each message, in ascending order of the keys."""
+        key = 0
+        for path in self.files():
+            for msg in self._file_messages(path):
+                rows = message_rows(msg)
+                if rows == None:
+                    continue
+                key += 1
+                if self.start_after != None and key <= self.start_after:
+                    continue
+                yield key, rows[0], rows[1]
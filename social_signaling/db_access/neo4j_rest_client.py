@@ -3,13 +3,17 @@ import base64
 import datetime
 import decimal
 import httplib2
+import Queue
 import re
 import simplejson
+import threading
 import time
 from urlparse import urlsplit
 
 __all__ = ("GraphDatabase", "Incoming", "Outgoing", "Undirected",
-           "StopAtDepth", "NotFoundError", "StatusException")
+           "StopAtDepth", "NotFoundError", "StatusException",
+           "ConnectionPool", "configure_pool", "ConcurrentExecutor",
+           "WriteBatch", "BatchReference")
 __author__ = "Javier de la Rosa, and Diego Muñoz Escalante"
 __credits__ = ["Javier de la Rosa", "Diego Muñoz Escalante"]
 __license__ = "GPLv3"
@@ -20,6 +24,16 @@ __status__ = "Development"
 # Global options
 CACHE = False
 DEBUG = False
+# Connection pool. Maximum number of keep-alive HTTP connections (0 disables
+# pooling and closes the connection after every request), socket timeout and
+# maximum wait for a free connection, both in seconds (None waits forever)
+POOL_SIZE = 10
+TIMEOUT = None
+POOL_TIMEOUT = None
+# Paged traversals. Number of results per request and seconds the server
+# keeps an idle traversal open
+PAGE_SIZE = 50
+LEASE_TIME = 60
 # Order
 BREADTH_FIRST = "breadth first"
 DEPTH_FIRST = "depth first"
@@ -83,6 +97,7 @@ class GraphDatabase(object):
         self.reference_node_url = None
         self.index_path = "/index"
         self.node_path = "/node"
+        self.batch_path = "/batch"
         self.Traversal = self._get_traversal_class()
         if url.endswith("/"):
             self.url = url[0:-1]
@@ -93,6 +108,8 @@ class GraphDatabase(object):
             response_json = simplejson.loads(content)
             self.index_url = response_json['index']
             self.reference_node_url = response_json['reference_node']
+            self.batch_url = response_json.get('batch', "%s%s" % (self.url,
+                                                                   self.batch_path))
             self.nodes = NodeProxy(self.url, self.node_path,
                                    self.reference_node_url)
             # Backward compatibility. The current style is more pythonic
@@ -110,12 +127,94 @@ class GraphDatabase(object):
     def traverse(self, *args, **kwargs):
         return self.reference_node.traverse(*args, **kwargs)
 
+    def batch(self, jobs):
+        """
+        Send a list of jobs to the REST batch endpoint in a single request.
+        Each job is a dictionary with the keys "method", "to" (a path relative
+        to the database URL, such as "/node/12") and optionally "body".
+        Returns the list of response bodies in the order of the jobs.
+        """
+        return [r.get("body") for r in self._batch(jobs)]
+
+    def _batch(self, jobs):
+        # The jobs are numbered by position, which back-references such as
+        # "{0}" refer to. Returns the job results in the order of the jobs.
+        data = []
+        for i, job in enumerate(jobs):
+            job = job.copy()
+            job["id"] = i
+            data.append(job)
+        response, content = Request().post(self.batch_url, data=data)
+        if response.status == 200:
+            results = simplejson.loads(content)
+            results.sort(key=lambda r: r["id"])
+            return results
+        elif response.status == 404:
+            raise NotFoundError(response.status, "Node or relationship not " \
+                                                 "found in batch")
+        else:
+            raise StatusException(response.status, "Invalid batch sent")
+
+    def hydrate(self, objects):
+        """
+        Fetch the representations of the lazy nodes and relationships in
+        objects that have not been loaded yet with a single batch request.
+        Returns objects.
+        """
+        pending = {}
+        for obj in objects:
+            if not obj.is_loaded:
+                pending.setdefault(obj.url, []).append(obj)
+        if pending:
+            urls = pending.keys()
+            jobs = []
+            for url in urls:
+                if url.startswith(self.url):
+                    url = url[len(self.url):]
+                jobs.append({"method": "GET", "to": url})
+            for url, representation in zip(urls, self.batch(jobs)):
+                for obj in pending[url]:
+                    obj._dic = representation
+        return objects
+
+    def get_nodes(self, ids, max_workers=None):
+        """
+        Fetch the nodes with the given ids or URLs concurrently from up to
+        max_workers threads. Yields (id, node, error) tuples in the order of
+        ids, where error is the exception raised for a missing node, if any.
+        """
+        return ConcurrentExecutor(max_workers).map(self.node.__getitem__, ids)
+
+    def get_relationships(self, ids, max_workers=None):
+        """
+        Fetch the relationships with the given ids or URLs concurrently from
+        up to max_workers threads. Yields (id, relationship, error) tuples
+        in the order of ids.
+        """
+
+        def get_relationship(key):
+            if isinstance(key, (str, unicode)) and key.startswith(self.url):
+                return Relationship(key)
+            return Relationship("%s/relationship/%s" % (self.url, key))
+        return ConcurrentExecutor(max_workers).map(get_relationship, ids)
+
+    def write_batch(self):
+        """
+        Return a WriteBatch for queueing node and relationship creations
+        that are sent to the server in a single request.
+        """
+        return WriteBatch(self)
+
     def _get_traversal_class(self):
         cls = self
 
         class Traversal(object):
             __metaclass__ = MetaTraversal
 
+            # Results are requested page_size at a time as the traversal
+            # is iterated, in server order
+            page_size = None
+
             def __init__(self, start_node=None):
                 if start_node and isinstance(start_node, Node):
                     self.start_node = start_node
@@ -123,52 +222,180 @@ class GraphDatabase(object):
                     self.start_node = cls.reference_node
                 is_returnable = self.is_returnable
                 is_stop_node = self.is_stop_node
-                results = self.start_node.traverse(types=self.types,
-                                                   order=self.order,
-                                                   stop=self.stop,
-                                                   returnable=self.returnable,
-                                                   uniqueness=self.uniqueness,
-                                                   is_stop_node=is_stop_node,
-                                                   is_returnable=is_returnable,
-                                                   returns=self.returns)
-                self._items = results
-                self._index = len(results)
+                paged_traverse = self.start_node.paged_traverse
+                self._results = paged_traverse(types=self.types,
+                                               order=self.order,
+                                               stop=self.stop,
+                                               returnable=self.returnable,
+                                               uniqueness=self.uniqueness,
+                                               is_stop_node=is_stop_node,
+                                               is_returnable=is_returnable,
+                                               returns=self.returns,
+                                               page_size=self.page_size)
 
             def __iter__(self):
                 return self
 
             def next(self):
-                if self._index == 0:
-                    raise StopIteration
-                self._index = self._index - 1
-                return self._items[self._index]
+                return self._results.next()
 
         return Traversal
 
 
+class BatchReference(object):
+    """
+    Reference to the node or relationship created by a job of a WriteBatch.
+    Until the batch is submitted, it may be used in later jobs of the same
+    batch. Afterwards it holds the url and representation of the created
+    entity.
+    """
+
+    def __init__(self, job_id, cls):
+        self.job_id = job_id
+        self.url = None
+        self._cls = cls
+        self._representation = None
+
+    def _get_id(self):
+        if self.url is None:
+            raise StatusException(409, "Batch not submitted yet")
+        return int(self.url.split("/")[-1])
+    id = property(_get_id)
+
+    def _get_entity(self):
+        if self.url is None:
+            raise StatusException(409, "Batch not submitted yet")
+        return self._cls(self.url, representation=self._representation)
+    entity = property(_get_entity)
+
+
+class WriteBatch(object):
+    """
+    Queue of node and relationship creations submitted to the REST batch
+    endpoint in a single request. The server runs the jobs of a batch in one
+    transaction. Nodes are given as Node objects, node ids, node URLs or
+    BatchReferences to nodes created earlier in the same batch.
+    """
+
+    def __init__(self, graphdb):
+        self._graphdb = graphdb
+        self._jobs = []
+        self._references = []
+
+    def __len__(self):
+        return len(self._jobs)
+
+    def _node_path(self, node):
+        if isinstance(node, BatchReference):
+            if node.url is None:
+                return "{%d}" % node.job_id
+            node = node.url
+        elif isinstance(node, Base):
+            node = node.url
+        elif isinstance(node, (int, long)):
+            return "%s/%d" % (self._graphdb.node_path, node)
+        if node.startswith(self._graphdb.url):
+            node = node[len(self._graphdb.url):]
+        return node
+
+    def _queue(self, job, cls):
+        reference = BatchReference(len(self._jobs), cls)
+        self._jobs.append(job)
+        self._references.append(reference)
+        return reference
+
+    def create_node(self, **properties):
+        """
+        Queue the creation of a node. Returns its BatchReference.
+        """
+        return self._queue({"method": "POST",
+                            "to": self._graphdb.node_path,
+                            "body": properties}, Node)
+
+    def create_relationship(self, start, end, relationship_type,
+                            **properties):
+        """
+        Queue the creation of a relationship of the given type from node
+        start to node end. Returns its BatchReference.
+        """
+        body = {"to": self._node_path(end), "type": relationship_type}
+        if properties:
+            body["data"] = properties
+        return self._queue({"method": "POST",
+                            "to": "%s/relationships" % self._node_path(start),
+                            "body": body}, Relationship)
+
+    def submit(self):
+        """
+        Send the queued jobs in a single request and empty the batch.
+        Returns the list of BatchReferences of the jobs, now holding the
+        urls of the created nodes and relationships.
+        """
+        jobs, references = self._jobs, self._references
+        self._jobs = []
+        self._references = []
+        if not jobs:
+            return []
+        for reference, result in zip(references, self._graphdb._batch(jobs)):
+            reference.url = result.get("location")
+            reference._representation = result.get("body")
+        return references
+
+
 class Base(object):
     """
     Base class.
     """
 
-    def __init__(self, url, create=False, data={}):
-        self._dic = {}
+    def __init__(self, url, create=False, data={}, lazy=False,
+                 representation=None):
+        # The representation is the JSON document of the node or
+        # relationship. It is fetched on first access if lazy is True,
+        # and never if it is given, e.g. from a relationship listing.
+        self._representation = None
         self.url = None
         if create:
             response, content = Request().post(url, data=data)
             if response.status == 201:
-                self._dic.update(data.copy())
+                self._representation = data.copy()
                 self.url = response.get("location")
             else:
                 raise NotFoundError(response.status, "Invalid data sent")
         if not self.url:
             self.url = url
+        if representation is not None:
+            self._representation = representation
+        elif create or not lazy:
+            self._load()
+
+    def _load(self):
         response, content = Request().get(self.url)
         if response.status == 200:
-            self._dic.update(simplejson.loads(content).copy())
+            dic = self._representation or {}
+            dic.update(simplejson.loads(content).copy())
+            self._representation = dic
         else:
             raise NotFoundError(response.status, "Unable get node")
 
+    def _get_dic(self):
+        if self._representation is None:
+            self._load()
+        return self._representation
+
+    def _set_dic(self, dic):
+        self._representation = dic
+    _dic = property(_get_dic, _set_dic)
+
+    def _is_loaded(self):
+        return self._representation is not None
+    is_loaded = property(_is_loaded)
+
+    def _get_url(self, key, path):
+        # The URLs of a node that is not loaded yet follow from its own URL
+        if self._representation is None or key not in self._representation:
+            return "%s%s" % (self.url, path)
+        return self._representation[key]
+
     def delete(self, key=None):
         if key:
             self.__delitem__(key)
@@ -184,12 +411,10 @@ class Base(object):
                                                    "relationships?)")
 
     def __getitem__(self, key):
-        property_url = self._dic["property"].replace("{key}", key)
-        response, content = Request().get(property_url)
-        if response.status == 200:
-            self._dic["data"][key] = simplejson.loads(content)
-        else:
-            raise NotFoundError(response.status, "Node or propery not found")
+        # Properties are served from the representation, which is fetched
+        # with a single request if needed
+        if key not in self._dic["data"]:
+            raise NotFoundError(404, "Node or propery not found")
         return self._dic["data"][key]
 
     def get(self, key, *args):
@@ -301,10 +526,20 @@ class NodeProxy(dict):
             return self.create(**kwargs)
 
     def __getitem__(self, key):
+        return Node(self._get_node_url(key))
+
+    def _get_node_url(self, key):
         if isinstance(key, (str, unicode)) and key.startswith(self.node_url):
-            return Node(key)
+            return key
         else:
-            return Node("%s/%s" % (self.node_url, key))
+            return "%s/%s" % (self.node_url, key)
+
+    def lazy(self, key):
+        """
+        Return a node whose properties are fetched on first access, or
+        together with other nodes through GraphDatabase.hydrate.
+        """
+        return Node(self._get_node_url(key), lazy=True)
 
     def get(self, key, *args, **kwargs):
         try:
@@ -336,7 +571,8 @@ class Node(Base):
         """
 
         def relationship(to, *args, **kwargs):
-            create_relationship_url = self._dic["create_relationship"]
+            create_relationship_url = self._get_url("create_relationship",
+                                                    "/relationships")
             data = {
                 "to": to.url,
                 "type": relationship_name,
@@ -366,9 +602,9 @@ class Node(Base):
         return int(self.url.split("/")[-1])
     id = property(_get_id)
 
-    def traverse(self, types=None, order=None, stop=None, returnable=None,
-                 uniqueness=None, is_stop_node=None, is_returnable=None,
-                 returns=None):
+    def _traversal_description(self, types=None, order=None, stop=None,
+                               returnable=None, uniqueness=None,
+                               returns=None):
         data = {}
         if order in (BREADTH_FIRST, DEPTH_FIRST):
             data.update({"order": order})
@@ -397,24 +633,81 @@ class Node(Base):
                 data.update({"relationships": relationships})
         if returns not in (NODE, RELATIONSHIP, PATH, POSITION):
             returns = NODE
-        traverse_url = self._dic["traverse"].replace("{returnType}", returns)
+        return data, returns
+
+    def _traversal_results(self, returns, results_list):
+        if returns == NODE:
+            return [Node(r["self"], representation=r) for r in results_list]
+        elif returns == RELATIONSHIP:
+            return [Relationship(r["self"], representation=r)
+                    for r in results_list]
+        elif returns == PATH:
+            return [Path(r) for r in results_list]
+        elif returns == POSITION:
+            return [Position(r) for r in results_list]
+
+    def traverse(self, types=None, order=None, stop=None, returnable=None,
+                 uniqueness=None, is_stop_node=None, is_returnable=None,
+                 returns=None):
+        data, returns = self._traversal_description(types, order, stop,
+                                                    returnable, uniqueness,
+                                                    returns)
+        traverse_url = self._get_url("traverse", "/traverse/{returnType}")
+        traverse_url = traverse_url.replace("{returnType}", returns)
         response, content = Request().post(traverse_url, data=data)
         if response.status == 200:
             results_list = simplejson.loads(content)
-            if returns is NODE:
-                return [Node(r["self"]) for r in results_list]
-            elif returns is RELATIONSHIP:
-                return [Relationship(r["self"]) for r in results_list]
-            elif returns is PATH:
-                return [Path(r) for r in results_list]
-            elif returns is POSITION:
-                return [Position(r) for r in results_list]
+            return self._traversal_results(returns, results_list)
         elif response.status == 404:
             raise NotFoundError(response.status, "Node or relationship not " \
                                                  "found")
         else:
             raise StatusException(response.status, "Invalid data sent")
 
+    def paged_traverse(self, types=None, order=None, stop=None,
+                       returnable=None, uniqueness=None, is_stop_node=None,
+                       is_returnable=None, returns=None, page_size=None,
+                       lease_time=None):
+        """
+        Generator over the results of a traversal in server order. The
+        server keeps the traversal open for lease_time seconds between
+        requests and sends page_size results per request, so memory use
+        does not grow with the size of the traversal and iteration may
+        stop at any point. page_size and lease_time default to PAGE_SIZE
+        and LEASE_TIME.
+        """
+        data, returns = self._traversal_description(types, order, stop,
+                                                    returnable, uniqueness,
+                                                    returns)
+        traverse_url = self._get_url("paged_traverse",
+                                     "/paged/traverse/{returnType}"
+                                     "{?pageSize,leaseTime}")
+        traverse_url = traverse_url.replace("{returnType}", returns)
+        traverse_url = traverse_url.replace("{?pageSize,leaseTime}",
+                                            "?pageSize=%d&leaseTime=%d" %
+                                            (page_size or PAGE_SIZE,
+                                             lease_time or LEASE_TIME))
+        response, content = Request().post(traverse_url, data=data)
+        if response.status == 404:
+            raise NotFoundError(response.status, "Node or relationship not " \
+                                                 "found")
+        elif response.status not in (200, 201):
+            raise StatusException(response.status, "Invalid data sent")
+        traverser_url = response.get("location")
+        while True:
+            results_list = simplejson.loads(content)
+            if not results_list:
+                return
+            for result in self._traversal_results(returns, results_list):
+                yield result
+            # The traverser is removed once it runs out of results
+            response, content = Request().get(traverser_url)
+            if response.status == 404:
+                return
+            elif response.status != 200:
+                raise StatusException(response.status,
+                                      "Traversal could not be continued")
+
 
 class Relationships(object):
     """
@@ -424,22 +717,26 @@ class Relationships(object):
     def __init__(self, node):
         self._node = node
         self._pattern = "{-list|&|types}"
+        self._directions = {"all": "all", "incoming": "in", "outgoing": "out"}
 
     def __getattr__(self, relationship_type):
 
         def get_relationships(types=None, *args, **kwargs):
             if relationship_type in ["all", "incoming", "outgoing"]:
+                path = "/relationships/%s" % self._directions[relationship_type]
                 if types and isinstance(types, (tuple, list)):
                     key = "%s_typed_relationships" % relationship_type
-                    url_string = self._node._dic[key]
+                    url_string = self._node._get_url(key, "%s/%s" % (path,
+                                                     self._pattern))
                     url = url_string.replace(self._pattern, "&".join(types))
                 else:
                     key = "%s_relationships" % relationship_type
-                    url = self._node._dic[key]
+                    url = self._node._get_url(key, path)
                 response, content = Request().get(url)
                 if response.status == 200:
                     relationship_list = simplejson.loads(content)
-                    relationships = [Relationship(r["self"])
+                    relationships = [Relationship(r["self"],
+                                                  representation=r)
                                      for r in relationship_list]
                     return relationships
                 elif response.status == 404:
@@ -461,11 +758,11 @@ class Relationship(Base):
     """
 
     def _get_start(self):
-        return Node(self._dic['start'])
+        return Node(self._dic['start'], lazy=True)
     start = property(_get_start)
 
     def _get_end(self):
-        return Node(self._dic['end'])
+        return Node(self._dic['end'], lazy=True)
     end = property(_get_end)
 
     def _get_type(self):
@@ -479,20 +776,20 @@ class Path(object):
     """
 
     def __init__(self, dic):
-        self.start = property(Node(dic["start"]))
-        self.end = property(Node(dic["end"]))
+        self.start = property(Node(dic["start"], lazy=True))
+        self.end = property(Node(dic["end"], lazy=True))
         self._length = int(dic["length"])
         nodes = []
         relationships = []
         self._iterable = []
         for i in range(0, len(dic["relationships"])):
-            node = Node(dic["nodes"][i])
+            node = Node(dic["nodes"][i], lazy=True)
             nodes.append(node)
-            relationship = Relationship(dic["relationships"][i])
+            relationship = Relationship(dic["relationships"][i], lazy=True)
             relationships.append(node)
             self._iterable.append(node)
             self._iterable.append(relationship)
-        node = Node(dic["nodes"][-1])
+        node = Node(dic["nodes"][-1], lazy=True)
         nodes.append(node)
         self._iterable.append(node)
         self.nodes = property(nodes)
@@ -513,9 +810,9 @@ class Position(object):
     """
 
     def __init__(self, dic):
-        self.node = property(Node(dic["node"]))
+        self.node = property(Node(dic["node"], lazy=True))
         self.depth = int(dic["depth"])
-        relationship = Relationship(dic["last relationship"])
+        relationship = Relationship(dic["last relationship"], lazy=True)
         self.last_relationship = property(relationship)
         self.path = property(Path(dic["path"]))
 
@@ -636,10 +933,166 @@ class NotFoundError(StatusException):
         super(NotFoundError, self).__init__(value, result)
 
 
+class ConnectionPool(object):
+    """
+    Thread-safe pool of keep-alive HTTP connections shared by all requests.
+    Each httplib2.Http object in the pool holds its open connections and is
+    used by one thread at a time. At most size objects are created, and a
+    request waits up to pool_timeout seconds for a free one.
+    """
+
+    def __init__(self, size=None, timeout=None, pool_timeout=None):
+        if size is None:
+            size = POOL_SIZE
+        self.size = size
+        self.timeout = timeout or TIMEOUT
+        self.pool_timeout = pool_timeout or POOL_TIMEOUT
+        self._idle = Queue.LifoQueue()
+        for i in range(size):
+            self._idle.put(None)
+
+    def _create(self):
+        if CACHE:
+            return httplib2.Http(".cache", timeout=self.timeout)
+        else:
+            return httplib2.Http(timeout=self.timeout)
+
+    def _close(self, http):
+        for connection in http.connections.values():
+            connection.close()
+        http.connections.clear()
+
+    def request(self, url, method, headers, body):
+        if self.size == 0:
+            headers['Connection'] = 'close'
+            return self._create().request(url, method, headers=headers,
+                                          body=body)
+        try:
+            http = self._idle.get(True, self.pool_timeout)
+        except Queue.Empty:
+            raise StatusException(503, "No HTTP connection available")
+        try:
+            if http is None:
+                http = self._create()
+            return http.request(url, method, headers=headers, body=body)
+        except Exception:
+            # The connection state is unknown after an error
+            if http is not None:
+                self._close(http)
+            http = None
+            raise
+        finally:
+            self._idle.put(http)
+
+    def close(self):
+        """
+        Close the idle connections. Connections in use are kept open.
+        """
+        for i in range(self._idle.qsize()):
+            try:
+                http = self._idle.get(False)
+            except Queue.Empty:
+                break
+            if http is not None:
+                self._close(http)
+            self._idle.put(None)
+
+
+class ConcurrentExecutor(object):
+    """
+    Runs independent requests from a bounded number of worker threads. The
+    workers share the keep-alive connections of the module connection pool,
+    so max_workers defaults to POOL_SIZE.
+    """
+
+    def __init__(self, max_workers=None):
+        self.max_workers = max_workers or POOL_SIZE or 1
+
+    def map(self, func, items):
+        """
+        Call func on each of items from the worker threads. Yields
+        (item, result, error) tuples in the order of items. error is the
+        exception raised by func for the item, if any, in which case result
+        is None; the remaining items are still processed. At most twice
+        max_workers items are in flight, so items may be a long iterator.
+        """
+        tasks = Queue.Queue()
+        done = Queue.Queue()
+
+        def work():
+            while True:
+                task = tasks.get()
+                if task is None:
+                    return
+                i, item = task
+                try:
+                    done.put((i, item, func(item), None))
+                except Exception, e:
+                    done.put((i, item, None, e))
+
+        workers = [threading.Thread(target=work)
+                   for i in range(self.max_workers)]
+        for worker in workers:
+            worker.daemon = True
+            worker.start()
+        try:
+            items = iter(items)
+            window = 2 * self.max_workers
+            finished = {}
+            queued = 0
+            next_index = 0
+            exhausted = False
+            while True:
+                while not exhausted and queued - next_index < window:
+                    try:
+                        tasks.put((queued, items.next()))
+                        queued += 1
+                    except StopIteration:
+                        exhausted = True
+                if next_index == queued:
+                    break
+                while next_index not in finished:
+                    i, item, result, error = done.get()
+                    finished[i] = (item, result, error)
+                yield finished.pop(next_index)
+                next_index += 1
+        finally:
+            for worker in workers:
+                tasks.put(None)
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def configure_pool(size=None, timeout=None, pool_timeout=None):
+    """
+    Replace the shared connection pool, closing the idle connections of the
+    previous one. The arguments default to POOL_SIZE, TIMEOUT and
+    POOL_TIMEOUT.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+        _pool = ConnectionPool(size, timeout, pool_timeout)
+    return _pool
+
+
+def _get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ConnectionPool()
+        return _pool
+
+
 class Request(object):
     """
     Create an HTTP request object for HTTP
-    verbs GET, POST, PUT and DELETE.
+    verbs GET, POST, PUT and DELETE. Requests
+    share the keep-alive connections of the
+    module connection pool.
     """
 
     def __init__(self, username=None, password=None, key_file=None,
@@ -780,18 +1233,18 @@ class Request(object):
             httplib2.debuglevel = 0
         if CACHE:
             headers['Cache-Control'] = 'no-cache'
-            http = httplib2.Http(".cache")
-        else:
-            http = httplib2.Http()
-        if scheme.lower() == 'https':
-            http.add_certificate(self.key_file, self.cert_file, self.url)
+        pool = _get_pool()
+        if scheme.lower() == 'https' and (self.key_file or self.cert_file):
+            # Client certificates are not shared through the pool
+            http = pool._create()
+            http.add_certificate(self.key_file, self.cert_file, splits.netloc)
+            headers['Connection'] = 'close'
+            pool = None
         headers['Accept'] = 'application/json'
         headers['Accept-Encoding'] = '*'
         headers['Accept-Charset'] = 'ISO-8859-1,utf-8;q=0.7,*;q=0.7'
         # I'm not sure on the right policy about cache with Neo4j REST Server
         # headers['Cache-Control'] = 'no-cache'
-        # TODO: Handle all requests with the same Http object
-        headers['Connection'] = 'close'
         headers['User-Agent'] = 'Neo4jPythonClient/%s ' % __version__
         if username and password:
             credentials = "%s:%s" % (username, password)
@@ -805,11 +1258,17 @@ class Request(object):
         # Don't JSON encode body when it starts with "http://" to set inde
         if isinstance(data, (str, unicode)) and data.startswith('http://'):
             body = data
+        elif method in ("GET", "DELETE") and not data:
+            # An empty body would be left unread on a kept-alive connection
+            body = None
         else:
             body = self._json_encode(data, ensure_ascii=True)
         try:
-            response, content = http.request(url, method, headers=headers,
-                                             body=body)
+            if pool is None:
+                response, content = http.request(url, method, headers=headers,
+                                                 body=body)
+            else:
+                response, content = pool.request(url, method, headers, body)
             if response.status == 401:
                 raise StatusException(401, "Authorization Required")
             return response, content
@@ -0,0 +1,431 @@
+"""Compact, versioned binary encoding of the records stored in Redis.
+
+Stores written by the ingest scripts use the legacy encoding: values are Python marshal
+blobs and tuple keys are written as str(tuple). Stores converted by
+enron_data_ingest/migrate_record_encoding.py use the compact encoding described below and
+record its version under the Redis key 'record_encoding_version'.
+
+Dictionary encoding
+    Email addresses and message ids are mapped to uint32 ids. The mappings are kept in the
+    hashes 'address_to_id' / 'id_to_address' and 'message_id_to_id' / 'id_to_message_id'.
+    The next free id of each dictionary is kept in the 'record_dictionary_counters' hash.
+
+Keys
+    Directed communication relationship (sender address, recipient address) and message id
+    pair keys are packed as two little-endian uint32 ids ('<II'). Message id pairs are sorted
+    by message id before they are packed, as in the legacy encoding. Hashes keyed by a single
+    message id or address keep the plain string as the key.
+
+Values
+    Message, relationship and extents values start with the two byte header MAGIC, VERSION
+    followed by a marshal blob of the payload tuple below, so they are decoded by marshal
+    like the legacy values. MAGIC is never the first byte of a marshal blob, so compact and
+    legacy values can be told apart.
+
+    message            (flags, epoch secs, sender id, TO ids, CC ids, BCC ids, subject, body)
+                       with body None if absent. Flags bit 0: has datetime, bit 1: has body.
+                       The recipients are tuples of address ids.
+    relationship       (message ids, epoch secs) tuples in ascending epoch secs order and
+                       optionally a string of the ROLE_CODES bytes of the recipient in each
+                       message
+    extents            (address ids, minimum epoch secs, maximum epoch secs) tuples
+
+    The other values (longest common substrings, annotations, message digests, ...) do not
+    refer to addresses or message ids, so they remain plain marshal blobs.
+"""
+import ast
+import marshal
+import struct
+import redis
+from itertools import izip
+from operator  import itemgetter
+
+MAGIC = '\xe5'
+VERSION = 1
+HEADER = MAGIC + chr(VERSION)
+
+# Flags of encoded messages
+HAS_DATETIME = 0x01
+HAS_BODY = 0x02
+
+# Codes of the recipient roles stored with relationship messages
+ROLE_CODES = { 'to' : 1, 'cc' : 2, 'bcc' : 3 }
+ROLES = dict([(code, role) for role, code in ROLE_CODES.items()])
+
+# Role of each role code byte
+_role_of_code = dict([(chr(code), role) for code, role in ROLES.items()])
+
+_key_struct = struct.Struct('<II')
+
+def _check_header(s):
+    """Raises an exception if s does not start with the compact encoding header."""
+    if s[:2] != HEADER:
+        raise Exception("Value is not in the compact record encoding (version %d)." % VERSION)
+
+def _payload(s):
+    """Returns the payload tuple of the compact encoding s."""
+    if s[:2] != HEADER:
+        _check_header(s)
+    return marshal.loads(s[2:])
+
+#========== Messages ==========#
+
+def encode_message(msg,sender_id,recipient_ids):
+    """Returns the compact encoding of the message dictionary msg, which uses the legacy
+    property names ('epoch_secs', 'subject', ...). sender_id is the address id of the sender.
+    recipient_ids is a tuple of the TO, CC and BCC address id lists. The message id is not
+    included since it is the key of the message hashes. The body is None if msg has none.
+    """
+    flags = 0
+    if msg.get('datetime') != 'None':
+        flags |= HAS_DATETIME
+    if msg.has_key('body'):
+        flags |= HAS_BODY
+    to_ids, cc_ids, bcc_ids = recipient_ids
+    return HEADER + marshal.dumps((flags,msg['epoch_secs'],sender_id,tuple(to_ids),tuple(cc_ids),
+                                   tuple(bcc_ids),msg['subject'],msg.get('body')))
+
+def decode_message(s):
+    """Returns the (flags, epoch secs, sender id, TO ids, CC ids, BCC ids, subject, body)
+    tuple decoded from the compact encoding s of a message. The recipient ids are tuples of
+    address ids."""
+    return _payload(s)
+
+#========== Relationships and temporal extents ==========#
+
+def encode_id_pair(id1,id2):
+    """Returns the key for a pair of ids."""
+    return _key_struct.pack(id1,id2)
+
+def decode_id_pair(s):
+    """Returns the pair of ids packed in the key s."""
+    return _key_struct.unpack(s)
+
+def encode_relationship(message_ids,epoch_secs,roles=None):
+    """Returns the compact encoding of a directed communication relationship given the lists
+    of message ids and epoch secs, in ascending epoch secs order, and optionally the list of
+    recipient roles ('to', 'cc' or 'bcc')."""
+    fields = (tuple(message_ids),tuple(epoch_secs))
+    if roles != None:
+        fields += (''.join([chr(ROLE_CODES[role]) for role in roles]),)
+    return HEADER + marshal.dumps(fields)
+
+def decode_relationship(s):
+    """Returns the tuples of message ids and epoch secs and the list of recipient roles, or
+    None if no roles are stored, decoded from the compact encoding of a directed communication
+    relationship."""
+    fields = _payload(s)
+    roles = None
+    if len(fields) > 2:
+        roles = map(_role_of_code.__getitem__,fields[2])
+    return fields[0], fields[1], roles
+
+def encode_extents(address_ids,min_epoch_secs,max_epoch_secs):
+    """Returns the compact encoding of the temporal extents of a set of relationships given
+    the lists of address ids, minimum epoch secs and maximum epoch secs."""
+    return HEADER + marshal.dumps((tuple(address_ids),tuple(min_epoch_secs),tuple(max_epoch_secs)))
+
+def decode_extents(s):
+    """Returns the tuples of address ids, minimum epoch secs and maximum epoch secs decoded from
+    the compact encoding of a set of relationship temporal extents."""
+    return _payload(s)
+
+#========== Dictionaries ==========#
+
+def _lookup(strings,ids):
+    """Returns the sequence of the strings of the ids in the list strings. A LookupError is
+    raised if the string of an id is not memoized. The strings of several ids are fetched by
+    itemgetter in a single call."""
+    if len(ids) > 1:
+        found = itemgetter(*ids)(strings)
+    else:
+        found = [strings[id] for id in ids]
+    if None in found:
+        raise KeyError(found.index(None))
+    return found
+
+class RecordDictionary(object):
+    """Two-way mapping between strings and uint32 ids, backed by the Redis hashes
+    '<name>_to_id' and 'id_to_<name>'. Mappings are memoized once fetched. The strings are
+    memoized in a list indexed by id, with None for the ids not fetched yet, since indexing
+    a list is much faster than hashing when decoding. If no Redis connection is given, the
+    dictionary lives in memory only.
+    """
+
+    def __init__(self,name,rdb=None):
+        self._name = name
+        self._rdb = rdb
+        self._ids = {}
+        self._strings = []
+        self.to_id_hash = '%s_to_id' % name
+        self.to_string_hash = 'id_to_%s' % name
+
+    def _remember(self,string,id):
+        self._ids[string] = id
+        if id >= len(self._strings):
+            self._strings.extend([None] * (id + 1 - len(self._strings)))
+        self._strings[id] = string
+
+    def getIDs(self,strings):
+        """Returns the list of ids for the given strings. The id of an unknown string is None."""
+        missing = list(set(strings).difference(self._ids))
+        if len(missing) > 0 and self._rdb != None:
+            for string, id in zip(missing,self._rdb.hmget(self.to_id_hash,missing)):
+                if id != None:
+                    self._remember(string,int(id))
+        return map(self._ids.get,strings)
+
+    def getStrings(self,ids):
+        """Returns the list of strings for the given ids. An exception is raised for unknown ids."""
+        try:
+            return list(_lookup(self._strings,ids))
+        except LookupError:
+            pass
+        n = len(self._strings)
+        missing = list(set([id for id in ids if id >= n or self._strings[id] == None]))
+        if self._rdb != None:
+            for id, string in zip(missing,self._rdb.hmget(self.to_string_hash,missing)):
+                if string != None:
+                    self._remember(string,id)
+        try:
+            return list(_lookup(self._strings,ids))
+        except LookupError:
+            n = len(self._strings)
+            raise Exception("Unknown %s id %s." % (self._name,[id for id in missing
+                                                               if id >= n or self._strings[id] == None][0]))
+
+    def _reserve(self,strings):
+        """Returns the ids of the strings, assigning a block of new ids to the strings that
+        have none yet. Another client may have assigned ids to some of the strings since they
+        were looked up, so they are looked up again while the counter of the dictionary and
+        the string to id hash are watched. The counter is advanced and the new mappings are
+        written in a single transaction, which is retried if another client changes either
+        of them in the meantime."""
+        pipe = self._rdb.pipeline(transaction=True)
+        try:
+            while True:
+                try:
+                    pipe.watch('record_dictionary_counters',self.to_id_hash)
+                    ids = pipe.hmget(self.to_id_hash,strings)
+                    new_strings = [s for s, id in zip(strings,ids) if id == None]
+                    if len(new_strings) == 0:
+                        return map(int,ids)
+                    first = int(pipe.hget('record_dictionary_counters',self._name) or 0)
+                    new_ids = range(first,first+len(new_strings))
+                    pipe.multi()
+                    pipe.hset('record_dictionary_counters',self._name,first+len(new_strings))
+                    pipe.hmset(self.to_id_hash,dict(zip(new_strings,new_ids)))
+                    pipe.hmset(self.to_string_hash,dict(zip(new_ids,new_strings)))
+                    pipe.execute()
+                    new_ids = iter(new_ids)
+                    return [new_ids.next() if id == None else int(id) for id in ids]
+                except redis.WatchError:
+                    continue
+        finally:
+            pipe.reset()
+
+    def assignIDs(self,strings):
+        """Returns the list of ids for the given strings, assigning new ids to unknown strings.
+        The new mappings are written to Redis in their own transaction and memoized only once
+        it succeeds, so they are in place before any record referring to them is written.
+        """
+        ids = self.getIDs(strings)
+        new_strings = []
+        seen = set()
+        for string, id in zip(strings,ids):
+            if id == None and not string in seen:
+                seen.add(string)
+                new_strings.append(string)
+        if len(new_strings) > 0:
+            if self._rdb != None:
+                new_ids = self._reserve(new_strings)
+            else:
+                new_ids = range(len(self._ids),len(self._ids)+len(new_strings))
+            for string, id in zip(new_strings,new_ids):
+                self._remember(string,id)
+            ids = [self._ids[s] for s in strings]
+        return ids
+
+#========== Codecs ==========#
+
+class LegacyRecordCodec(object):
+    """Reads and writes records in the legacy encoding: marshal values and str(tuple) keys."""
+
+    version = 0
+
+    def decodeMessages(self,values,message_ids):
+        return [marshal.loads(s) for s in values]
+
+    def encodeMessages(self,msgs):
+        return [marshal.dumps(msg) for msg in msgs]
+
+    def encodeRelationshipKeys(self,rel_ids,assign=False):
+        return [str(tuple(rel_id)) for rel_id in rel_ids]
+
+    def decodeRelationshipKeys(self,keys):
+        return [ast.literal_eval(key) for key in keys]
+
+    def encodeRelationship(self,tlist):
+        return marshal.dumps(tlist)
+
+    def decodeRelationships(self,values):
+        return [marshal.loads(s) for s in values]
+
+    def encodeExtents(self,extents):
+        return marshal.dumps(extents)
+
+    def decodeExtents(self,s):
+        return marshal.loads(s)
+
+    def encodeMessagePairKeys(self,pairs,assign=False):
+        return [str(sorted(pair)) for pair in pairs]
+
+    def decodeMessagePairKeys(self,keys):
+        return [ast.literal_eval(key) for key in keys]
+
+    def encodeValue(self,value):
+        return marshal.dumps(value)
+
+    def decodeValue(self,s):
+        return marshal.loads(s)
+
+class CompactRecordCodec(object):
+    """Reads and writes records in the compact encoding using the address and message id
+    dictionaries. The methods mirror those of LegacyRecordCodec. Key encoders return None
+    for keys involving unknown addresses or message ids unless assign = True, in which case
+    new ids are assigned.
+
+    The decoders translate ids with the strings memoized by the dictionaries, building the
+    records in a single pass over the values so that the decoded payloads are freed right
+    away. If an id is not memoized yet, the missing ids of all of the values are fetched at
+    once and the values are decoded again.
+    """
+
+    version = VERSION
+
+    def __init__(self,rdb=None):
+        self.addresses = RecordDictionary('address',rdb)
+        self.message_ids = RecordDictionary('message_id',rdb)
+
+    def _message_dicts(self,values,message_ids):
+        strings = self.addresses._strings
+        loads = marshal.loads
+        msgs = []
+        for s, message_id in izip(values,message_ids):
+            if s[:2] != HEADER:
+                _check_header(s)
+            flags, epoch_secs, sender_id, to_ids, cc_ids, bcc_ids, subject, body = loads(s[2:])
+            msg = { 'message_id' : message_id, 'epoch_secs' : epoch_secs, 'sender' : strings[sender_id],
+                    'to' : [strings[id] for id in to_ids], 'cc' : [strings[id] for id in cc_ids],
+                    'bcc' : [strings[id] for id in bcc_ids], 'subject' : subject }
+            if msg['sender'] == None or None in msg['to'] or None in msg['cc'] or None in msg['bcc']:
+                raise KeyError(message_id)
+            if not flags & HAS_DATETIME:
+                msg['datetime'] = 'None'
+            if flags & HAS_BODY:
+                msg['body'] = body
+            msgs.append(msg)
+        return msgs
+
+    def decodeMessages(self,values,message_ids):
+        try:
+            return self._message_dicts(values,message_ids)
+        except LookupError:
+            ids = []
+            for s in values:
+                fields = decode_message(s)
+                ids.append(fields[2])
+                ids.extend(fields[3])
+                ids.extend(fields[4])
+                ids.extend(fields[5])
+            self.addresses.getStrings(ids)
+            return self._message_dicts(values,message_ids)
+
+    def encodeMessages(self,msgs):
+        addresses = []
+        for msg in msgs:
+            addresses.append(msg['sender'])
+            addresses.extend(msg['to'])
+            addresses.extend(msg['cc'])
+            addresses.extend(msg['bcc'])
+        ids = iter(self.addresses.assignIDs(addresses))
+        values = []
+        for msg in msgs:
+            sender_id = ids.next()
+            recipient_ids = tuple([[ids.next() for a in msg[field]] for field in ['to','cc','bcc']])
+            values.append(encode_message(msg,sender_id,recipient_ids))
+        return values
+
+    def _encode_pairs(self,pairs,dictionary,assign):
+        strings = [s for pair in pairs for s in pair]
+        if assign:
+            ids = dictionary.assignIDs(strings)
+        else:
+            ids = dictionary.getIDs(strings)
+        keys = []
+        for i in xrange(0,len(ids),2):
+            if ids[i] == None or ids[i+1] == None:
+                keys.append(None)
+            else:
+                keys.append(encode_id_pair(ids[i],ids[i+1]))
+        return keys
+
+    def _decode_pairs(self,keys,dictionary):
+        ids = [id for key in keys for id in decode_id_pair(key)]
+        strings = dictionary.getStrings(ids)
+        return [(strings[i],strings[i+1]) for i in xrange(0,len(strings),2)]
+
+    def encodeRelationshipKeys(self,rel_ids,assign=False):
+        return self._encode_pairs(rel_ids,self.addresses,assign)
+
+    def decodeRelationshipKeys(self,keys):
+        return self._decode_pairs(keys,self.addresses)
+
+    def encodeRelationship(self,tlist):
+        mids = self.message_ids.assignIDs([t[0] for t in tlist])
+        roles = None
+        if len(tlist) > 0 and len(tlist[0]) > 2:
+            roles = [t[2] for t in tlist]
+        return encode_relationship(mids,[t[1] for t in tlist],roles)
+
+    def _tlists(self,values):
+        strings = self.message_ids._strings
+        tlists = []
+        for s in values:
+            mids, secs, roles = decode_relationship(s)
+            if roles == None:
+                tlists.append(zip(_lookup(strings,mids),secs))
+            else:
+                tlists.append(zip(_lookup(strings,mids),secs,roles))
+        return tlists
+
+    def decodeRelationships(self,values):
+        try:
+            return self._tlists(values)
+        except LookupError:
+            ids = []
+            for s in values:
+                ids.extend(decode_relationship(s)[0])
+            self.message_ids.getStrings(ids)
+            return self._tlists(values)
+
+    def encodeExtents(self,extents):
+        extents = list(extents)
+        ids = self.addresses.assignIDs([e[0] for e in extents])
+        return encode_extents(ids,[e[1][0] for e in extents],[e[1][1] for e in extents])
+
+    def decodeExtents(self,s):
+        ids, mins, maxs = decode_extents(s)
+        return set(zip(self.addresses.getStrings(ids),zip(mins,maxs)))
+
+    def encodeMessagePairKeys(self,pairs,assign=False):
+        return self._encode_pairs([sorted(pair) for pair in pairs],self.message_ids,assign)
+
+    def decodeMessagePairKeys(self,keys):
+        return [list(pair) for pair in self._decode_pairs(keys,self.message_ids)]
+
+    def encodeValue(self,value):
+        return marshal.dumps(value)
+
+    def decodeValue(self,s):
+        return marshal.loads(s)
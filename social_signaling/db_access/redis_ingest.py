@@ -0,0 +1,504 @@
+"""Redis ingest of the UC Berkeley Enron database, used by berkeley_enron_import_redis.py.
+
+The messages are streamed along with their recipients by a reader, either an IngestReader
+reading MySQL (see ingest_reader) or a MailReader reading mail files (see mail_reader),
+normalized, and written to the messages and message_headers hashes and the
+sorted_message_ids sorted set as they arrive. The directed communication relationships are
+aggregated in memory by CommAggregates and bulk loaded once all of the messages are in.
+
+The message keys are split into partitions, which are ingested by a pool of worker
+processes. Each worker reads, normalizes, encodes and writes the messages of its own
+partition and returns the relationship aggregates of the partition. The aggregates are
+merged in partition order and the relationship lists are ordered by (epoch secs, message
+id), so the result does not depend on the number of partitions.
+
+The progress of an ingest run is recorded in the ingest_checkpoints hash: the number of
+partitions, the last message key loaded by each partition, which is written in the same
+MULTI/EXEC transaction as the batch of messages it covers, and a completion marker for
+each stage. All of the writes are idempotent, so an interrupted run can be resumed from the
+checkpoints: the partitions continue after their last message key, and the relationship
+aggregates of the messages that were already loaded are rebuilt from the message_headers
+hash.
+
+Each message is written along with a digest of its content, i.e. of all of its properties
+except the message id, to the message_digests hash. The message ids are aggregated by
+digest as well and loaded into the message_ids_per_digest hash, which maps each digest to
+the sorted list of message ids holding that content. collapse_duplicates() removes the
+copies of duplicated messages before the relationships are loaded.
+
+estimate() times each stage on a sample of the messages without writing to redis and
+prints the estimated duration of the stages for the whole corpus.
+"""
+
+import hashlib
+import marshal
+import redis
+import time
+from itertools       import islice
+from multiprocessing import Pool
+from social_signaling.db_access.ingest_normalize import normalize_address, normalize_datetime
+
+# Number of messages or hash fields written to redis with each pipelined command
+WRITE_BATCH_SIZE = 1000
+
+# Hash holding the progress checkpoints of an ingest run
+CHECKPOINT_KEY = 'ingest_checkpoints'
+
+# Number of messages timed by a dry run
+DRY_RUN_SAMPLE_SIZE = 2000
+
+# The recipient fields. The role of a recipient in a message is the first field that
+# lists the recipient.
+RECIPIENT_FIELDS = ['to','cc','bcc']
+
+# The message properties covered by the content digest: all of them except the message id
+DIGEST_FIELDS = ['datetime','epoch_secs','sender','to','cc','bcc','subject','body']
+
+def report(count,label,start_time):
+    """Prints the number of items processed by a stage and the throughput."""
+    elapsed = max(time.time() - start_time,1e-6)
+    print "%d %s processed (%.0f per sec)." % (count,label,count/elapsed)
+
+def get_checkpoints(rdb):
+    """Returns the checkpoint dictionary of the current ingest run, which is empty if no run
+    has started."""
+    return rdb.hgetall(CHECKPOINT_KEY)
+
+def is_stage_done(checkpoints,stage):
+    """Returns True if the stage is marked as completed in the checkpoint dictionary."""
+    return checkpoints.get('stage:' + stage) == 'done'
+
+def mark_stage_done(rdb,stage):
+    """Marks the stage of the current ingest run as completed."""
+    rdb.hset(CHECKPOINT_KEY,'stage:' + stage,'done')
+
+def make_message(msg,recips):
+    """Returns the legacy message dictionary for the message row and its recipient rows
+    as yielded by IngestReader.messages() and MailReader.messages()."""
+    sender, msg_dt, msg_tz, msg_id, msg_subj, msg_body = msg
+
+    if msg_dt != None:
+
+        # normalize the datetime to UTC and convert it into seconds since the epoch
+        msg_dt, msg_dt_secs = normalize_datetime(msg_dt,msg_tz)
+        msg_dt_string = str(msg_dt)
+
+    else:
+        msg_dt_secs = 0
+        msg_dt_string = 'None'
+
+    m_dict = { 'message_id' : msg_id, 'datetime' : msg_dt_string, 'epoch_secs' : msg_dt_secs,
+               'subject' : msg_subj, 'body' : msg_body, 'sender' : normalize_address(sender),
+               'to' : [], 'cc' : [], 'bcc' : [] }
+
+    # add the (address, order) tuples of the recipients to the recipient fields
+    for recip in recips:
+        r_tup = (normalize_address(recip[3]),int(recip[2]))
+        if m_dict.has_key(recip[1]):
+            m_dict[recip[1]].append(r_tup)
+        else:
+            m_dict[recip[1]] = [r_tup]
+
+    # sort the recipients by their position info and reduce the lists down to the addresses
+    # only, now in the proper order
+    for field in RECIPIENT_FIELDS:
+        m_dict[field].sort(key=lambda tup: tup[1])
+        m_dict[field] = [tup[0] for tup in m_dict[field]]
+
+    return m_dict
+
+def _digest_value(value):
+    if isinstance(value,unicode):
+        value = value.encode('utf-8')
+    else:
+        value = str(value)
+    return '%d:%s' % (len(value),value)
+
+def message_digest(m_dict):
+    """Returns the SHA-1 hex digest of the content of the message dictionary, i.e. of all of
+    its properties except the message id. Copies of a message stored under different message
+    ids have the same digest. Each value is length prefixed, so that the digest does not
+    depend on how the values could be concatenated."""
+    digest = hashlib.sha1()
+    for field in DIGEST_FIELDS:
+        value = m_dict[field]
+        if isinstance(value,list):
+            digest.update('%d[' % len(value))
+            for item in value:
+                digest.update(_digest_value(item))
+        else:
+            digest.update(_digest_value(value))
+    return digest.hexdigest()
+
+def queue_message(pipe,m_dict,digest=None):
+    """Queues the writes of the message to the messages hash, of the message without the
+    body to the header-only message hash, of the message id to the sorted set and, if given,
+    of the content digest to the message_digests hash."""
+    msg_id = m_dict['message_id']
+    pipe.hset('messages',msg_id,marshal.dumps(m_dict))
+    h_dict = m_dict.copy()
+    del h_dict['body']
+    pipe.hset('message_headers',msg_id,marshal.dumps(h_dict))
+    pipe.zadd('sorted_message_ids',msg_id,m_dict['epoch_secs'])
+    if digest != None:
+        pipe.hset('message_digests',msg_id,marshal.dumps(digest))
+
+def _extend(extents,key,min_secs,max_secs):
+    """Widens the extent stored for key in the extents dictionary to include the given
+    extent."""
+    extent = extents.get(key)
+    if extent == None:
+        extents[key] = (min_secs,max_secs)
+    elif min_secs < extent[0] or max_secs > extent[1]:
+        extents[key] = (min(min_secs,extent[0]),max(max_secs,extent[1]))
+
+def merge_relationship_lists(t_list,new_tuples):
+    """Returns the relationship list t_list with the tuples of new_tuples merged in. Both
+    lists are in ascending (epoch secs, message id) order, as sorted by CommAggregates.sort,
+    and so is the result, so appending messages yields the same lists as ingesting them
+    all at once."""
+    merged = []
+    i = 0
+    n = len(t_list)
+    for tup in new_tuples:
+        while i < n and (t_list[i][1],t_list[i][0]) <= (tup[1],tup[0]):
+            merged.append(t_list[i])
+            i += 1
+        merged.append(tup)
+    merged.extend(t_list[i:])
+    return merged
+
+class CommAggregates(object):
+    """Directed communication relationships aggregated from messages:
+
+      rel_lists      - lists of (message id, epoch secs, recipient role) tuples by
+                       (sender email address, recipient email address) tuple
+      recip_extents  - (min epoch secs, max epoch secs) extents by recipient email address
+                       by sender email address
+      sender_extents - (min epoch secs, max epoch secs) extents by sender email address by
+                       recipient email address
+      digests        - lists of message ids by message content digest
+    """
+
+    def __init__(self):
+        self.rel_lists = {}
+        self.recip_extents = {}
+        self.sender_extents = {}
+        self.digests = {}
+
+    def add_message(self,m_dict):
+        """Adds the relationships of the message."""
+        sender = m_dict['sender']
+        msg_id = m_dict['message_id']
+        secs = m_dict['epoch_secs']
+
+        # some email addresses are added to more than one recipient field (to/cc/bcc). only
+        # the first role of each recipient is kept.
+        roles = {}
+        for field in RECIPIENT_FIELDS:
+            for recip in m_dict[field]:
+                if not roles.has_key(recip):
+                    roles[recip] = field
+
+        for recip, role in roles.iteritems():
+
+            # if the sender and recipient email addresses are the same, skip this relationship
+            if sender == recip:
+                continue
+
+            rel = (sender,recip)
+            t_list = self.rel_lists.get(rel)
+            if t_list == None:
+                self.rel_lists[rel] = t_list = []
+            t_list.append((msg_id,secs,role))
+            _extend(self.recip_extents.setdefault(sender,{}),recip,secs,secs)
+            _extend(self.sender_extents.setdefault(recip,{}),sender,secs,secs)
+
+    def add_digest(self,msg_id,digest):
+        """Adds the message id to the message ids with the content digest."""
+        self.digests.setdefault(digest,[]).append(msg_id)
+
+    def duplicate_copies(self):
+        """Returns the set of message ids of the copies of duplicated messages. The copy with
+        the smallest message id of each set of duplicates is kept."""
+        copies = set()
+        for msg_ids in self.digests.itervalues():
+            if len(msg_ids) > 1:
+                copies.update(sorted(msg_ids)[1:])
+        return copies
+
+    def remove_messages(self,msg_ids):
+        """Removes the relationships of the messages with the given set of ids and recomputes
+        the extents."""
+        for rel in self.rel_lists.keys():
+            t_list = [tup for tup in self.rel_lists[rel] if not tup[0] in msg_ids]
+            if t_list:
+                self.rel_lists[rel] = t_list
+            else:
+                del self.rel_lists[rel]
+        self.recip_extents = {}
+        self.sender_extents = {}
+        for (sender,recip), t_list in self.rel_lists.iteritems():
+            min_secs = min([tup[1] for tup in t_list])
+            max_secs = max([tup[1] for tup in t_list])
+            _extend(self.recip_extents.setdefault(sender,{}),recip,min_secs,max_secs)
+            _extend(self.sender_extents.setdefault(recip,{}),sender,min_secs,max_secs)
+
+    def merge(self,other):
+        """Adds the relationships and digests aggregated by other."""
+        for rel, t_list in other.rel_lists.iteritems():
+            self.rel_lists.setdefault(rel,[]).extend(t_list)
+        for digest, msg_ids in other.digests.iteritems():
+            self.digests.setdefault(digest,[]).extend(msg_ids)
+        for mine, theirs in ((self.recip_extents,other.recip_extents),
+                             (self.sender_extents,other.sender_extents)):
+            for address, extents in theirs.iteritems():
+                my_extents = mine.setdefault(address,{})
+                for key, extent in extents.iteritems():
+                    _extend(my_extents,key,extent[0],extent[1])
+
+    def sort(self):
+        """Orders each relationship list by ascending epoch secs, breaking ties by message
+        id."""
+        for t_list in self.rel_lists.itervalues():
+            t_list.sort(key=lambda tup: (tup[1],tup[0]))
+
+    def _load_hash(self,rdb,name,items,label):
+        start_time = time.time()
+        pipe = rdb.pipeline(transaction=False)
+        batch = {}
+        i = 0
+        for field, value in items:
+            batch[field] = value
+            i += 1
+            if len(batch) == WRITE_BATCH_SIZE:
+                pipe.hmset(name,batch)
+                pipe.execute()
+                batch = {}
+                report(i,label,start_time)
+        if batch:
+            pipe.hmset(name,batch)
+            pipe.execute()
+        report(i,label,start_time)
+
+    def load(self,rdb):
+        """Bulk loads the mids_per_directed_comm_relationship, recipients_per_sender_address
+        and senders_per_recipient_address hashes with pipelined HMSETs."""
+        self._load_hash(rdb,'mids_per_directed_comm_relationship',
+                        ((str(rel),marshal.dumps(t_list)) for rel, t_list in self.rel_lists.iteritems()),
+                        "relationships")
+        self._load_hash(rdb,'recipients_per_sender_address',
+                        ((sender,marshal.dumps(set(extents.iteritems())))
+                         for sender, extents in self.recip_extents.iteritems()),
+                        "senders")
+        self._load_hash(rdb,'senders_per_recipient_address',
+                        ((recip,marshal.dumps(set(extents.iteritems())))
+                         for recip, extents in self.sender_extents.iteritems()),
+                        "recipients")
+
+    def load_digests(self,rdb):
+        """Bulk loads the message_ids_per_digest hash with pipelined HMSETs."""
+        self._load_hash(rdb,'message_ids_per_digest',
+                        ((digest,marshal.dumps(sorted(msg_ids))) for digest, msg_ids in self.digests.iteritems()),
+                        "digests")
+
+def collapse_duplicates(rdb,aggregates):
+    """Removes the copies of duplicated messages from the messages and message_headers
+    hashes, from the sorted_message_ids sorted set and from the relationships of the
+    aggregates, keeping the copy with the smallest message id. The copies stay in the
+    message_digests and message_ids_per_digest hashes. Returns the number of copies
+    removed and the number of their recipients, not counting copies that an interrupted
+    run removed already."""
+    copies = aggregates.duplicate_copies()
+    start_time = time.time()
+    pipe = rdb.pipeline(transaction=False)
+    batch = list(copies)
+    num_msgs = 0
+    num_recips = 0
+    for i in xrange(0,len(batch),WRITE_BATCH_SIZE):
+        msg_ids = batch[i:i+WRITE_BATCH_SIZE]
+
+        # count the copies that were not removed by an interrupted run and their recipients
+        for h_dict_str in rdb.hmget('message_headers',msg_ids):
+            if h_dict_str != None:
+                num_msgs += 1
+                h_dict = marshal.loads(h_dict_str)
+                for field in RECIPIENT_FIELDS:
+                    num_recips += len(h_dict[field])
+
+        pipe.hdel('messages',*msg_ids)
+        pipe.hdel('message_headers',*msg_ids)
+        pipe.zrem('sorted_message_ids',*msg_ids)
+        pipe.execute()
+        report(i+len(msg_ids),"duplicate copies",start_time)
+    aggregates.remove_messages(copies)
+    return num_msgs, num_recips
+
+def _add_loaded_messages(rdb,aggregates):
+    """Adds the relationships of the messages in the message_headers hash to the aggregates.
+    Returns the number of messages and recipients."""
+    start_time = time.time()
+    seen = set()
+    num_recips = 0
+    for msg_id, h_dict_str in rdb.hscan_iter('message_headers',count=WRITE_BATCH_SIZE):
+
+        # HSCAN may return a field more than once
+        if msg_id in seen:
+            continue
+        seen.add(msg_id)
+
+        h_dict = marshal.loads(h_dict_str)
+        aggregates.add_message(h_dict)
+        for field in RECIPIENT_FIELDS:
+            num_recips += len(h_dict[field])
+        if len(seen) % WRITE_BATCH_SIZE == 0:
+            report(len(seen),"loaded messages",start_time)
+    report(len(seen),"loaded messages",start_time)
+    return len(seen), num_recips
+
+def _add_loaded_digests(rdb,aggregates):
+    """Adds the content digests in the message_digests hash to the aggregates."""
+    seen = set()
+    for msg_id, digest in rdb.hscan_iter('message_digests',count=WRITE_BATCH_SIZE):
+        if not msg_id in seen:
+            seen.add(msg_id)
+            aggregates.add_digest(msg_id,marshal.loads(digest))
+
+def ingest_partition(args):
+    """Writes the messages of a partition to redis. args is a (reader, redis_kwargs,
+    partition, num_partitions, start_after) tuple, where redis_kwargs are the redis.Redis
+    arguments and start_after is the last message key of the partition that was loaded
+    before, or None. Returns the number of messages, the number of recipients and the
+    CommAggregates of the partition."""
+    reader, redis_kwargs, partition, num_partitions, start_after = args
+    reader = reader.partition_reader(partition,num_partitions,start_after)
+    rdb = redis.Redis(**redis_kwargs)
+    pipe = rdb.pipeline(transaction=True)
+    checkpoint = 'partition:%d' % partition
+    aggregates = CommAggregates()
+    label = "messages"
+    if num_partitions > 1:
+        label = "messages of partition %d" % partition
+    start_time = time.time()
+    num_msgs = 0
+    num_recips = 0
+    for key, msg, recips in reader.keyed_messages():
+        m_dict = make_message(msg,recips)
+        digest = message_digest(m_dict)
+        queue_message(pipe,m_dict,digest)
+        aggregates.add_message(m_dict)
+        aggregates.add_digest(m_dict['message_id'],digest)
+        num_msgs += 1
+        num_recips += len(recips)
+
+        # commit the batch along with the checkpoint of its last message key
+        if num_msgs % WRITE_BATCH_SIZE == 0:
+            pipe.hset(CHECKPOINT_KEY,checkpoint,key)
+            pipe.execute()
+            report(num_msgs,label,start_time)
+    if num_msgs % WRITE_BATCH_SIZE != 0:
+        pipe.hset(CHECKPOINT_KEY,checkpoint,key)
+        pipe.execute()
+    report(num_msgs,label,start_time)
+    return num_msgs, num_recips, aggregates
+
+def ingest(reader,redis_kwargs,num_workers=1):
+    """Writes the messages of the reader to redis from num_workers worker processes, each
+    ingesting one partition of the messages, or from the calling process if num_workers is
+    one. Returns the number of messages, the number of recipients and the merged and sorted
+    CommAggregates.
+
+    If the checkpoints show that a previous run was interrupted, the run is resumed with
+    the number of partitions of that run."""
+    rdb = redis.Redis(**redis_kwargs)
+    checkpoints = get_checkpoints(rdb)
+    if checkpoints.has_key('num_partitions'):
+        num_workers = int(checkpoints['num_partitions'])
+    else:
+        rdb.hset(CHECKPOINT_KEY,'num_partitions',num_workers)
+
+    # rebuild the aggregates of the messages that were loaded before
+    num_msgs = 0
+    num_recips = 0
+    aggregates = CommAggregates()
+    if is_stage_done(checkpoints,'messages') or \
+       any(checkpoints.has_key('partition:%d' % p) for p in xrange(num_workers)):
+        print "Rebuilding the relationships of the messages loaded by the interrupted run."
+        num_msgs, num_recips = _add_loaded_messages(rdb,aggregates)
+        _add_loaded_digests(rdb,aggregates)
+
+    if not is_stage_done(checkpoints,'messages'):
+        tasks = []
+        for p in xrange(num_workers):
+            start_after = checkpoints.get('partition:%d' % p)
+            if start_after != None:
+                start_after = int(start_after)
+            tasks.append((reader,redis_kwargs,p,num_workers,start_after))
+        if num_workers > 1:
+            pool = Pool(num_workers)
+            try:
+                results = pool.map(ingest_partition,tasks)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            results = map(ingest_partition,tasks)
+
+        # merge the partitions in partition order
+        for partition_msgs, partition_recips, partition_aggregates in results:
+            num_msgs += partition_msgs
+            num_recips += partition_recips
+            aggregates.merge(partition_aggregates)
+        mark_stage_done(rdb,'messages')
+
+    aggregates.sort()
+    return num_msgs, num_recips, aggregates
+
+class _DryRunPipeline(object):
+    """Pipeline that discards the writes queued by queue_message."""
+
+    def hset(self,name,key,value):
+        pass
+
+    def zadd(self,name,value,score):
+        pass
+
+def estimate(reader,num_workers=1,sample_size=DRY_RUN_SAMPLE_SIZE):
+    """Times the read, normalize, encode and aggregate stages of the ingest on the first
+    sample_size messages of the reader, without writing to redis, and prints the throughput
+    of each stage along with its estimated duration for the whole corpus with num_workers
+    workers."""
+    total = reader.count_messages()
+    print "Timing the ingest stages on a sample of %d of %d messages." % (min(sample_size,total),total)
+
+    start_time = time.time()
+    messages = reader.messages()
+    rows = list(islice(messages,sample_size))
+    messages.close()
+    timings = [("read",time.time() - start_time)]
+
+    start_time = time.time()
+    m_dicts = [make_message(msg,recips) for msg, recips in rows]
+    timings.append(("normalize",time.time() - start_time))
+
+    start_time = time.time()
+    pipe = _DryRunPipeline()
+    for m_dict in m_dicts:
+        queue_message(pipe,m_dict,message_digest(m_dict))
+    timings.append(("encode",time.time() - start_time))
+
+    start_time = time.time()
+    aggregates = CommAggregates()
+    for m_dict in m_dicts:
+        aggregates.add_message(m_dict)
+    timings.append(("aggregate",time.time() - start_time))
+
+    # the stages run in each worker on its partition of the messages
+    total_secs = 0.0
+    for stage, elapsed in timings:
+        rate = len(rows) / max(elapsed,1e-6)
+        secs = total / rate / num_workers
+        total_secs += secs
+        print "%-10s %10.0f messages / sec  %10.1f secs estimated" % (stage,rate,secs)
+    print "Estimated %.1f secs for %d messages with %d workers, excluding the redis writes." % \
+          (total_secs,total,num_workers)
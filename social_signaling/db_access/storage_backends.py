@@ -0,0 +1,504 @@
+"""Storage backends for the key-value data used by DB.
+
+Every backend exposes the subset of the redis-py client API that the analysis and ingest
+code relies on: strings, hashes, sets and sorted sets, key management and pipelines. DB
+talks to whichever backend it is given through this interface, so the same code runs
+against
+
+  RedisBackend      - a Redis server (the redis-py client itself),
+  DictBackend       - an in-process store held in Python dictionaries,
+  SnapshotBackend   - an in-process store loaded into memory from, and saved to, an
+                      on-disk snapshot.
+
+Snapshots are written by save_snapshot from any backend, including a live Redis server,
+so a database can be exported once and analyzed offline without starting any servers.
+
+Sorted sets use the argument order of the legacy redis.Redis client, i.e.
+zadd(name, value, score).
+"""
+
+import os
+import marshal
+import fnmatch
+import redis
+from bisect import bisect_left
+
+# Identifies snapshot files and the version of their layout
+SNAPSHOT_MAGIC = 'SSDBSNAP'
+SNAPSHOT_VERSION = 1
+
+class RedisBackend(redis.Redis):
+    """Backend for a Redis server. This is the legacy redis-py client, which already
+    provides the backend interface."""
+    pass
+
+def _to_str(value):
+    """Converts a value to the string Redis would store for it."""
+    if isinstance(value,str):
+        return value
+    elif isinstance(value,unicode):
+        return value.encode('utf-8')
+    else:
+        return str(value)
+
+def _score_bound(bound):
+    """Returns the score and whether it is exclusive for a sorted set score bound, which may
+    be a number or a string such as '-inf', '+inf' or '(5' as in Redis."""
+    if isinstance(bound,basestring) and bound.startswith('('):
+        return float(bound[1:]), True
+    return float(bound), False
+
+def _wrong_type(key):
+    return redis.ResponseError("WRONGTYPE Operation against key %s holding the wrong kind of value" % key)
+
+class SortedSet(object):
+    """Sorted set of members with float scores. The (score, member) ordering is rebuilt
+    lazily after modifications."""
+
+    def __init__(self,scores=None):
+        self.scores = scores or {}
+        self._ordered = None
+
+    def __len__(self):
+        return len(self.scores)
+
+    def add(self,member,score):
+        """Adds member or updates its score. Returns 1 if member is new."""
+        is_new = not self.scores.has_key(member)
+        self.scores[member] = float(score)
+        self._ordered = None
+        return int(is_new)
+
+    def remove(self,member):
+        """Removes member. Returns 1 if it was present."""
+        if self.scores.pop(member,None) == None:
+            return 0
+        self._ordered = None
+        return 1
+
+    def ordered(self):
+        """Returns the list of (score, member) pairs in ascending order."""
+        if self._ordered == None:
+            self._ordered = sorted([(score, member) for member, score in self.scores.iteritems()])
+        return self._ordered
+
+class Pipeline(object):
+    """Buffers commands for a DictBackend and runs them in order on execute(). The backend
+    is single-threaded and in-process, so every pipeline behaves like a transaction."""
+
+    def __init__(self,backend):
+        self._backend = backend
+        self._commands = []
+        self._watching = False
+
+    def __getattr__(self,name):
+        if name.startswith('_') or not hasattr(self._backend,name):
+            raise AttributeError(name)
+        def command(*args,**kwargs):
+            if self._watching:
+                return getattr(self._backend,name)(*args,**kwargs)
+            self._commands.append((name,args,kwargs))
+            return self
+        return command
+
+    def __len__(self):
+        return len(self._commands)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,exc_type,exc_value,traceback):
+        self.reset()
+
+    def watch(self,*names):
+        """Runs the following commands immediately until multi() is called, as redis-py
+        does. No other client can modify the keys, so the transaction never fails."""
+        self._watching = True
+        return True
+
+    def multi(self):
+        """Buffers the following commands until execute()."""
+        self._watching = False
+
+    def unwatch(self):
+        self._watching = False
+        return True
+
+    def reset(self):
+        """Discards the buffered commands."""
+        self._commands = []
+        self._watching = False
+
+    def execute(self):
+        """Runs the buffered commands and returns the list of their results."""
+        commands, self._commands = self._commands, []
+        return [getattr(self._backend,name)(*args,**kwargs) for name, args, kwargs in commands]
+
+class DictBackend(object):
+    """In-process backend holding all keys in a dictionary. Strings are stored as str,
+    hashes as dict, sets as set and sorted sets as SortedSet. Values are converted to
+    strings on write, as Redis does."""
+
+    def __init__(self):
+        self._data = {}
+
+        # Key list of each hash being scanned with hscan
+        self._scan_keys = {}
+
+    def _get(self,key,kind):
+        """Returns the container stored at key or None. Raises a ResponseError if the key
+        holds a different type."""
+        value = self._data.get(key)
+        if value != None and not isinstance(value,kind):
+            raise _wrong_type(key)
+        return value
+
+    def _get_or_create(self,key,kind):
+        value = self._get(key,kind)
+        if value == None:
+            value = self._data[key] = kind()
+        return value
+
+    def _drop_if_empty(self,key):
+        if len(self._data[key]) == 0:
+            del self._data[key]
+
+    def pipeline(self,transaction=True,shard_hint=None):
+        return Pipeline(self)
+
+    #========== Keys ==========#
+
+    def exists(self,name):
+        return self._data.has_key(name)
+
+    def delete(self,*names):
+        count = 0
+        for name in names:
+            if self._data.pop(name,None) != None:
+                count += 1
+        return count
+
+    def rename(self,src,dst):
+        if not self._data.has_key(src):
+            raise redis.ResponseError("no such key")
+        self._data[dst] = self._data.pop(src)
+        return True
+
+    def keys(self,pattern='*'):
+        if pattern == '*':
+            return self._data.keys()
+        return [key for key in self._data if fnmatch.fnmatchcase(key,pattern)]
+
+    def type(self,name):
+        value = self._data.get(name)
+        if value == None:
+            return 'none'
+        return { str : 'string', dict : 'hash', set : 'set', SortedSet : 'zset' }[type(value)]
+
+    def dbsize(self):
+        return len(self._data)
+
+    def flushdb(self):
+        self._data.clear()
+        return True
+
+    def flushall(self):
+        return self.flushdb()
+
+    #========== Strings ==========#
+
+    def get(self,name):
+        return self._get(name,str)
+
+    def set(self,name,value):
+        self._data[name] = _to_str(value)
+        return True
+
+    def incr(self,name,amount=1):
+        value = int(self.get(name) or 0) + amount
+        self._data[name] = str(value)
+        return value
+
+    #========== Hashes ==========#
+
+    def hget(self,name,key):
+        h = self._get(name,dict)
+        if h == None:
+            return None
+        return h.get(_to_str(key))
+
+    def hset(self,name,key,value):
+        h = self._get_or_create(name,dict)
+        key = _to_str(key)
+        is_new = not h.has_key(key)
+        h[key] = _to_str(value)
+        return int(is_new)
+
+    def hsetnx(self,name,key,value):
+        h = self._get_or_create(name,dict)
+        key = _to_str(key)
+        if h.has_key(key):
+            return 0
+        h[key] = _to_str(value)
+        return 1
+
+    def hmget(self,name,keys,*args):
+        if isinstance(keys,basestring):
+            keys = [keys]
+        keys = map(_to_str,list(keys) + list(args))
+        h = self._get(name,dict)
+        if h == None:
+            return [None] * len(keys)
+        return map(h.get,keys)
+
+    def hmset(self,name,mapping):
+        if len(mapping) == 0:
+            raise redis.DataError("'hmset' with 'mapping' of length 0")
+        h = self._get_or_create(name,dict)
+        for key, value in mapping.iteritems():
+            h[_to_str(key)] = _to_str(value)
+        return True
+
+    def hdel(self,name,*keys):
+        h = self._get(name,dict)
+        if h == None:
+            return 0
+        count = 0
+        for key in keys:
+            if h.pop(_to_str(key),None) != None:
+                count += 1
+        self._drop_if_empty(name)
+        return count
+
+    def hexists(self,name,key):
+        h = self._get(name,dict)
+        return h != None and h.has_key(_to_str(key))
+
+    def hincrby(self,name,key,amount=1):
+        h = self._get_or_create(name,dict)
+        key = _to_str(key)
+        value = int(h.get(key,0)) + amount
+        h[key] = str(value)
+        return value
+
+    def hlen(self,name):
+        return len(self._get(name,dict) or {})
+
+    def hkeys(self,name):
+        return (self._get(name,dict) or {}).keys()
+
+    def hvals(self,name):
+        return (self._get(name,dict) or {}).values()
+
+    def hgetall(self,name):
+        return dict(self._get(name,dict) or {})
+
+    def hscan(self,name,cursor=0,match=None,count=None):
+        """Returns (next cursor, dictionary) for the next count entries of the hash. The
+        keys of the hash are listed once when a scan starts with cursor 0 and the cursor is
+        the position in that list, so a full scan takes linear time. Entries added during
+        the scan are missed and entries removed during the scan are skipped."""
+        h = self._get(name,dict) or {}
+        count = count or 10
+        keys = self._scan_keys.get(name)
+        if cursor == 0 or keys == None:
+            keys = self._scan_keys[name] = h.keys()
+        batch = keys[cursor:cursor+count]
+        next_cursor = cursor + len(batch)
+        if next_cursor >= len(keys):
+            next_cursor = 0
+            del self._scan_keys[name]
+        items = [(key, h[key]) for key in batch if h.has_key(key)]
+        if match != None:
+            items = [item for item in items if fnmatch.fnmatchcase(item[0],match)]
+        return next_cursor, dict(items)
+
+    def hscan_iter(self,name,match=None,count=None):
+        cursor = None
+        while cursor != 0:
+            cursor, data = self.hscan(name,cursor or 0,match,count)
+            for item in data.iteritems():
+                yield item
+
+    #========== Sets ==========#
+
+    def sadd(self,name,*values):
+        s = self._get_or_create(name,set)
+        n = len(s)
+        s.update([_to_str(value) for value in values])
+        return len(s) - n
+
+    def srem(self,name,*values):
+        s = self._get(name,set)
+        if s == None:
+            return 0
+        n = len(s)
+        s.difference_update(map(_to_str,values))
+        removed = n - len(s)
+        self._drop_if_empty(name)
+        return removed
+
+    def sismember(self,name,value):
+        s = self._get(name,set)
+        return s != None and _to_str(value) in s
+
+    def smembers(self,name):
+        return set(self._get(name,set) or ())
+
+    def scard(self,name):
+        return len(self._get(name,set) or ())
+
+    #========== Sorted sets ==========#
+
+    def zadd(self,name,*args,**kwargs):
+        """Adds members with the legacy argument order: zadd(name, value1, score1,
+        value2, score2, ...) or zadd(name, value1=score1, ...)."""
+        if len(args) % 2 != 0:
+            raise redis.RedisError("ZADD requires an equal number of values and scores")
+        z = self._get_or_create(name,SortedSet)
+        pairs = zip(args[::2],args[1::2]) + kwargs.items()
+        return sum([z.add(_to_str(value),score) for value, score in pairs])
+
+    def zrem(self,name,*values):
+        z = self._get(name,SortedSet)
+        if z == None:
+            return 0
+        removed = sum([z.remove(_to_str(value)) for value in values])
+        self._drop_if_empty(name)
+        return removed
+
+    def zcard(self,name):
+        return len(self._get(name,SortedSet) or ())
+
+    def zscore(self,name,value):
+        z = self._get(name,SortedSet)
+        if z == None:
+            return None
+        return z.scores.get(_to_str(value))
+
+    def zrank(self,name,value):
+        z = self._get(name,SortedSet)
+        value = _to_str(value)
+        if z == None or not z.scores.has_key(value):
+            return None
+        return bisect_left(z.ordered(),(z.scores[value],value))
+
+    def _zresult(self,pairs,withscores,score_cast_func):
+        if withscores:
+            return [(member, score_cast_func(score)) for score, member in pairs]
+        return [member for score, member in pairs]
+
+    def zrange(self,name,start,end,desc=False,withscores=False,score_cast_func=float):
+        z = self._get(name,SortedSet)
+        if z == None:
+            return []
+        ordered = z.ordered()
+        if desc:
+            ordered = ordered[::-1]
+        n = len(ordered)
+        if start < 0:
+            start = max(n + start,0)
+        if end < 0:
+            end = n + end
+        return self._zresult(ordered[start:end+1],withscores,score_cast_func)
+
+    def zrangebyscore(self,name,min,max,start=None,num=None,withscores=False,score_cast_func=float):
+        if (start == None) != (num == None):
+            raise redis.RedisError("``start`` and ``num`` must both be specified")
+        z = self._get(name,SortedSet)
+        if z == None:
+            return []
+        ordered = z.ordered()
+        min, min_exclusive = _score_bound(min)
+        max, max_exclusive = _score_bound(max)
+        lo = bisect_left(ordered,(min,))
+        while lo < len(ordered) and min_exclusive and ordered[lo][0] == min:
+            lo += 1
+        hi = bisect_left(ordered,(max,),lo)
+        while hi < len(ordered) and not max_exclusive and ordered[hi][0] == max:
+            hi += 1
+        pairs = ordered[lo:hi]
+        if start != None:
+            if num < 0:
+                pairs = pairs[start:]
+            else:
+                pairs = pairs[start:start+num]
+        return self._zresult(pairs,withscores,score_cast_func)
+
+    def zcount(self,name,min,max):
+        return len(self.zrangebyscore(name,min,max))
+
+    #========== Snapshots ==========#
+
+    def save(self):
+        """Nothing to persist for a purely in-process store."""
+        return True
+
+class SnapshotBackend(DictBackend):
+    """In-process backend loaded from an on-disk snapshot written by save_snapshot.
+    The whole snapshot is read into memory when the backend is created, so opening it
+    takes time and memory proportional to the size of the database; for read-only
+    analysis of large stores, see the memory-mapped columnar snapshots of
+    columnar_snapshot.py. Changes stay in memory until save() writes them back to the
+    snapshot file. A snapshot file that does not exist yet starts out as an empty store."""
+
+    def __init__(self,path):
+        DictBackend.__init__(self)
+        self.path = path
+        if os.path.exists(path):
+            self._data = load_snapshot(path)
+
+    def save(self):
+        """Writes the store to the snapshot file."""
+        save_snapshot(self,self.path)
+        return True
+
+def save_snapshot(backend,path):
+    """Writes every key of backend to a snapshot file at path. backend may be any storage
+    backend, including a connection to a Redis server. The file is replaced atomically."""
+    data = {}
+    for key in backend.keys('*'):
+        kind = backend.type(key)
+        if kind == 'string':
+            data[key] = ('string',backend.get(key))
+        elif kind == 'hash':
+            data[key] = ('hash',backend.hgetall(key))
+        elif kind == 'set':
+            data[key] = ('set',backend.smembers(key))
+        elif kind == 'zset':
+            data[key] = ('zset',dict(backend.zrange(key,0,-1,withscores=True)))
+        elif kind != 'none':
+            err = "Snapshots do not support the %s type of key %s." % (kind,key)
+            raise Exception(err)
+
+    tmp_path = path + '.tmp'
+    f = open(tmp_path,'wb')
+    try:
+        f.write(SNAPSHOT_MAGIC)
+        marshal.dump(SNAPSHOT_VERSION,f)
+        marshal.dump(data,f)
+    finally:
+        f.close()
+    os.rename(tmp_path,path)
+
+def load_snapshot(path):
+    """Reads a snapshot file and returns the key dictionary used by DictBackend."""
+    f = open(path,'rb')
+    try:
+        if f.read(len(SNAPSHOT_MAGIC)) != SNAPSHOT_MAGIC:
+            err = "%s is not a snapshot file." % path
+            raise Exception(err)
+        version = marshal.load(f)
+        if version != SNAPSHOT_VERSION:
+            err = "Unsupported snapshot version %s." % version
+            raise Exception(err)
+        data = marshal.load(f)
+    finally:
+        f.close()
+
+    for key, (kind, value) in data.iteritems():
+        if kind == 'zset':
+            data[key] = SortedSet(value)
+        else:
+            data[key] = value
+    return data
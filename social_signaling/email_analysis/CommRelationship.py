@@ -1,4 +1,4 @@
-from social_signaling.db_access.DB   import DB
+from social_signaling.db_access.DB   import DB, HEADER_FIELDS
 from social_signaling.email_analysis import MessageCollection, MessageThreading
 from social_signaling.util.time_interval import *
 
@@ -11,6 +11,9 @@ class DirectedCommRelationship(object):
         self._db = DB()
         self._rel_id = None
         self._messages = MessageCollection.MessageCollection()
+        self._epoch_secs = []
+        self._direct_counts = None
+        self._indirect_counts = None
         if rel_id != None:
             self.setRelationshipID(rel_id)
             
@@ -25,6 +28,9 @@ class DirectedCommRelationship(object):
         
         # Set the relationship id
         self._rel_id = rel_id
+        self._epoch_secs = []
+        self._direct_counts = None
+        self._indirect_counts = None
         
         # Get the list of (message id, epoch secs) tuples for the directed relationship
         tlist = self._db.getDirectedCommRelationship(rel_id)
@@ -38,6 +44,18 @@ class DirectedCommRelationship(object):
             # Set the list of message ids in the MessageCollection object
             self._messages.setMessageIDs(mids)
             
+            # Keep the ascending epoch secs for counts over time intervals
+            self._epoch_secs = [tup[1] for tup in tlist]
+            
+            # If the recipient roles are stored with the tuples, keep running counts of the
+            # direct (TO) and indirect (CC/BCC) messages
+            if len(tlist) > 0 and len(tlist[0]) > 2:
+                self._direct_counts = [0]
+                self._indirect_counts = [0]
+                for tup in tlist:
+                    self._direct_counts.append(self._direct_counts[-1] + (tup[2] == 'to'))
+                    self._indirect_counts.append(self._indirect_counts[-1] + (tup[2] != 'to'))
+            
     def getRelationshipID(self):
         """Returns the relationship ID for the directed relationship."""
         return self._rel_id
@@ -56,41 +74,79 @@ class DirectedCommRelationship(object):
         # If a time interval is specified, check to see if it is valid
         if time_interval != None and not valid_time_interval(time_interval):
             raise Exception("The specificed time interval is not valid!")
+        if time_interval != None:
+            epoch_interval = epoch_time_interval(time_interval)
 
         # Extract the tokens
         tokens = []
         for msg in self._messages:
-            if time_interval == None or within_time_interval(msg.Datetime,time_interval):
+            if time_interval == None or (msg.hasDatetime() and 
+                                         within_epoch_time_interval(msg.EpochSecs,epoch_interval)):
                 tokens.extend(msg.getSenderTokens())
         return tokens
         
+    def _interval_slices(self,time_interval):
+        """Returns the ranges (start, stop) of the positions in the relationship's message
+        list for the messages sent within the time interval given as a tuple of datetimes.
+        The ranges are found by bisection over the stored epoch secs. Messages without a
+        datetime are stored with epoch secs zero and are excluded.
+        """
+        if not valid_time_interval(time_interval):
+            raise Exception("The specificed time interval is not valid!")
+        start, stop = epoch_time_interval_slice(self._epoch_secs,epoch_time_interval(time_interval))
+        undated_start, undated_stop = epoch_time_interval_slice(self._epoch_secs,(0,0))
+        return [(start,min(stop,undated_start)),(max(start,undated_stop),stop)]
+        
+    def _count(self,counts,time_interval):
+        """Returns the number of messages sent within the time interval from the running
+        counts, or from the positions themselves if counts is None."""
+        if time_interval == None:
+            slices = [(0,len(self._epoch_secs))]
+        else:
+            slices = self._interval_slices(time_interval)
+        total = 0
+        for start, stop in slices:
+            if start < stop:
+                if counts == None:
+                    total += stop - start
+                else:
+                    total += counts[stop] - counts[start]
+        return total
+        
     def getNumberOfMsgs(self,time_interval=None):
         """Returns the number of messages associated with the directed relationship.
         If a time interval is specified through a tuple of datetimes (interval_begin, 
         interval_end), the count returned corresponds to the number of messages that 
-        were sent within the time interval.
+        were sent within the time interval. The count is computed from the stored epoch
+        secs without fetching any messages.
         """
-        return self._messages.getNumberOfMsgs(time_interval)
+        return self._count(None,time_interval)
         
     def getNumberOfDirectMsgs(self,time_interval=None):
         """Returns the number of messages where the recipient is listed in the TO field.
         If a time interval is specified through a tuple of datetimes (interval_begin, 
         interval_end), the count returned corresponds to the number of relevant messages 
-        that were sent within the time interval.
+        that were sent within the time interval. If the recipient roles are stored with the
+        relationship, no messages are fetched.
         """
+        if self._direct_counts != None:
+            return self._count(self._direct_counts,time_interval)
 
         # If a time interval is specified, check to see if it is valid
         if time_interval != None and not valid_time_interval(time_interval):
             raise Exception("The specificed time interval is not valid!")
+        if time_interval != None:
+            epoch_interval = epoch_time_interval(time_interval)
 
         # Count the relevant messages
         count = 0
         recip = self._rel_id[1]
-        for msg in self._messages:
+        for msg in self._messages.iterMessages(HEADER_FIELDS):
             
             # If a time interval was specified and the message is not in the time interval,
             # continue to the next message
-            if time_interval != None and not within_time_interval(msg.Datetime,time_interval):
+            if time_interval != None and not (msg.hasDatetime() and 
+                                              within_epoch_time_interval(msg.EpochSecs,epoch_interval)):
                 continue
 
             if recip in msg.TO:
@@ -103,20 +159,26 @@ class DirectedCommRelationship(object):
         or BCC field. If the recipient is listed in the TO field as well, the TO field takes
         precedent. If a time interval is specified through a tuple of datetimes (interval_begin, 
         interval_end), the count returned corresponds to the number of relevant messages 
-        that were sent within the time interval.
+        that were sent within the time interval. If the recipient roles are stored with the
+        relationship, no messages are fetched.
         """
+        if self._indirect_counts != None:
+            return self._count(self._indirect_counts,time_interval)
 
         # If a time interval is specified, check to see if it is valid
         if time_interval != None and not valid_time_interval(time_interval):
             raise Exception("The specificed time interval is not valid!")
+        if time_interval != None:
+            epoch_interval = epoch_time_interval(time_interval)
 
         count = 0
         recip = self._rel_id[1]
-        for msg in self._messages:
+        for msg in self._messages.iterMessages(HEADER_FIELDS):
         
             # If a time interval was specified and the message is not in the time interval,
             # continue to the next message
-            if time_interval != None and not within_time_interval(msg.Datetime,time_interval):
+            if time_interval != None and not (msg.hasDatetime() and 
+                                              within_epoch_time_interval(msg.EpochSecs,epoch_interval)):
                 continue        
         
             if (not recip in msg.TO) and (recip in msg.CC or recip in msg.BCC):
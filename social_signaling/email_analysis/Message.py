@@ -1,10 +1,12 @@
 import re,nltk
-from social_signaling.db_access.DB import DB
+from social_signaling.db_access.DB            import DB
+from social_signaling.db_access.MessageRecord import MessageRecord
 
 class Message(object):
 
     def __init__(self, message_id=None):
         self._db = DB()
+        self._msg = MessageRecord()
         if message_id != None:
             self.setMessageID(message_id)
         
@@ -37,15 +39,31 @@ class Message(object):
    
         return disp_string
         
-    def setMessageID(self,message_id):
-        """Sets the message object attributes to those returned by db.getMessage()."""
-        
-        # Get the message properties
-        msg = self._db.getMessage(message_id)
-        
-        # Set the object properties
-        for k,v in msg.items():
-            setattr(self, k, v)
+    def setMessageID(self,message_id,fields=None):
+        """Sets the message object attributes to those returned by db.getMessage(). If a list
+        of property names is given through fields, only those properties are guaranteed to
+        be set."""
+        self.setMessageData(self._db.getMessage(message_id,fields))
+        
+    def setMessageData(self,msg):
+        """Sets the message object attributes to those in the message property dictionary
+        msg, as returned by db.getMessage() or db.getMessages()."""
+        self._msg = msg
+        
+    def __getattr__(self,name):
+        """Returns the message property name from the message property dictionary. Properties
+        such as Datetime are only constructed when they are first accessed."""
+        if name.startswith('_'):
+            raise AttributeError(name)
+        try:
+            return self._msg[name]
+        except KeyError:
+            raise AttributeError(name)
+            
+    def hasDatetime(self):
+        """Returns True if the message has a datetime. Unlike checking Datetime against None,
+        the datetime is not constructed."""
+        return self._msg.hasDatetime()
             
     def _trim_at_first_substring(self,sub,s):
         """Finds the first occurrence of sub in s. If sub is present, s is trimmed at the 
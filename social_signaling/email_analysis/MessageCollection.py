@@ -1,13 +1,19 @@
 from collections                             import Sequence
+from social_signaling.db_access.DB           import DB, HEADER_FIELDS
 from social_signaling.email_analysis.Message import Message
 from social_signaling.util.time_interval     import *
 
 class MessageCollection(Sequence):
 
-    def __init__(self,message_ids=[],message_epoch_secs={}):
+    # Number of messages fetched from the database at a time during iteration
+    _batch_size = 1000
+
+    def __init__(self,message_ids=[],message_epoch_secs={},fields=None):
+        self._db = DB()
         self._msg = Message()
         self._message_ids = []
         self._message_epoch_secs = message_epoch_secs
+        self._fields = fields
         if message_ids != []:
             self.setMessageIDs(message_ids)
         
@@ -19,22 +25,45 @@ class MessageCollection(Sequence):
         """Returns a single message object referenced by key."""
         mid = self._message_ids[key]
         if type(mid) == str:
-            self._msg.setMessageID(mid)
+            self._msg.setMessageID(mid,self._fields)
             return self._msg
         else:
             raise Exception("Slice operations are not supported.")
             
+    def __iter__(self):
+        """Iterates over the messages in the collection. The messages are fetched from the
+        database in batches rather than one at a time."""
+        return self.iterMessages(self._fields)
+        
+    def iterMessages(self,fields=None):
+        """Iterates over the messages in the collection, fetching them from the database in
+        batches. If a list of property names is given through fields, only those properties
+        are guaranteed to be set on the messages."""
+        for i in xrange(0,len(self._message_ids),self._batch_size):
+            for msg in self._db.getMessages(self._message_ids[i:i+self._batch_size],fields):
+                self._msg.setMessageData(msg)
+                yield self._msg
+            
     def _extract_message_epoch_secs(self,mids):
         """Adds message EpochSecs to the internal dictionary for the referenced messages."""
-        msg = Message()
-        for mid in mids:
-            msg.setMessageID(mid)
-            self._message_epoch_secs[mid] = msg.EpochSecs
+        mids = list(mids)
+        for i in xrange(0,len(mids),self._batch_size):
+            for msg in self._db.getMessages(mids[i:i+self._batch_size],['EpochSecs']):
+                self._message_epoch_secs[msg['MessageID']] = msg['EpochSecs']
         
     def copy(self):
-        """Returns a new MessageCollection object with the same message ids as the
-        current instance."""
-        return MessageCollection(self._message_ids,self._message_epoch_secs)
+        """Returns a new MessageCollection object with the same message ids and message
+        property fields as the current instance."""
+        return MessageCollection(self._message_ids,self._message_epoch_secs,self._fields)
+        
+    def setFields(self,fields):
+        """Sets the list of message properties fetched when messages are accessed. If fields 
+        is None, all message properties are fetched."""
+        self._fields = fields
+        
+    def getFields(self):
+        """Returns the list of message properties fetched when messages are accessed."""
+        return self._fields
         
     def timeOrder(self,time_reverse=False):
         """Reorders the message ids such that they are in ascending order based on the
@@ -81,8 +110,9 @@ class MessageCollection(Sequence):
             count = len(self._message_ids)
         else:
             count = 0
-            for msg in self:
-                if within_time_interval(msg.Datetime,time_interval):
+            epoch_interval = epoch_time_interval(time_interval)
+            for msg in self.iterMessages(HEADER_FIELDS):
+                if msg.hasDatetime() and within_epoch_time_interval(msg.EpochSecs,epoch_interval):
                     count += 1
                     
         return count
@@ -37,7 +37,7 @@ class Thread(object):
         
     def getMessageIDs(self):
         """Returns a list of the message ids in the thread."""
-        return [msg.MessageID for msg in self.getMessages()]
+        return list(self._msgs.getMessageIDs())
         
     def getNumberOfMsgs(self,time_interval=None):
         """Returns the number of messages in the thread. If a time interval is specified through 
@@ -53,8 +53,9 @@ class Thread(object):
             count = len(self._msgs)
         else:
             count = 0
-            for msg in self._msgs:
-                if within_time_interval(msg.Datetime,time_interval):
+            epoch_interval = epoch_time_interval(time_interval)
+            for msg in self._msgs.iterMessages(DB.HEADER_FIELDS):
+                if msg.hasDatetime() and within_epoch_time_interval(msg.EpochSecs,epoch_interval):
                     count += 1
                     
         return count        
@@ -68,13 +69,16 @@ class Thread(object):
         # If a time interval is specified, check to see if it is valid
         if time_interval != None and not valid_time_interval(time_interval):
             raise Exception("The specificed time interval is not valid!")       
+        if time_interval != None:
+            epoch_interval = epoch_time_interval(time_interval)
         
         count = 0
-        for msg in self._msgs:
+        for msg in self._msgs.iterMessages(DB.HEADER_FIELDS):
         
             # If a time interval was specified and the message is not in the time interval,
             # continue to the next message
-            if time_interval != None and not within_time_interval(msg.Datetime,time_interval):
+            if time_interval != None and not (msg.hasDatetime() and 
+                                              within_epoch_time_interval(msg.EpochSecs,epoch_interval)):
                 continue        
         
             if msg.Sender == sender:
@@ -130,22 +134,30 @@ class MessageThreadFactory(Borg):
         # Time order the message ids
         msgs.timeOrder()
         
-        # Create another copy of the message collection for iteration
-        msgs2 = msgs.copy()
+        # The time differentials are compared in epoch secs
+        time_delta_secs = self._time_delta.total_seconds()
+        
+        # Create two copies of the message collection for iteration. Only the message
+        # headers are needed for the comparisons.
+        msgs1 = msgs.copy()
+        msgs1.setFields(DB.HEADER_FIELDS)
+        msgs2 = msgs1.copy()
         
         # Create thread graph
         tgraph = nx.Graph()
         
-        # Begin pairwise comparisons
+        # Begin pairwise comparisons. The message pairs that satisfy the time and sender
+        # conditions are collected as candidates for the subject line comparison.
+        candidates = []
         i = 0
         num_msgs = msgs.getNumberOfMsgs()
         while i < num_msgs-1:
             
             # Select the earlier message
-            msg1 = msgs[i]
+            msg1 = msgs1[i]
             
             # If there's no datetime for this message, continue
-            if msg1.Datetime == None:
+            if not msg1.hasDatetime():
                 i += 1
                 continue
             
@@ -155,7 +167,7 @@ class MessageThreadFactory(Borg):
 
                 # If there's no datetime for this message, continue
                 msg2 = msgs2[j]
-                if msg2.Datetime == None:
+                if not msg2.hasDatetime():
                     j += 1
                     continue
 
@@ -164,10 +176,10 @@ class MessageThreadFactory(Borg):
 
                 # If the message time differental exceeds time_delta, advance msg1
                 # and start scanning again.
-                td = msg2.Datetime - msg1.Datetime
+                td = msg2.EpochSecs - msg1.EpochSecs
                 if self._verbose:
-                    print "Time Differential: %s" % str(td)
-                if td > self._time_delta:
+                    print "Time Differential: %s" % str(datetime.timedelta(seconds=td))
+                if td > time_delta_secs:
                     if self._verbose:
                         print "Exceeds time delta threshold!"
                         print
@@ -186,39 +198,53 @@ class MessageThreadFactory(Borg):
                     j += 1
                     continue
                 
-                # Lookup the longest common substring between the message subject lines. 
-                # Compute the LCS if it is not available.
-                pair = [msg1.MessageID,msg2.MessageID]
-                lcs = self._db.getMessagePairLCSubstring(pair,'Subject')[0]
-                if lcs == None:
-                    print "Warning: longest common substring not available in the database."
-                dist = lcs_dist(msg1.Subject,msg2.Subject,lcs)
-                if self._verbose:
-                    print "Distance: %f" % dist
-                    print "Message 1 Subject: %s" % msg1.Subject
-                    print "Message 2 Subject: %s" % msg2.Subject
-                    print "Longest Common Substring: %s" % lcs
-                
-                # Check to see if the distance is above or below threshold
-                if dist > self._thres:
-                    if self._verbose:
-                        print "String distance above threshold!"
-                        print
-                    j += 1
-                    continue
-                    
-                # Add message nodes and an edge between them to the thread graph if we've 
-                # made it this far
+                # The pair is a candidate. Its subject lines are compared once the longest
+                # common substrings of all of the candidates have been fetched. The message
+                # collections reuse their message objects, so the properties are copied.
                 if self._verbose:
-                    print "Match!"
+                    print "Candidate pair!"
                     print
-                tgraph.add_node(msg1.MessageID)
-                tgraph.add_node(msg2.MessageID)
-                tgraph.add_edge(msg2.MessageID,msg1.MessageID)
+                candidates.append(((msg1.MessageID,msg1.Subject),(msg2.MessageID,msg2.Subject)))
                 
                 j += 1
                 
             i += 1
+            
+        # Preload the longest common substrings between the subject lines of the candidate
+        # message pairs with a single bulk lookup
+        pairs = [[mid1,mid2] for (mid1, subject1), (mid2, subject2) in candidates]
+        lcss = self._db.getMessagePairLCSubstrings(pairs,'Subject')
+        
+        for ((mid1, subject1), (mid2, subject2)), lcs in zip(candidates,lcss):
+        
+            # Compute the LCS if it is not available.
+            if lcs == None:
+                print "Warning: longest common substring not available in the database."
+            else:
+                lcs = lcs[0]
+            dist = lcs_dist(subject1,subject2,lcs)
+            if self._verbose:
+                print "Message Pair (%s,%s):" % (mid1,mid2)
+                print "Distance: %f" % dist
+                print "Message 1 Subject: %s" % subject1
+                print "Message 2 Subject: %s" % subject2
+                print "Longest Common Substring: %s" % lcs
+            
+            # Check to see if the distance is above or below threshold
+            if dist > self._thres:
+                if self._verbose:
+                    print "String distance above threshold!"
+                    print
+                continue
+                
+            # Add message nodes and an edge between them to the thread graph if we've 
+            # made it this far
+            if self._verbose:
+                print "Match!"
+                print
+            tgraph.add_node(mid1)
+            tgraph.add_node(mid2)
+            tgraph.add_edge(mid2,mid1)
                 
         # Identify the individual threads by computing the connected components of tgraph
         threads = nx.algorithms.components.connected.connected_component_subgraphs(tgraph)                
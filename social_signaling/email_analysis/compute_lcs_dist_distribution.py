@@ -1,6 +1,6 @@
 import marshal
+from itertools                            import islice
 from social_signaling.db_access           import DB
-from social_signaling.email_analysis      import Message
 from social_signaling.util.string_metrics import *
 
 # Connect to the database
@@ -9,27 +9,31 @@ db = DB.DB()
 db.startRedisServer()
 db.createRedisConnection()
 
-# Get all message pairs for which a longest common substring has been computed
-print "Getting all message pairs with a computed longest common substring."
-mps = db.getAllLCSMessagePairs()
+# Stream the message pairs for which a longest common subject substring has been computed
+print "Getting all message pairs with a computed longest common subject substring."
+mps = db.iterAllLCSMessagePairs('Subject')
 
-# Compute the message pair subject line distances 
+# Compute the message pair subject line distances for up to one million pairs. The subject 
+# lines and substrings are fetched in batches of message pairs.
 print "Compute the message pair subject line distances."
 i = 0
 dlist = []
-msg = Message.Message()
-while i<1000000:
-    mp = mps[i]
-    slist = []
-    for mid in mp:
-        msg.setMessageID(mid)
-        slist.append(msg.Subject)
-    lcs = db.getMessagePairLCSubstring(mp,'Subject')
-    dlist.append(lcs_dist(slist[0],slist[1],lcs[0]))
-    i += 1
+batch_size = 1000
+max_pairs = 1000000
+while i<max_pairs:
+    batch = list(islice(mps,min(batch_size,max_pairs-i)))
+    if len(batch) == 0:
+        break
+    mids = [mid for mp in batch for mid in mp]
+    subjects = dict([(msg['MessageID'],msg['Subject']) for msg in db.getMessages(mids,['Subject'])])
+    lcss = db.getMessagePairLCSubstrings(batch,'Subject')
+    for mp, lcs in zip(batch,lcss):
+        slist = [subjects[mid] for mid in mp]
+        dlist.append(lcs_dist(slist[0],slist[1],lcs[0]))
+        i += 1
 
-    if i % 1000 == 0:
-        print "%d distances computed." % i
+        if i % 1000 == 0:
+            print "%d distances computed." % i
         
 # Save the results
 f = open('subject_line_distances.txt','w')
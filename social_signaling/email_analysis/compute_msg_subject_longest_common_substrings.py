@@ -1,7 +1,7 @@
 import time
+from collections                        import deque
 from datetime                           import timedelta
 from social_signaling.db_access         import DB
-from social_signaling.email_analysis    import CommRelationship, MessageCollection
 from social_signaling.util.suffix_array import *
 
 # Connect to the database
@@ -14,55 +14,61 @@ db.createRedisConnection()
 print "Clearing previous LCS data."
 db.clearMessagePairLCSubstrings()
 
-# Get all of the message ids
-print "Fetching all of the message ids."
-mids = db.getAllMessageIDs()
+# Get all of the message ids in time order from the sorted set of message ids
+print "Fetching the time ordered message ids."
+mids = db.getMessageIDsInTimeRange()
 
-# Define two message collections to iterate through
-print "Creating the message collections."
-mc1 = MessageCollection.MessageCollection(mids)
-mc1.timeOrder()
-mc2 = mc1.copy()
-
-num_msgs = len(mc1)
+num_msgs = len(mids)
 print "Total number of messages: %d" % num_msgs
+
+# Fetch the messages in time order in batches. Each message B is compared with the 
+# earlier messages A in the preceding two day window. The window holds (message, 
+# recipients) tuples in time order. The results are buffered and written in batches.
+window_secs = int(timedelta(days=2).total_seconds())
+window = deque()
+batch_size = 1000
 comparisons = 0
 prev_comparisons = 0
+rate = 0.0
 start = time.clock()
-for i in range(num_msgs-1):
+i = 0
+for k in xrange(0,num_msgs,batch_size):
+    for msgB in db.getMessages(mids[k:k+batch_size],DB.HEADER_FIELDS):
+        i += 1
+
+        # If there's no datetime associated with the message, skip ahead
+        if not msgB.hasDatetime():
+            continue
+
+        # Drop the messages that fall outside the two day window
+        while len(window) > 0 and msgB['EpochSecs'] - window[0][0]['EpochSecs'] > window_secs:
+            window.popleft()
+
+        for msgA, recips in window:
+
+            # If the sender of message B is one of the recipients of message A...
+            if msgB['Sender'] in recips:
+
+                # Compute the longest common substrings between the message subjects
+                lcs = compute_longest_common_substrings([msgA['Subject'],msgB['Subject']])
+                pair = [msgA['MessageID'],msgB['MessageID']]
+                db.bufferMessagePairLCSubstring(pair,'Subject',lcs)
+                comparisons += 1
 
-    msgA = mc1[i]
-    
-    # If there's no datetime associated with the message, skip ahead
-    if msgA.Datetime == None:
-        continue
-    
-    # Recipients of message A
-    recips = msgA.TO
-    recips.extend(msgA.CC)
-    recips.extend(msgA.BCC)
-    
-    # Scan ahead to compare with messages in a two day window
-    j = i+1
-    msgB = mc2[j]
-    while j < num_msgs and msgB.Datetime - msgA.Datetime <= timedelta(days=2):
-    
-        # If the sender of message B is one of the recipients of message A...
-        if msgB.Sender in recips:
-    
-            # Compute the longest common substrings between the message subjects
-            lcs = compute_longest_common_substrings([msgA.Subject,msgB.Subject])
-            pair = [msgA.MessageID,msgB.MessageID]
-            db.setMessagePairLCSubstring(pair,'Subject',lcs)    
-            comparisons += 1
+        # Recipients of message B
+        recips = set(msgB['TO'])
+        recips.update(msgB['CC'])
+        recips.update(msgB['BCC'])
+        window.append((msgB,recips))
 
-        j += 1
-        msgB = mc2[j]
+        if i % 500 == 0:
+            elapsed = time.clock() - start
+            if comparisons > prev_comparisons:
+                rate = elapsed / float(comparisons-prev_comparisons)
+            prev_comparisons = comparisons
+            print "%d messages processed. %d comparisons. %f seconds / comparison." % (i,comparisons,rate)
+            start = time.clock()
 
-    if (i+1) % 500 == 0:
-        elapsed = time.clock() - start
-        if comparisons > prev_comparisons:
-            rate = elapsed / float(comparisons-prev_comparisons)
-        prev_comparisons = comparisons
-        print "%d messages processed. %d comparisons. %f seconds / comparison." % (i+1,comparisons,rate)
-        start = time.clock()
\ No newline at end of file
+# Write the remaining buffered results
+db.flushMessagePairLCSubstrings()
+print "%d messages processed. %d comparisons." % (i,comparisons)
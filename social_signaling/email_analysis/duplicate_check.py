@@ -1,43 +1,52 @@
+import hashlib
 import marshal
+import sys
 from social_signaling.db_access import DB
-from social_signaling.email_analysis import Message
 
 # connect to redis
 db = DB.DB()
 db.startRedisServer()
 db.createRedisConnection()
-r = db.redisDB
 
-# get all of the message strings
-orig_msgs = r.hvals('messages')
+# read the messages from a columnar snapshot if one is given (see enron_data_ingest/build_columnar_snapshot.py)
+# instead of from redis
+if len(sys.argv) > 1:
+    db.openColumnarSnapshot(sys.argv[1])
 
-# remove message_id from the message dictionaries
+# if the ingest indexed the message ids by content digest (see redis_ingest.py), read the
+# sets of duplicate messages from the index
+if len(sys.argv) == 1 and db.redisDB.exists('message_ids_per_digest'):
+    msg_sets = 0
+    for mids in db.iterDuplicateMessageIDs():
+        msg_sets += 1
+    print "%d sets of duplicate messages." % msg_sets
+    sys.exit(0)
+
+# otherwise group the message ids by the message content, i.e. all of the message
+# properties except the message id. the messages are streamed from the database in
+# batches and only a digest of the content of each message is kept.
 i = 0
 dup_dict = {}
-for mstr in orig_msgs:
-    mdict = marshal.loads(mstr)
-    mid = mdict['message_id']
-    del mdict['message_id']
-    mstr = marshal.dumps(mdict)
-    if dup_dict.has_key(mstr):
-        dup_dict[mstr].append(mid)
+for mdict in db.iterAllMessages():
+    mkey = (mdict.hasDatetime(), mdict['EpochSecs'], mdict['Sender'], tuple(mdict['TO']),
+            tuple(mdict['CC']), tuple(mdict['BCC']), mdict['Subject'], mdict['Body'])
+    mkey = hashlib.sha1(marshal.dumps(mkey)).digest()
+    if dup_dict.has_key(mkey):
+        dup_dict[mkey].append(mdict['MessageID'])
     else:
-        dup_dict[mstr] = [mid]
+        dup_dict[mkey] = [mdict['MessageID']]
     i += 1
     if i % 500 == 0:
         print "%d messages processed." % i    
 
 # compare counts    
-print "%d original messages." % len(orig_msgs)
+print "%d original messages." % i
 print "%d unique messages." % len(dup_dict.keys())
 
-# count the sets of message duplicates and print out duplicate messages
-msg = Message.Message()
+# count the sets of message duplicates
 msg_sets = 0
 for mids in dup_dict.values(): 
     if len(mids) > 1:
         msg_sets += 1
-        msg.setMessageID(mids[0])
-        #print msg
 print "%d sets of duplicate messages." % msg_sets
 
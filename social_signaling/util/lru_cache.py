@@ -0,0 +1,83 @@
+from collections import OrderedDict
+
+class LRUCache(object):
+    """Size-bounded key-value cache that evicts the least recently used entry once
+    the maximum size is reached. Hit, miss and eviction counts are kept for reporting.
+    """
+
+    def __init__(self,max_size=10000):
+        self._entries = OrderedDict()
+        self._max_size = max_size
+        self.resetStats()
+
+    def __len__(self):
+        """Returns the number of entries in the cache."""
+        return len(self._entries)
+
+    def __contains__(self,key):
+        """Returns True if key is in the cache. The hit/miss counts are not affected."""
+        return key in self._entries
+
+    def get(self,key,default=None):
+        """Returns the value for key and marks it as most recently used if it is in the
+        cache. Otherwise default is returned."""
+        try:
+            value = self._entries.pop(key)
+        except KeyError:
+            self._misses += 1
+            return default
+        self._entries[key] = value
+        self._hits += 1
+        return value
+
+    def put(self,key,value):
+        """Inserts value for key as the most recently used entry, evicting the least
+        recently used entries if the cache is full."""
+        if self._max_size <= 0:
+            return
+        if key in self._entries:
+            del self._entries[key]
+        self._entries[key] = value
+        self._evict()
+
+    def _evict(self):
+        """Evicts least recently used entries until the cache fits its maximum size."""
+        while len(self._entries) > self._max_size:
+            self._entries.popitem(last=False)
+            self._evictions += 1
+
+    def invalidate(self,keys=None):
+        """Removes the entries for the given keys from the cache. If keys is None, all
+        entries are removed."""
+        if keys == None:
+            self._entries.clear()
+        else:
+            for key in keys:
+                self._entries.pop(key,None)
+
+    def setMaxSize(self,max_size):
+        """Sets the maximum number of entries, evicting entries as needed. A maximum size
+        of zero disables caching."""
+        self._max_size = max_size
+        self._evict()
+
+    def getMaxSize(self):
+        """Returns the maximum number of entries."""
+        return self._max_size
+
+    def resetStats(self):
+        """Resets the hit, miss and eviction counts."""
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    def getStats(self):
+        """Returns a dictionary with the hit, miss and eviction counts, the hit rate and
+        the current and maximum sizes of the cache."""
+        lookups = self._hits + self._misses
+        if lookups > 0:
+            hit_rate = self._hits / float(lookups)
+        else:
+            hit_rate = 0.0
+        return { 'hits' : self._hits, 'misses' : self._misses, 'evictions' : self._evictions,
+                 'hit_rate' : hit_rate, 'size' : len(self._entries), 'max_size' : self._max_size }
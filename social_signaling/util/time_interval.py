@@ -1,4 +1,10 @@
 import datetime
+from bisect   import bisect_left, bisect_right
+from calendar import timegm
+from dateutil import tz
+
+# Time zone of the datetimes derived from epoch secs
+UTC = tz.tzutc()
 
 def valid_time_interval(time_interval):
     """Returns True if the time_interval[0] < time_interval[1] and both are of type 
@@ -15,4 +21,29 @@ def within_time_interval(dt,time_interval):
     if type(dt) == datetime.datetime and time_interval[0] <= dt and dt <= time_interval[1]:
         return True
     else:
-        return False
\ No newline at end of file
+        return False
+
+def datetime_to_epoch_secs(dt):
+    """Returns the number of seconds since the epoch for the datetime dt."""
+    return timegm(dt.utctimetuple())
+    
+def epoch_secs_to_datetime(secs):
+    """Returns a UTC datetime for the given number of seconds since the epoch."""
+    return datetime.datetime.fromtimestamp(secs,UTC)
+    
+def epoch_time_interval(time_interval):
+    """Converts the time interval given as a tuple of datetimes (interval_begin, interval_end)
+    into a tuple of epoch secs."""
+    return (datetime_to_epoch_secs(time_interval[0]),datetime_to_epoch_secs(time_interval[1]))
+    
+def within_epoch_time_interval(secs,epoch_interval):
+    """Returns True if the epoch secs are within the time interval given as a tuple of epoch
+    secs and False otherwise."""
+    return epoch_interval[0] <= secs and secs <= epoch_interval[1]
+
+def epoch_time_interval_slice(sorted_secs,epoch_interval):
+    """Returns the range (start, stop) of the positions in the ascending sequence of epoch
+    secs sorted_secs that are within the time interval given as a tuple of epoch secs. The
+    range is found by bisection."""
+    start = bisect_left(sorted_secs,epoch_interval[0])
+    return start, bisect_right(sorted_secs,epoch_interval[1],start)
@@ -0,0 +1,155 @@
+"""Tests of IngestReader against a small SQLite stand-in for the UC Berkeley Enron database.
+
+Run from the repository root with: python -m unittest discover tests
+"""
+
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+from social_signaling.db_access.ingest_reader import IngestReader, MESSAGE_QUERY, RECIPIENT_QUERY
+
+ADDRESSES = [(1,'kay.mann@enron.com'),(2,'vince.kaminski@enron.com'),(3,'jeff.dasovich@enron.com'),
+             (4,'sara.shackleton@enron.com')]
+
+# (mid, eid, date, timezone, smtpid, subject, body). Message 6 has no sender address.
+MESSAGES = [(1,1,'2001-05-01 09:00:00','-0700 (PDT)','<1.JavaMail@thyme>','gas deal','body 1'),
+            (2,2,'2001-05-01 10:30:00','-0700 (PDT)','<2.JavaMail@thyme>','RE: gas deal','body 2'),
+            (3,3,'2001-05-02 08:15:00','-0500 (CDT)','<3.JavaMail@thyme>','lunch',''),
+            (4,1,'2001-05-02 11:00:00','-0700 (PDT)','<4.JavaMail@thyme>','meeting','body 4'),
+            (5,4,'2001-05-03 16:45:00','-0700 (PDT)','<5.JavaMail@thyme>','FW: meeting','body 5'),
+            (6,9,'2001-05-03 17:00:00','-0700 (PDT)','<6.JavaMail@thyme>','orphan','body 6'),
+            (7,2,'2001-05-04 07:30:00','-0700 (PDT)','<7.JavaMail@thyme>','RE: lunch','body 7'),
+            (8,3,'2001-05-04 12:00:00','-0500 (CDT)','<8.JavaMail@thyme>','schedule','body 8')]
+
+# (mid, eid, reciptype, reciporder). Message 4 has no recipients.
+RECIPIENTS = [(1,2,'to',1),(1,3,'cc',2),(2,1,'to',1),(3,1,'to',1),(3,2,'to',2),(3,4,'bcc',3),
+              (5,1,'to',1),(6,1,'to',1),(7,3,'to',1),(7,4,'cc',2),(8,1,'to',1),(8,2,'to',2)]
+
+def make_database(path):
+    """Writes the msgs, addresses and recip_info tables to a SQLite database at path."""
+    conn = sqlite3.connect(path)
+    conn.execute("create table addresses (eid integer, email text);")
+    conn.execute("create table msgs (mid integer, eid integer, date text, timezone text, "
+                 "smtpid text, subject text, body text);")
+    conn.execute("create table recip_info (mid integer, eid integer, reciptype text, reciporder integer);")
+    conn.executemany("insert into addresses values (?,?);",ADDRESSES)
+    conn.executemany("insert into msgs values (?,?,?,?,?,?,?);",MESSAGES)
+    conn.executemany("insert into recip_info values (?,?,?,?);",RECIPIENTS)
+    conn.commit()
+    conn.close()
+
+class RecordingCursor(object):
+    """DB-API cursor wrapper recording the sizes of the batches returned by fetchmany."""
+
+    def __init__(self,cursor,batches):
+        self._cursor = cursor
+        self._batches = batches
+
+    def execute(self,query):
+        return self._cursor.execute(query)
+
+    def fetchmany(self,size):
+        rows = self._cursor.fetchmany(size)
+        self._batches.append(len(rows))
+        return rows
+
+    def close(self):
+        self._cursor.close()
+
+class RecordingConnection(object):
+    """DB-API connection wrapper handing out RecordingCursors."""
+
+    def __init__(self,conn,batches):
+        self._conn = conn
+        self._batches = batches
+
+    def cursor(self):
+        return RecordingCursor(self._conn.cursor(),self._batches)
+
+    def close(self):
+        self._conn.close()
+
+class IngestReaderTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir,'berkeley_enron.db')
+        make_database(self.path)
+        self.batches = []
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def connect(self):
+        return RecordingConnection(sqlite3.connect(self.path),self.batches)
+
+    def fetchall(self,query):
+        conn = sqlite3.connect(self.path)
+        try:
+            return conn.execute(query).fetchall()
+        finally:
+            conn.close()
+
+    def expected_messages(self,clause=''):
+        """Returns the (key, message row, recipient rows) tuples built from fetchall."""
+        recips = {}
+        for row in self.fetchall(RECIPIENT_QUERY % clause):
+            recips.setdefault(row[0],[]).append(row[1:])
+        return [(row[0],row[1:],recips.get(row[0],[])) for row in self.fetchall(MESSAGE_QUERY % clause)]
+
+    def test_rows_match_fetchall(self):
+        query = MESSAGE_QUERY % ''
+        expected = self.fetchall(query)
+        for chunk_size in [1,2,3,len(expected),len(expected)+1,1000]:
+            del self.batches[:]
+            reader = IngestReader(self.connect,chunk_size)
+            self.assertEqual(list(reader.rows(query)),expected)
+
+            # full chunks, then the remainder, then an empty fetch ending the stream
+            n = len(expected)
+            sizes = [chunk_size] * (n // chunk_size)
+            if n % chunk_size:
+                sizes.append(n % chunk_size)
+            self.assertEqual(self.batches,sizes + [0])
+
+    def test_keyed_messages_match_fetchall(self):
+        expected = self.expected_messages()
+        self.assertEqual([key for key, msg, recips in expected],[1,2,3,4,5,7,8])
+        for chunk_size in [1,2,3,1000]:
+            reader = IngestReader(self.connect,chunk_size)
+            self.assertEqual(list(reader.keyed_messages()),expected)
+            self.assertEqual(list(reader.messages()),[(msg, recips) for key, msg, recips in expected])
+
+    def test_messages_without_recipients(self):
+        msgs = dict([(key, recips) for key, msg, recips in IngestReader(self.connect,2).keyed_messages()])
+        self.assertEqual(msgs[4],[])
+        self.assertEqual(msgs[3],[('<3.JavaMail@thyme>','to',1,'kay.mann@enron.com'),
+                                  ('<3.JavaMail@thyme>','to',2,'vince.kaminski@enron.com'),
+                                  ('<3.JavaMail@thyme>','bcc',3,'sara.shackleton@enron.com')])
+
+    def test_partitions(self):
+        expected = self.expected_messages()
+        reader = IngestReader(self.connect,2)
+        num_partitions = 3
+        seen = []
+        for partition in xrange(num_partitions):
+            msgs = list(reader.partition_reader(partition,num_partitions).keyed_messages())
+            for key, msg, recips in msgs:
+                self.assertEqual(key % num_partitions,partition)
+            seen.extend(msgs)
+        self.assertEqual(sorted(seen),expected)
+
+    def test_start_after(self):
+        expected = self.expected_messages()
+        for start_after in [0,3,5,8]:
+            reader = IngestReader(self.connect,2,start_after=start_after)
+            self.assertEqual(list(reader.keyed_messages()),
+                             [m for m in expected if m[0] > start_after])
+
+    def test_count_messages(self):
+        self.assertEqual(IngestReader(self.connect).count_messages(),7)
+
+if __name__ == '__main__':
+    unittest.main()
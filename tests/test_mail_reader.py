@@ -0,0 +1,78 @@
+"""Tests of MailReader against the small mail tree in fixtures/mail: an mbox file with two
+messages and a maildir-like tree of single-message files, one of which has no Message-ID.
+
+Run from the repository root with: python -m unittest discover tests
+"""
+
+import os
+import unittest
+from datetime import datetime
+from social_signaling.db_access.mail_reader import MailReader
+
+MAIL_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),'fixtures','mail')
+
+# The files in the order MailReader visits them
+FILES = ['vince.kaminski.mbox','kay.mann/inbox/1.','kay.mann/inbox/2.','kay.mann/sent/1.']
+
+# The rows of the messages in key order. The message in kay.mann/inbox/2. is skipped.
+MESSAGES = [
+    (('vince.kaminski@enron.com',datetime(2001,5,1,9,0,0),'-0700','<101.JavaMail.evans@thyme>','gas deal',
+      'Kay,\n\nPlease review the gas deal terms.\n\nVince\n'),
+     [('<101.JavaMail.evans@thyme>','to',0,'kay.mann@enron.com'),
+      ('<101.JavaMail.evans@thyme>','to',1,'jeff.dasovich@enron.com')]),
+    (('vince.kaminski@enron.com',datetime(2001,5,2,14,30,0),'-0500','<102.JavaMail.evans@thyme>','RE: lunch',
+      'Noon works.'),
+     [('<102.JavaMail.evans@thyme>','to',0,'sara.shackleton@enron.com'),
+      ('<102.JavaMail.evans@thyme>','cc',0,'kay.mann@enron.com')]),
+    (('jeff.dasovich@enron.com',datetime(2001,5,3,8,15,0),'-0700','<201.JavaMail.evans@thyme>','meeting',
+      'See you at the meeting.\n'),
+     [('<201.JavaMail.evans@thyme>','to',0,'kay.mann@enron.com'),
+      ('<201.JavaMail.evans@thyme>','cc',0,'vince.kaminski@enron.com'),
+      ('<201.JavaMail.evans@thyme>','cc',1,'sara.shackleton@enron.com')]),
+    (('kay.mann@enron.com',None,None,'<301.JavaMail.evans@thyme>','FW: gas deal','Forwarding the terms.\n'),
+     [('<301.JavaMail.evans@thyme>','to',0,'vince.kaminski@enron.com'),
+      ('<301.JavaMail.evans@thyme>','bcc',0,'jeff.dasovich@enron.com')])]
+
+class MailReaderTest(unittest.TestCase):
+
+    def test_files(self):
+        self.assertEqual(MailReader(MAIL_PATH).files(),[os.path.join(MAIL_PATH,path) for path in FILES])
+
+    def test_messages(self):
+        reader = MailReader(MAIL_PATH)
+        self.assertEqual(list(reader.messages()),MESSAGES)
+        self.assertEqual([key for key, msg, recips in reader.keyed_messages()],[1,2,3,4])
+
+    def test_single_mbox_file(self):
+        reader = MailReader(os.path.join(MAIL_PATH,'vince.kaminski.mbox'))
+        self.assertEqual(list(reader.messages()),MESSAGES[:2])
+
+    def test_count_messages(self):
+        self.assertEqual(MailReader(MAIL_PATH).count_messages(),5)
+
+    def test_partitions(self):
+        reader = MailReader(MAIL_PATH)
+        num_partitions = 2
+        files = []
+        msgs = []
+        for partition in xrange(num_partitions):
+            partition_reader = reader.partition_reader(partition,num_partitions)
+            files.extend(partition_reader.files())
+            keyed = list(partition_reader.keyed_messages())
+            self.assertEqual([key for key, msg, recips in keyed],range(1,len(keyed)+1))
+            msgs.extend([(msg, recips) for key, msg, recips in keyed])
+        self.assertEqual(sorted(files),sorted(reader.files()))
+        self.assertEqual(sorted(msgs),sorted(MESSAGES))
+
+        # the files are dealt out in order, so the first partition holds the mbox file
+        self.assertEqual(list(reader.partition_reader(0,2).messages()),MESSAGES[:2])
+
+    def test_start_after(self):
+        for start_after in [0,1,3,4]:
+            reader = MailReader(MAIL_PATH,start_after=start_after)
+            self.assertEqual(list(reader.messages()),MESSAGES[start_after:])
+        reader = MailReader(MAIL_PATH).partition_reader(1,2,start_after=1)
+        self.assertEqual(list(reader.keyed_messages()),[(2,)+MESSAGES[3]])
+
+if __name__ == '__main__':
+    unittest.main()